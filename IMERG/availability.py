@@ -0,0 +1,180 @@
+"""
+availability.py: Contains the class 'Availability' which records which half-hourly bands of the IMERG tile database hold
+data.
+
+The availability is kept by the ingestion pipeline as a list of runs of consecutive ingested bands and stored in the
+metadata of the IMERG tile database, so it is loaded together with the shared handle instead of listing the granule
+directory on every request. Checking a date range against it takes a bounds check and a binary search over the gaps.
+Tile databases ingested before the availability existed get one with: python -m IMERG.ingest <hdf5 directory> <uri>
+--rebuild-availability
+"""
+
+__author__ = "Tim Rietdijk"
+__email__ = "tim.is@live.nl"
+__status__ = "Development"
+
+# third-party imports:
+import numpy as np
+import tiledb
+
+# local imports:
+from date_range import DateRange
+from exceptions import DateRangeOutOfBounds
+from IMERG.time_axis import IMERG_TIME_AXIS
+
+AVAILABILITY_KEY = 'available'
+
+
+class Availability:
+    def __init__(self, runs: np.ndarray) -> None:
+        """
+        The bands of the IMERG tile database that hold data, as sorted, non-overlapping runs of consecutive bands.
+
+        :param runs: Array (runs x 2) containing the first band and the band after the last band of every run.
+        """
+        self.runs = np.asarray(runs, dtype=np.int64).reshape(-1, 2)
+
+    @classmethod
+    def from_bands(cls, bands: list[int] | np.ndarray) -> 'Availability':
+        """
+        Creates the availability of a set of bands.
+
+        :param bands: The bands that hold data, in any order.
+        :return: Availability of the bands.
+        """
+        bands = np.unique(np.asarray(bands, dtype=np.int64))
+        if not len(bands):
+            return cls(np.empty((0, 2), dtype=np.int64))
+        breaks = np.flatnonzero(np.diff(bands) > 1) + 1
+        return cls(np.stack([bands[np.r_[0, breaks]], bands[np.r_[breaks - 1, len(bands) - 1]] + 1], axis=1))
+
+    @classmethod
+    def from_meta(cls, meta: tiledb.Metadata) -> 'Availability | None':
+        """
+        Loads the availability from the metadata of a tile database.
+
+        :param meta: Metadata of the opened tile database.
+        :return: The stored availability, or None if the tile database doesn't have one.
+        """
+        if AVAILABILITY_KEY not in meta:
+            return None
+        # Copied, the metadata buffer is freed when the tile database is closed.
+        return cls(np.array(meta[AVAILABILITY_KEY], dtype=np.int64))
+
+    def write(self, uri: str, ctx: tiledb.Ctx) -> None:
+        """
+        Stores the availability in the metadata of a tile database.
+
+        :param uri: Location of the tile database.
+        :param ctx: TileDB context containing the (S3) VFS options.
+        :return: None
+        """
+        with tiledb.open(uri, 'w', ctx=ctx) as array:
+            array.meta[AVAILABILITY_KEY] = self.runs.ravel() if len(self.runs) else np.zeros(0, dtype=np.int64)
+
+    def merge(self, bands: list[int] | np.ndarray) -> 'Availability':
+        """
+        Adds newly ingested bands.
+
+        :param bands: The bands that were added.
+        :return: Availability containing both the existing runs and the added bands.
+        """
+        added = Availability.from_bands(bands).runs
+        runs = np.concatenate([self.runs, added])
+        runs = runs[np.argsort(runs[:, 0], kind='stable')]
+        merged = []
+        for start, stop in runs:
+            if merged and start <= merged[-1][1]:
+                merged[-1][1] = max(merged[-1][1], stop)
+            else:
+                merged.append([start, stop])
+        return Availability(np.array(merged, dtype=np.int64))
+
+    @property
+    def first(self) -> int | None:
+        return int(self.runs[0, 0]) if len(self.runs) else None
+
+    @property
+    def last(self) -> int | None:
+        return int(self.runs[-1, 1]) - 1 if len(self.runs) else None
+
+    @property
+    def gaps(self) -> np.ndarray:
+        """
+        Returns the runs of missing bands between the first and the last available band.
+
+        :return: Array (gaps x 2) containing the first missing band and the next available band of every gap.
+        """
+        return np.stack([self.runs[:-1, 1], self.runs[1:, 0]], axis=1)
+
+    def missing(self, band_slice: slice) -> np.ndarray:
+        """
+        Returns the gaps that overlap a slice of bands, clipped to the slice.
+
+        :param band_slice: Bands that will be read.
+        :return: Array (gaps x 2) containing the first and the band after the last missing band of every gap.
+        """
+        gaps = self.gaps
+        first = np.searchsorted(gaps[:, 1], band_slice.start, side='right')
+        last = np.searchsorted(gaps[:, 0], band_slice.stop, side='left')
+        return np.clip(gaps[first:last], band_slice.start, band_slice.stop)
+
+    def contains(self, band_slice: slice) -> bool:
+        """
+        Checks whether a slice of bands lies within the first and the last available band.
+
+        :param band_slice: Bands that will be read.
+        :return: Boolean representing whether the bands are within the availability.
+        """
+        return self.first is not None and self.first <= band_slice.start and band_slice.stop - 1 <= self.last
+
+    def check(self, date_range: DateRange) -> None:
+        """
+        Checks that the date range lies within the available bands and doesn't fall entirely within a gap. Bands of a
+        gap that is only partly requested read as missing values.
+
+        :param date_range: The date range of which the user wants the historic precipitation.
+        :return: None
+        """
+        requested = f"{date_range.min_date_str}/{date_range.max_date_str}"
+        first_date = IMERG_TIME_AXIS.timestamp(self.first) if self.first is not None else None
+        last_date = IMERG_TIME_AXIS.timestamp(self.last) if self.last is not None else None
+        if first_date is None or not date_range.is_valid(first_date, last_date):
+            raise DateRangeOutOfBounds(requested, first_date, last_date)
+        band_slice = IMERG_TIME_AXIS.slice(date_range)
+        missing = self.missing(band_slice)
+        if len(missing) == 1 and missing[0, 0] == band_slice.start and missing[0, 1] == band_slice.stop:
+            raise DateRangeOutOfBounds(requested, first_date, last_date)
+
+    def coverage(self, band_slice: slice | None = None) -> dict[str, str | int | list[list[str]]]:
+        """
+        Describes the available bands for the API.
+
+        :param band_slice: (optional) Only report the gaps that overlap these bands.
+        :return: Dictionary containing the first and last available timestamp, the number of available bands and the
+        first and last missing timestamp of every gap.
+        """
+        if self.first is None:
+            return {'first': None, 'last': None, 'bands': 0, 'gaps': []}
+        gaps = self.gaps if band_slice is None else self.missing(band_slice)
+        return {'first': str(IMERG_TIME_AXIS.timestamp(self.first)), 'last': str(IMERG_TIME_AXIS.timestamp(self.last)),
+                'bands': int((self.runs[:, 1] - self.runs[:, 0]).sum()),
+                'gaps': [[str(IMERG_TIME_AXIS.timestamp(int(start))), str(IMERG_TIME_AXIS.timestamp(int(stop) - 1))]
+                         for start, stop in gaps]}
+
+
+def update_availability(uri: str, ctx: tiledb.Ctx, bands: list[int]) -> Availability:
+    """
+    Adds newly ingested bands to the availability stored in a tile database.
+
+    :param uri: Location of the tile database.
+    :param ctx: TileDB context containing the (S3) VFS options.
+    :param bands: The bands that were ingested.
+    :return: The updated availability.
+    """
+    with tiledb.open(uri, ctx=ctx) as array:
+        availability = Availability.from_meta(array.meta) or Availability.from_bands([])
+    availability = availability.merge(bands)
+    availability.write(uri, ctx)
+    return availability
+
@@ -0,0 +1,229 @@
+"""
+benchmark.py: Contains the benchmark suite that times IMERG reads against a synthetic, local IMERG tile database.
+
+The suite generates an IMERG-shaped tile database (same grid, temporal axis and attribute) with configurable tiling and
+data type, filled with synthetic precipitation, so layouts, caches and storage formats can be compared without access
+to S3. Every case reads through the same functions and readers the endpoints use. The timings are written as JSON.
+
+Usage: python -m IMERG.benchmark /tmp/imerg_benchmark --days 30 --space-tile 100 --dtype float32 --output results.json
+"""
+
+__author__ = "Tim Rietdijk"
+__email__ = "tim.is@live.nl"
+__status__ = "Development"
+
+# standard imports:
+import argparse
+import json
+import os
+import platform
+import shutil
+import statistics
+import time
+from datetime import datetime
+from typing import Callable
+
+# third-party imports:
+import numpy as np
+import shapely
+import tiledb
+from geopandas import GeoSeries
+
+# local imports:
+from date_range import DateRange
+from IMERG.block_cache import BlockCache
+from IMERG.dataset import ImergDataset, ImergLayouts
+from IMERG.grid_index import IMERG_GRID
+from IMERG.imerg_api import IMERG_ATTRIBUTE, get_multi_point_precipitation, get_point_precipitation, \
+    get_polygon_precipitation
+from IMERG.ingest import create_imerg_array
+from IMERG.parallel import ImergScheduler
+from IMERG.rollups import DAILY, HOURLY, ROLLUPS, Rollup, aggregation_reader, rollup_uri, update_rollups
+from IMERG.time_axis import IMERG_EPOCH
+from IMERG.time_series_layout import copy_to_time_series_array, create_time_series_array
+
+NORWAY = (4, 57.9, 31.5, 71.3)
+
+
+def create_synthetic_array(uri: str, ctx: tiledb.Ctx, days: int, bounds: tuple[float, float, float, float],
+                           time_tile: int, space_tile: int, dtype: np.dtype, seed: int = 0) -> slice:
+    """
+    Creates an IMERG tile database filled with synthetic precipitation within the bounds, for the given number of days
+    from the IMERG epoch. Like the real data most values are zero, the rest follows a gamma distribution and a few
+    percent is missing.
+
+    :param uri: Location of the synthetic tile database, replaced if it exists.
+    :param ctx: TileDB context.
+    :param days: Number of days of half-hourly bands.
+    :param bounds: tuple containing minx, miny, maxx, maxy (EPSG:4326) of the area that is filled.
+    :param time_tile: Number of bands per tile.
+    :param space_tile: Number of rows and columns per tile.
+    :param dtype: Data type of the precipitation attribute.
+    :param seed: Seed of the random generator.
+    :return: Slice of the bands that were written.
+    """
+    if os.path.exists(uri):
+        shutil.rmtree(uri)
+    create_imerg_array(uri, ctx, time_tile=time_tile, space_tile=space_tile, dtype=dtype)
+    row_slice, col_slice = IMERG_GRID.slices(bounds)
+    shape = (row_slice.stop - row_slice.start, col_slice.stop - col_slice.start)
+    rng = np.random.default_rng(seed)
+    bands = slice(0, days * 48)
+    with tiledb.open(uri, 'w', ctx=ctx) as array:
+        for band in range(bands.start, bands.stop, time_tile):
+            stop = min(band + time_tile, bands.stop)
+            values = rng.gamma(0.3, 2, (stop - band, *shape)) * (rng.random((stop - band, *shape)) < 0.15)
+            values[rng.random(values.shape) < 0.01] = np.nan
+            array[band:stop, row_slice, col_slice] = {IMERG_ATTRIBUTE: values.astype(dtype)}
+    return bands
+
+
+def date_range_of(days: int, offset: int = 0) -> DateRange:
+    """
+    Returns the date range of a number of whole days after the IMERG epoch.
+
+    :param days: Number of days.
+    :param offset: Number of days between the IMERG epoch and the start of the date range.
+    :return: The date range.
+    """
+    first = IMERG_EPOCH.astype('M8[D]') + np.timedelta64(offset, 'D')
+    return DateRange(f"{first}/{first + np.timedelta64(days - 1, 'D')}")
+
+
+def time_case(run: Callable[[], np.ndarray], repeat: int) -> dict[str, float | list[float]]:
+    """
+    Times a benchmark case. The first run is reported separately, it includes opening tiles and filling caches.
+
+    :param run: Function reading and reducing the data of the case.
+    :param repeat: Number of timed runs after the first run.
+    :return: Dictionary containing the timings in seconds.
+    """
+    timings = []
+    for _ in range(repeat + 1):
+        start_time = time.perf_counter()
+        run()
+        timings.append(time.perf_counter() - start_time)
+    warm = timings[1:] or timings
+    return {'first': timings[0], 'min': min(warm), 'median': statistics.median(warm), 'mean': statistics.mean(warm),
+            'runs': timings}
+
+
+def run_benchmark(days: int, bounds: tuple[float, float, float, float], repeat: int, layouts: ImergLayouts,
+                  rollups: dict[str, ImergDataset], scheduler: ImergScheduler | None,
+                  n_points: int = 100, seed: int = 1) -> dict[str, dict]:
+    """
+    Times point, polygon, multi-point and long-range reads of the synthetic tile database through the readers and
+    functions of the endpoints.
+
+    :param days: Number of days stored in the synthetic tile database.
+    :param bounds: Area filled with synthetic data.
+    :param repeat: Number of timed runs per case.
+    :param layouts: The layouts the endpoints read from.
+    :param rollups: The rollups the endpoints read from.
+    :param scheduler: (optional) Scheduler used for parallel reads.
+    :param n_points: Number of points of the multi-point case.
+    :param seed: Seed of the random locations.
+    :return: Dictionary containing the timings of every case.
+    """
+    rng = np.random.default_rng(seed)
+    minx, miny, maxx, maxy = bounds
+    lons, lats = rng.uniform(minx, maxx, n_points), rng.uniform(miny, maxy, n_points)
+    rows, cols = IMERG_GRID.cell(lons, lats)
+    row, col = int(rows[0]), int(cols[0])
+    polygon = GeoSeries([shapely.box(lons[0], lats[0], lons[0] + 1, lats[0] + 0.5)], crs=4326)
+    week, month, everything = date_range_of(min(7, days)), date_range_of(min(30, days)), date_range_of(days)
+
+    def point(date_range: DateRange, aggregation: Rollup = HOURLY) -> Callable[[], np.ndarray]:
+        def run() -> np.ndarray:
+            with aggregation_reader(layouts, rollups, aggregation, date_range, slice(row, row + 1),
+                                    slice(col, col + 1)) as (array, source):
+                return get_point_precipitation(array, row, col, date_range, source, aggregation, scheduler)
+        return run
+
+    def polygon_case(date_range: DateRange, aggregation: Rollup = HOURLY) -> Callable[[], np.ndarray]:
+        def run() -> np.ndarray:
+            with aggregation_reader(layouts, rollups, aggregation, date_range,
+                                    *IMERG_GRID.slices(polygon.total_bounds)) as (array, source):
+                return get_polygon_precipitation(array, polygon, date_range, source, aggregation, scheduler)
+        return run
+
+    def multi_point(date_range: DateRange) -> Callable[[], np.ndarray]:
+        def run() -> np.ndarray:
+            with aggregation_reader(layouts, rollups, HOURLY, date_range,
+                                    slice(int(rows.min()), int(rows.max()) + 1),
+                                    slice(int(cols.min()), int(cols.max()) + 1)) as (array, source):
+                return get_multi_point_precipitation(array, rows, cols, date_range, source, HOURLY)
+        return run
+
+    cases = {'point_week': point(week), 'point_month': point(month), 'point_all': point(everything),
+             'point_all_daily': point(everything, DAILY), 'polygon_month': polygon_case(month),
+             'polygon_all': polygon_case(everything), 'polygon_all_daily': polygon_case(everything, DAILY),
+             f'multi_point_{n_points}_month': multi_point(month)}
+    return {name: time_case(run, repeat) for name, run in cases.items()}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmark IMERG reads against a synthetic local tile database.")
+    parser.add_argument('directory', help="Directory the synthetic tile databases are written to")
+    parser.add_argument('--days', type=int, default=30, help="Number of days of synthetic data (default: 30)")
+    parser.add_argument('--bounds', nargs=4, type=float, default=NORWAY,
+                        metavar=('MINX', 'MINY', 'MAXX', 'MAXY'), help="Area of synthetic data (default: Norway)")
+    parser.add_argument('--time-tile', type=int, default=48)
+    parser.add_argument('--space-tile', type=int, default=100)
+    parser.add_argument('--dtype', choices=('float32', 'float64'), default='float32')
+    parser.add_argument('--time-series', action='store_true', help="Add a time-series layout")
+    parser.add_argument('--rollups', action='store_true', help="Build the hourly, daily and monthly rollups")
+    parser.add_argument('--cache-bytes', type=int, default=0, help="Size of the block cache (default: no cache)")
+    parser.add_argument('--dask', action='store_true', help="Read point and polygon cases in parallel")
+    parser.add_argument('--reuse', action='store_true', help="Reuse the synthetic tile databases of a previous run")
+    parser.add_argument('--repeat', type=int, default=5, help="Number of timed runs per case (default: 5)")
+    parser.add_argument('--output', default='benchmark.json', help="File the results are written to")
+    args = parser.parse_args()
+
+    context = tiledb.Ctx()
+    source_uri = os.path.join(args.directory, 'imerg')
+    time_series_uri = os.path.join(args.directory, 'imerg_time_series')
+    row_slice, col_slice = IMERG_GRID.slices(args.bounds)
+    setup_time = time.time()
+    if not (args.reuse and tiledb.array_exists(source_uri)):
+        band_slice = create_synthetic_array(source_uri, context, args.days, args.bounds, args.time_tile,
+                                            args.space_tile, np.dtype(args.dtype))
+        for uri in [time_series_uri, *(rollup_uri(source_uri, rollup) for rollup in ROLLUPS.values())]:
+            shutil.rmtree(uri, ignore_errors=True)
+        if args.time_series:
+            create_time_series_array(source_uri, time_series_uri, context, row_slice, col_slice)
+            copy_to_time_series_array(source_uri, time_series_uri, context, band_slice)
+        if args.rollups:
+            update_rollups(source_uri, context, band_slice, row_slice, col_slice)
+    setup_time = time.time() - setup_time
+
+    cache = BlockCache(args.cache_bytes) if args.cache_bytes else None
+    datasets = [ImergDataset(source_uri, context.config(), cache=cache)]
+    if args.time_series:
+        datasets.append(ImergDataset(time_series_uri, context.config(), cache=cache))
+    imerg_layouts = ImergLayouts(*datasets)
+    imerg_rollups = {rollup.name: ImergDataset(rollup_uri(source_uri, rollup), context.config(), cache=cache)
+                     for rollup in ROLLUPS.values()} if args.rollups else {}
+    imerg_scheduler = ImergScheduler() if args.dask else None
+    imerg_layouts.start()
+    for dataset in imerg_rollups.values():
+        dataset.start()
+    try:
+        results = run_benchmark(args.days, args.bounds, args.repeat, imerg_layouts, imerg_rollups, imerg_scheduler)
+    finally:
+        imerg_layouts.close()
+        for dataset in imerg_rollups.values():
+            dataset.close()
+        if imerg_scheduler is not None:
+            imerg_scheduler.close()
+
+    report = {'created': datetime.now().isoformat(timespec='seconds'), 'machine': platform.platform(),
+              'python': platform.python_version(), 'tiledb': tiledb.__version__,
+              'config': {key: value for key, value in vars(args).items() if key != 'output'},
+              'setup_seconds': setup_time, 'bytes': tiledb.VFS(ctx=context).dir_size(source_uri),
+              'cache': cache.stats() if cache is not None else None, 'cases': results}
+    with open(args.output, 'w') as file:
+        json.dump(report, file, indent=2)
+    for name, timing in results.items():
+        print(f"{name:<28} first {timing['first']:.4f}s  median {timing['median']:.4f}s")
+    print(f"Results written to {args.output}")
@@ -0,0 +1,214 @@
+"""
+block_cache.py: Contains the class 'BlockCache' which keeps recently read tiles of the IMERG tile databases in memory.
+
+Dashboards keep requesting the same catchments and recent months. Every read is split on the tiles of the tile database,
+tiles that were read before are served from memory (or local disk) and only the missing tiles are fetched, so warm
+requests don't reach object storage at all. The cache is bounded in bytes and evicts the least recently used tiles
+first.
+"""
+
+__author__ = "Tim Rietdijk"
+__email__ = "tim.is@live.nl"
+__status__ = "Development"
+
+# standard imports:
+import itertools
+import threading
+from collections import OrderedDict
+from typing import Any
+
+# third-party imports:
+import numpy as np
+import tiledb
+
+# local imports:
+from IMERG.disk_cache import DiskBlockCache
+
+
+class BlockCache:
+    def __init__(self, max_bytes: int, max_request_fraction: float = 0.25, disk: DiskBlockCache | None = None,
+                 prefetch_tiles: int = 0) -> None:
+        """
+        A least-recently-used cache of whole tiles, keyed on the tile database, the version of the tile and the index
+        of the tile along every dimension. Reads that touch more than max_request_fraction of the memory cache bypass
+        memory, so a single long series can't flush the tiles every other request is using. With a disk cache, tiles
+        evicted from memory are still served from local disk, and reads too large for memory still go through the
+        disk cache as long as they fit in max_request_fraction of it.
+
+        :param max_bytes: Maximum number of bytes of tiles kept in memory.
+        :param max_request_fraction: Largest fraction of the cache a single read may fill.
+        :param disk: (optional) Persistent cache on local disk behind the memory cache.
+        :param prefetch_tiles: Number of neighbouring time tiles fetched along with every missing run of tiles.
+        """
+        self.max_bytes = max_bytes
+        self.max_request_fraction = max_request_fraction
+        self.disk = disk
+        self.prefetch_tiles = prefetch_tiles
+        self._blocks: OrderedDict[tuple, np.ndarray] = OrderedDict()
+        self._lock = threading.Lock()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.bypasses = 0
+        self.prefetched = 0
+
+    def stats(self) -> dict[str, int | float | dict[str, int]]:
+        """
+        Returns the counters of the cache, used to tune its size.
+
+        :return: Dictionary containing the size, hit, miss, eviction, bypass and prefetch counters, the hit rate and the
+        counters of the disk cache.
+        """
+        with self._lock:
+            lookups = self.hits + self.misses
+            stats = {'max_bytes': self.max_bytes, 'bytes': self.bytes, 'blocks': len(self._blocks), 'hits': self.hits,
+                     'misses': self.misses, 'evictions': self.evictions, 'bypasses': self.bypasses,
+                     'prefetched': self.prefetched, 'hit_rate': self.hits / lookups if lookups else 0.0}
+        if self.disk is not None:
+            stats['disk'] = self.disk.stats()
+        return stats
+
+    def clear(self) -> None:
+        with self._lock:
+            self._blocks.clear()
+            self.bytes = 0
+
+    def _get(self, key: tuple, to_memory: bool = True) -> np.ndarray | None:
+        with self._lock:
+            block = self._blocks.get(key)
+            if block is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+                self._blocks.move_to_end(key)
+        if block is None and self.disk is not None:
+            block = self.disk.get(key)
+            if block is not None and to_memory:
+                self._put(key, block, to_disk=False)
+        return block
+
+    def _contains(self, key: tuple) -> bool:
+        with self._lock:
+            if key in self._blocks:
+                return True
+        return self.disk is not None and self.disk.contains(key)
+
+    def _put(self, key: tuple, block: np.ndarray, to_disk: bool = True, to_memory: bool = True) -> None:
+        if to_disk and self.disk is not None:
+            self.disk.put(key, block)
+        if not to_memory or block.nbytes > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._blocks:
+                return
+            self._blocks[key] = block
+            self.bytes += block.nbytes
+            while self.bytes > self.max_bytes:
+                _, evicted = self._blocks.popitem(last=False)
+                self.bytes -= evicted.nbytes
+                self.evictions += 1
+
+    def read(self, array: tiledb.DenseArray, subarray: tuple[slice, ...],
+             fragments: list[tuple[int, int, int]] | None = None) -> np.ndarray:
+        """
+        Reads the subarray from the cached tiles of the tile database. Missing tiles are fetched whole, consecutive
+        missing tiles along the first dimension in a single query, and added to the cache. Every tile is versioned by
+        the newest fragment that wrote to its bands, so appending new bands doesn't invalidate the tiles before them.
+        Without fragments the tiles are versioned by the snapshot the tile database was opened at.
+
+        :param array: Opened tile database.
+        :param subarray: Slice for every dimension of the tile database.
+        :param fragments: (optional) First band, last band and write timestamp of every fragment of the tile database.
+        :return: Array containing the values of the first attribute within the subarray.
+        """
+        attr = array.schema.attr(0)
+        dims = list(array.schema.domain)
+        starts = [int(dim.domain[0]) for dim in dims]
+        ends = [int(dim.domain[1]) + 1 for dim in dims]
+        tiles = [int(dim.tile) for dim in dims]
+        tile_ranges = [range((s.start - start) // tile, (s.stop - 1 - start) // tile + 1)
+                       for s, start, tile in zip(subarray, starts, tiles)]
+
+        def extent(dim: int, first: int, last: int) -> slice:
+            return slice(starts[dim] + first * tiles[dim], min(starts[dim] + (last + 1) * tiles[dim], ends[dim]))
+
+        def key(time: int, spatial: tuple[int, ...]) -> tuple:
+            if fragments is None:
+                return array.uri, array.timestamp_range, time, *spatial
+            bands = extent(0, time, time)
+            version = max((timestamp for first, last, timestamp in fragments
+                           if first < bands.stop and last >= bands.start), default=0)
+            return array.uri, version, time, *spatial
+
+        # Every tier is only used for reads that fit in its share of the cache: a long read that is too large for
+        # memory still goes through the (larger) disk cache, but doesn't flush the tiles held in memory.
+        request_bytes = np.prod([len(r) for r in tile_ranges]) * int(np.prod(tiles)) * attr.dtype.itemsize
+        to_memory = request_bytes <= self.max_bytes * self.max_request_fraction
+        to_disk = self.disk is not None and request_bytes <= self.disk.max_bytes * self.max_request_fraction
+        if not to_memory and not to_disk:
+            with self._lock:
+                self.bypasses += 1
+            return array[subarray][attr.name]
+
+        n_time_tiles = -(-(ends[0] - starts[0]) // tiles[0])
+        out = np.empty([s.stop - s.start for s in subarray], dtype=attr.dtype)
+        for spatial in itertools.product(*tile_ranges[1:]):
+            spatial_extent = [extent(dim, index, index) for dim, index in enumerate(spatial, start=1)]
+            blocks = {time: self._get(key(time, spatial), to_memory) for time in tile_ranges[0]}
+            missing = [time for time, block in blocks.items() if block is None]
+            # Consecutive missing time tiles of the same spatial tile are fetched in one query. The query is extended
+            # with neighbouring tiles that aren't cached yet, which costs hardly anything on top of the round trip.
+            for _, run in itertools.groupby(enumerate(missing), key=lambda item: item[1] - item[0]):
+                run = [time for _, time in run]
+                first, last = run[0], run[-1]
+                while first > max(0, run[0] - self.prefetch_tiles) and not self._contains(key(first - 1, spatial)):
+                    first -= 1
+                while last < min(n_time_tiles - 1, run[-1] + self.prefetch_tiles) and \
+                        not self._contains(key(last + 1, spatial)):
+                    last += 1
+                fetched = array[(extent(0, first, last), *spatial_extent)][attr.name]
+                for offset, time in enumerate(range(first, last + 1)):
+                    block = fetched[offset * tiles[0]:(offset + 1) * tiles[0]]
+                    self._put(key(time, spatial), block, to_disk, to_memory)
+                    if time in blocks:
+                        blocks[time] = block
+                    else:
+                        with self._lock:
+                            self.prefetched += 1
+
+            for time, block in blocks.items():
+                block_slices = [extent(0, time, time), *spatial_extent]
+                source, target = [], []
+                for block_slice, request in zip(block_slices, subarray):
+                    first, last = max(block_slice.start, request.start), min(block_slice.stop, request.stop)
+                    source.append(slice(first - block_slice.start, last - block_slice.start))
+                    target.append(slice(first - request.start, last - request.start))
+                out[tuple(target)] = block[tuple(source)]
+        return out
+
+
+class CachedArray:
+    def __init__(self, array: tiledb.DenseArray, cache: BlockCache,
+                 fragments: list[tuple[int, int, int]] | None = None) -> None:
+        """
+        An opened tile database of which slicing reads go through the block cache. Everything else (schema, metadata,
+        multi-range queries) is passed on to the tile database.
+
+        :param array: Opened tile database.
+        :param cache: The block cache shared by all tile databases.
+        :param fragments: (optional) First band, last band and write timestamp of every fragment of the tile database.
+        """
+        self._array = array
+        self._cache = cache
+        self._fragments = fragments
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self._array, name)
+
+    def __getitem__(self, subarray: Any) -> Any:
+        if isinstance(subarray, tuple) and len(subarray) == self._array.ndim and \
+                all(isinstance(s, slice) and s.start is not None and s.stop is not None and s.step is None
+                    for s in subarray):
+            return {self._array.schema.attr(0).name: self._cache.read(self._array, subarray, self._fragments)}
+        return self._array[subarray]
@@ -0,0 +1,329 @@
+"""
+climatology.py: Contains the batch job that derives per-cell precipitation climatology grids from the IMERG tile
+database, and the functions that read them.
+
+Design-rainfall work needs the annual maxima of every duration and the return-period values over the whole record, for
+every cell. Computing them per request means streaming two decades of half-hourly data. The job sweeps the area in
+spatial blocks that Dask spreads over the cores (or the workers of a distributed scheduler). Every block streams its
+series through the running statistics of statistics.py in tile-aligned chunks, so memory stays bounded, and writes its
+grids straight into the derived tile database. The API then answers design-storm lookups with a single small read.
+
+Return-period values are fitted with a Gumbel distribution (method of moments) on the annual maxima of the complete
+calendar years within the date range.
+
+Usage: python -m IMERG.climatology <uri> --date-range 2001-01-01/2021-12-31 --bounds 4 57.9 31.5 71.3
+"""
+
+__author__ = "Tim Rietdijk"
+__email__ = "tim.is@live.nl"
+__status__ = "Development"
+
+# standard imports:
+import argparse
+import time
+import warnings
+from functools import partial
+from typing import Callable
+
+# third-party imports:
+import dask
+import numpy as np
+import tiledb
+from dotenv import dotenv_values
+from geopandas import GeoSeries
+from numpy import datetime64
+
+# local imports:
+from date_range import DateRange
+from IMERG.dataset import get_tiledb_options
+from IMERG.grid_index import IMERG_GRID
+from IMERG.imerg_api import IMERG_ATTRIBUTE, _weighted_mean, to_output
+from IMERG.parallel import tile_chunks
+from IMERG.statistics import DEFAULT_DURATIONS, RollingStatistics, duration_bands
+from IMERG.time_axis import IMERG_TIME_AXIS
+
+DEFAULT_RETURN_PERIODS = (2, 5, 10, 25, 50, 100)
+CLIMATOLOGY_STATISTICS = ('max', 'annual_max_mean', 'annual_max_std', 'years')
+CLIMATOLOGY_SPACE_TILE = 32
+EULER_GAMMA = 0.5772156649
+
+
+def climatology_uri(uri: str) -> str:
+    """
+    Returns the location of the climatology of a tile database.
+
+    :param uri: Location of the half-hourly tile database.
+    :return: String representing the location of the climatology.
+    """
+    return f"{uri.rstrip('/')}_climatology"
+
+
+def return_period_attribute(return_period: float) -> str:
+    return f"T{return_period:g}"
+
+
+def complete_years(date_range: DateRange) -> tuple[int, int]:
+    """
+    Returns the calendar years that lie entirely within the date range.
+
+    :param date_range: The date range the climatology is computed over.
+    :return: tuple containing the first and the last complete year (the last is smaller when there are none).
+    """
+    first = int(str(date_range.min_date.astype('M8[Y]')))
+    last = int(str(date_range.max_date.astype('M8[Y]')))
+    if date_range.min_date > datetime64(f"{first}-01-01T00:00", 'm'):
+        first += 1
+    if date_range.max_date < datetime64(f"{last}-12-31T23:30", 'm'):
+        last -= 1
+    return first, last
+
+
+def gumbel_return_levels(annual_maxima: np.ndarray, return_periods: list[float]) -> np.ndarray:
+    """
+    Fits a Gumbel distribution to the annual maxima with the method of moments and returns the value that is exceeded
+    once every return period (years). Missing years (NaN) are left out, cells with fewer than two years are NaN.
+
+    :param annual_maxima: Array (years x ...) containing the annual maxima.
+    :param return_periods: Return periods in years, larger than 1.
+    :return: Array (return periods x ...) containing the return levels.
+    """
+    n_years = (~np.isnan(annual_maxima)).sum(axis=0)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean = np.nanmean(np.where(n_years >= 2, annual_maxima, np.nan), axis=0)
+        scale = np.sqrt(6) * np.nanstd(annual_maxima, axis=0, ddof=1) / np.pi
+    location = mean - EULER_GAMMA * scale
+    reduced = -np.log(-np.log(1 - 1 / np.asarray(return_periods, dtype=np.float64)))
+    return location + scale * reduced.reshape(-1, *[1] * mean.ndim)
+
+
+def create_climatology_array(uri: str, ctx: tiledb.Ctx, durations: list[float], return_periods: list[float],
+                             row_slice: slice, col_slice: slice, space_tile: int = CLIMATOLOGY_SPACE_TILE) -> None:
+    """
+    Creates an empty climatology tile database over the grid of the half-hourly tile database. The first dimension
+    holds the durations, every statistic and return period is an attribute.
+
+    :param uri: Location of the half-hourly tile database.
+    :param ctx: TileDB context containing the (S3) VFS options.
+    :param durations: Durations of the rolling windows in hours.
+    :param return_periods: Return periods in years.
+    :param row_slice: Rows of the half-hourly tile database the climatology is computed for.
+    :param col_slice: Columns of the half-hourly tile database the climatology is computed for.
+    :param space_tile: Number of rows and columns per tile.
+    :return: None
+    """
+    with tiledb.open(uri, ctx=ctx) as source:
+        _, row_dim, col_dim = source.schema.domain
+        filters = source.schema.attr(0).filters
+    dom = tiledb.Domain(
+        tiledb.Dim(name='DURATIONS', domain=(0, len(durations) - 1), tile=len(durations), dtype=row_dim.dtype),
+        tiledb.Dim(name=row_dim.name, domain=row_dim.domain, tile=space_tile, dtype=row_dim.dtype),
+        tiledb.Dim(name=col_dim.name, domain=col_dim.domain, tile=space_tile, dtype=col_dim.dtype), ctx=ctx)
+    names = [*CLIMATOLOGY_STATISTICS, *(return_period_attribute(period) for period in return_periods)]
+    attrs = [tiledb.Attr(name=name, dtype=np.int32 if name == 'years' else np.float32, filters=filters)
+             for name in names]
+    tiledb.DenseArray.create(climatology_uri(uri), tiledb.ArraySchema(domain=dom, sparse=False, attrs=attrs, ctx=ctx),
+                             ctx=ctx)
+    with tiledb.open(climatology_uri(uri), 'w', ctx=ctx) as target:
+        target.meta['rows'] = (row_slice.start, row_slice.stop)
+        target.meta['cols'] = (col_slice.start, col_slice.stop)
+        target.meta['durations'] = np.asarray(durations, dtype=np.float64)
+        target.meta['return_periods'] = np.asarray(return_periods, dtype=np.float64)
+
+
+def block_slices(dim: tiledb.Dim, area: slice, block_size: int | None = None) -> list[slice]:
+    """
+    Splits the rows or columns of an area into blocks aligned to the start of the domain of the dimension. With the
+    tile of the dimension as block size (or a multiple of it), no tile of the half-hourly tile database is read by two
+    blocks.
+
+    :param dim: Spatial dimension of the half-hourly tile database.
+    :param area: Rows or columns of the area.
+    :param block_size: (optional) Number of rows or columns per block, defaults to the tile of the dimension.
+    :return: List containing a slice for every block.
+    """
+    step = block_size or int(dim.tile)
+    first = area.start - (area.start - int(dim.domain[0])) % step
+    return [slice(max(start, area.start), min(start + step, area.stop)) for start in range(first, area.stop, step)]
+
+
+def compute_block(uri: str, config: dict[str, str], date_range: str, row_slice: slice, col_slice: slice,
+                  chunk_bands: int = 31 * 48) -> int:
+    """
+    Computes the climatology of one spatial block and writes it to the climatology tile database. Runs on a Dask
+    worker, so it opens the tile databases itself.
+
+    :param uri: Location of the half-hourly tile database.
+    :param config: TileDB configuration containing the (S3) VFS options.
+    :param date_range: The date range the climatology is computed over (YYYY-MM-DD/YYYY-MM-DD).
+    :param row_slice: Rows of the block.
+    :param col_slice: Columns of the block.
+    :param chunk_bands: Approximate number of bands read per query.
+    :return: Number of cells of the block.
+    """
+    ctx = tiledb.Ctx(tiledb.Config(config))
+    date_range = DateRange(date_range)
+    with tiledb.open(climatology_uri(uri), ctx=ctx) as target:
+        durations = list(np.atleast_1d(target.meta['durations']))
+        return_periods = list(np.atleast_1d(target.meta['return_periods']))
+    shape = (len(durations), row_slice.stop - row_slice.start, col_slice.stop - col_slice.start)
+    statistics = RollingStatistics(duration_bands(durations), shape[1] * shape[2])
+    with tiledb.open(uri, ctx=ctx) as array:
+        time_tile = int(array.schema.domain.dim(0).tile)
+        for chunk in tile_chunks(array, IMERG_TIME_AXIS.slice(date_range), max(1, chunk_bands // time_tile)):
+            block = array[chunk, row_slice, col_slice][IMERG_ATTRIBUTE]
+            statistics.update(block.reshape(block.shape[0], -1), chunk.start)
+
+    first_year, last_year = complete_years(date_range)
+    years, annual_maxima = statistics.annual_maxima()
+    annual_maxima = annual_maxima[[first_year <= year <= last_year for year in years]]
+    # Cells without any complete year get NaN, which numpy warns about.
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', RuntimeWarning)
+        grids = {'max': np.nanmax(annual_maxima, axis=0) if len(annual_maxima) else np.full(shape, np.nan),
+                 'annual_max_mean': np.nanmean(annual_maxima, axis=0),
+                 'annual_max_std': np.nanstd(annual_maxima, axis=0, ddof=1),
+                 'years': (~np.isnan(annual_maxima)).sum(axis=0)}
+        for period, levels in zip(return_periods, gumbel_return_levels(annual_maxima, return_periods)):
+            grids[return_period_attribute(period)] = levels
+    with tiledb.open(climatology_uri(uri), 'w', ctx=ctx) as target:
+        target[0:shape[0], row_slice, col_slice] = {name: grid.reshape(shape).astype(target.schema.attr(name).dtype)
+                                                    for name, grid in grids.items()}
+    return shape[1] * shape[2]
+
+
+def compute_climatology(uri: str, ctx: tiledb.Ctx, date_range: DateRange, row_slice: slice, col_slice: slice,
+                        durations: list[float] = DEFAULT_DURATIONS,
+                        return_periods: list[float] = DEFAULT_RETURN_PERIODS, block_size: int | None = None,
+                        address: str | None = None, workers: int | None = None) -> float:
+    """
+    Computes the climatology of an area in spatial blocks, which Dask runs in parallel: in local processes by default,
+    or on the workers of a distributed scheduler. The blocks follow the spatial tiles of the half-hourly tile database,
+    so every tile is fetched by one task only. The climatology tile
+    database is created when it doesn't exist yet, an existing one is updated if the durations and return periods
+    match.
+
+    :param uri: Location of the half-hourly tile database.
+    :param ctx: TileDB context containing the (S3) VFS options.
+    :param date_range: The date range the climatology is computed over.
+    :param row_slice: Rows of the area.
+    :param col_slice: Columns of the area.
+    :param durations: Durations of the rolling windows in hours.
+    :param return_periods: Return periods in years.
+    :param block_size: (optional) Number of rows and columns of the block computed by one task, defaults to the
+    spatial tiles of the half-hourly tile database.
+    :param address: (optional) Address of a Dask distributed scheduler, for example tcp://127.0.0.1:8786.
+    :param workers: Number of local processes (default: number of cores).
+    :return: Float representing the number of seconds it took.
+    """
+    start_time = time.time()
+    duration_bands(durations)
+    if any(period <= 1 for period in return_periods):
+        raise ValueError(f"Return periods have to be larger than 1 year ({return_periods})")
+    target_uri = climatology_uri(uri)
+    if not tiledb.array_exists(target_uri, ctx=ctx):
+        create_climatology_array(uri, ctx, durations, return_periods, row_slice, col_slice)
+    with tiledb.open(target_uri, ctx=ctx) as target:
+        (row_start, row_stop), (col_start, col_stop) = target.meta['rows'], target.meta['cols']
+        if list(np.atleast_1d(target.meta['durations'])) != list(durations) or \
+                list(np.atleast_1d(target.meta['return_periods'])) != list(return_periods):
+            raise ValueError(f"{target_uri} holds other durations or return periods, remove it first")
+    if not (row_start <= row_slice.start <= row_slice.stop <= row_stop and
+            col_start <= col_slice.start <= col_slice.stop <= col_stop):
+        raise ValueError(f"The area lies outside the area of {target_uri}, remove it first")
+
+    with tiledb.open(uri, ctx=ctx) as source:
+        _, row_dim, col_dim = source.schema.domain
+    config = ctx.config().dict()
+    tasks = [dask.delayed(compute_block)(uri, config, f"{date_range.min_date_str}/{date_range.max_date_str}",
+                                         rows, cols)
+             for rows in block_slices(row_dim, row_slice, block_size)
+             for cols in block_slices(col_dim, col_slice, block_size)]
+    if address:
+        from dask.distributed import Client
+        with Client(address) as client:
+            dask.compute(*tasks, scheduler=client)
+    else:
+        dask.compute(*tasks, scheduler='processes', num_workers=workers)
+
+    tiledb.consolidate(target_uri, ctx=ctx)
+    tiledb.vacuum(target_uri, ctx=ctx)
+    with tiledb.open(target_uri, 'w', ctx=ctx) as target:
+        target.meta['date_range'] = f"{date_range.min_date_str}/{date_range.max_date_str}"
+        target.meta['years'] = complete_years(date_range)
+    return time.time() - start_time
+
+
+def get_climatology(array: tiledb.DenseArray, row_slice: slice, col_slice: slice,
+                    reduce: Callable[[np.ndarray], np.ndarray]) -> dict[str, list | dict]:
+    """
+    Reads the climatology grids of an area and reduces every grid to its series (points or polygons).
+
+    :param array: Opened climatology tile database.
+    :param row_slice: Rows that are read.
+    :param col_slice: Columns that are read.
+    :param reduce: Function reducing a (durations x rows x columns) block to a (durations x series) array.
+    :return: Dictionary containing every statistic and return level per duration, with one entry per series.
+    """
+    durations = list(np.atleast_1d(array.meta['durations']))
+    return_periods = list(np.atleast_1d(array.meta['return_periods']))
+    keys = [f"{duration:g}" for duration in durations]
+    grids = array[:, row_slice, col_slice]
+
+    def per_duration(name: str) -> dict[str, list]:
+        return dict(zip(keys, to_output(reduce(grids[name].astype(np.float64))).tolist()))
+
+    return {'durations': durations, 'date_range': array.meta.get('date_range'),
+            'year_range': list(array.meta['years']) if 'years' in array.meta else None,
+            **{name: per_duration(name) for name in CLIMATOLOGY_STATISTICS},
+            'return_levels': {f"{period:g}": per_duration(return_period_attribute(period))
+                              for period in return_periods}}
+
+
+def get_point_climatology(array: tiledb.DenseArray, row: int, col: int) -> dict[str, list | dict]:
+    """
+    Reads the climatology of one cell.
+
+    :param array: Opened climatology tile database.
+    :param row: Row (latitude) index of the cell.
+    :param col: Column (longitude) index of the cell.
+    :return: Dictionary containing the climatology of the cell.
+    """
+    return get_climatology(array, slice(row, row + 1), slice(col, col + 1),
+                           lambda block: block.reshape(block.shape[0], 1))
+
+
+def get_polygon_climatology(array: tiledb.DenseArray, polygons: GeoSeries) -> dict[str, list | dict]:
+    """
+    Reads the area-weighted mean of the climatology grids within every polygon.
+
+    :param array: Opened climatology tile database.
+    :param polygons: GeoSeries (EPSG:4326) containing the polygons.
+    :return: Dictionary containing the climatology of every polygon.
+    """
+    row_slice, col_slice, weights = IMERG_GRID.coverage(polygons)
+    return get_climatology(array, row_slice, col_slice, partial(_weighted_mean, weights=weights))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Compute the IMERG climatology grids (annual maxima per duration and "
+                                                 "return-period values) into a derived tile database.")
+    parser.add_argument('uri', help="Location of the half-hourly IMERG tile database")
+    parser.add_argument('--date-range', required=True, help="Period the climatology is computed over "
+                                                            "(YYYY-MM-DD/YYYY-MM-DD), only complete years are used")
+    parser.add_argument('--bounds', nargs=4, type=float, default=(4, 57.9, 31.5, 71.3),
+                        metavar=('MINX', 'MINY', 'MAXX', 'MAXY'), help="Area to compute (default: Norway)")
+    parser.add_argument('--durations', type=float, nargs='+', default=DEFAULT_DURATIONS,
+                        help="Durations of the rolling windows in hours")
+    parser.add_argument('--return-periods', type=float, nargs='+', default=DEFAULT_RETURN_PERIODS,
+                        help="Return periods in years")
+    parser.add_argument('--block-size', type=int,
+                        help="Number of rows and columns computed by one task (default: the spatial tile)")
+    parser.add_argument('--scheduler', help="Address of a Dask distributed scheduler (default: local processes)")
+    parser.add_argument('--workers', type=int, help="Number of local processes (default: all cores)")
+    args = parser.parse_args()
+
+    context = tiledb.Ctx(tiledb.Config(get_tiledb_options(dotenv_values('.env'))))
+    seconds = compute_climatology(args.uri, context, DateRange(args.date_range), *IMERG_GRID.slices(args.bounds),
+                                  durations=args.durations, return_periods=args.return_periods,
+                                  block_size=args.block_size, address=args.scheduler, workers=args.workers)
+    print(f"Computed the climatology in {seconds} seconds")
@@ -0,0 +1,315 @@
+"""
+dataset.py: Contains the class 'ImergDataset' which manages the shared, long-lived handle to the IMERG tile database.
+"""
+
+__author__ = "Tim Rietdijk"
+__email__ = "tim.is@live.nl"
+__status__ = "Development"
+
+# standard imports:
+import math
+import threading
+import time
+from contextlib import contextmanager, ExitStack
+from typing import Iterator
+
+# third-party imports:
+import tiledb
+
+# local imports:
+from exceptions import DatasetNotReady
+from IMERG.availability import Availability
+from IMERG.block_cache import BlockCache, CachedArray
+
+
+def get_tiledb_options(secrets: dict[str, str]) -> dict[str, str]:
+    """
+    Creates the TileDB VFS options needed to access the tile databases stored on S3.
+
+    :param secrets: Dictionary containing the values of the .env file.
+    :return: Dictionary containing the TileDB configuration options.
+    """
+    return {'vfs.s3.aws_access_key_id': secrets['AMAZON_S3_AWS_ACCESS_KEY_ID'],
+            'vfs.s3.aws_secret_access_key': secrets['AMAZON_S3_AWS_SECRET_ACCESS_KEY'],
+            'vfs.s3.scheme': 'https',
+            'vfs.s3.region': 'eu-west-1'
+            }
+
+
+def bytes_touched(array: tiledb.DenseArray, subarray: tuple[slice, ...]) -> int:
+    """
+    Estimates how many bytes a read of the subarray fetches, by counting the tiles it touches and multiplying that by
+    the size of a tile.
+
+    :param array: Opened tile database.
+    :param subarray: Slice for every dimension of the tile database.
+    :return: Integer representing the number of bytes in the tiles touched by the read.
+    """
+    tiles, tile_cells = 1, 1
+    for dim, dim_slice in zip(array.schema.domain, subarray):
+        domain_start, tile = int(dim.domain[0]), int(dim.tile)
+        tiles *= (dim_slice.stop - 1 - domain_start) // tile - (dim_slice.start - domain_start) // tile + 1
+        tile_cells *= tile
+    return tiles * tile_cells * array.schema.attr(0).dtype.itemsize
+
+
+def covers(array: tiledb.DenseArray, subarray: tuple[slice, ...]) -> bool:
+    """
+    Checks whether the subarray lies within the part of the source that was copied into a derived tile database.
+    Arrays without coverage metadata hold the full dataset.
+
+    :param array: Opened tile database.
+    :param subarray: Slice for the bands, rows and columns.
+    :return: Boolean representing whether every cell of the subarray is stored in the tile database.
+    """
+    for key, dim_slice in zip(('bands', 'rows', 'cols'), subarray):
+        if key in array.meta:
+            start, stop = array.meta[key]
+            if not start <= dim_slice.start <= dim_slice.stop <= stop:
+                return False
+    return True
+
+
+class _ArrayHandle:
+    def __init__(self, array: tiledb.DenseArray, fragments: tiledb.FragmentInfoList) -> None:
+        """
+        An opened array together with the fragments it was opened on, its availability and the number of requests
+        reading from it.
+        """
+        self.array = array
+        self.availability = Availability.from_meta(array.meta)
+        self.fragments = frozenset(fragments.uri)
+        self.fragment_bands = [(int(domain[0][0]), int(domain[0][1]), int(timestamps[1]))
+                               for domain, timestamps in zip(fragments.nonempty_domain, fragments.timestamp_range)]
+        self.readers = 0
+        self.retired = False
+
+
+class ImergDataset:
+    def __init__(self, uri: str, config: tiledb.Config, refresh_interval: float = 300,
+                 open_timeout: float = 30, cache: BlockCache | None = None) -> None:
+        """
+        A tile database that is opened once per worker in the background and shared by all requests. A background
+        thread checks for new fragments every refresh_interval seconds and swaps in a freshly opened handle, the
+        previous handle is closed once the last request reading from it is done.
+
+        :param uri: Location of the tile database (local path or s3:// url).
+        :param config: TileDB configuration containing the (S3) VFS options.
+        :param refresh_interval: Seconds between two checks for new fragments.
+        :param open_timeout: Seconds a request waits for the initial open before giving up.
+        :param cache: (optional) Block cache the reads of the requests go through.
+        """
+        self.uri = uri
+        self._ctx = tiledb.Ctx(config)
+        self._refresh_interval = refresh_interval
+        self._open_timeout = open_timeout
+        self._handle: _ArrayHandle | None = None
+        self._lock = threading.Lock()
+        self._ready = threading.Event()
+        self._checked = threading.Event()
+        self._stopped = threading.Event()
+        self._thread: threading.Thread | None = None
+        self._error: Exception | None = None
+        self._missing = False
+        self._cache = cache
+
+    def __str__(self):
+        return self.uri
+
+    @property
+    def is_ready(self) -> bool:
+        return self._ready.is_set()
+
+    @property
+    def is_missing(self) -> bool:
+        """
+        Returns whether the tile database doesn't exist (yet), for example a rollup or climatology that was never
+        built. The background thread keeps checking, so it is opened once it is built.
+
+        :return: Boolean representing whether the tile database is missing.
+        """
+        return self._missing and not self._ready.is_set()
+
+    @property
+    def availability(self) -> Availability | None:
+        """
+        Returns the availability stored with the tile database, loaded when the current handle was opened.
+
+        :return: The availability, or None if the tile database isn't open (yet) or doesn't have one.
+        """
+        handle = self._handle
+        return handle.availability if handle is not None else None
+
+    def version(self, bands: slice) -> tuple[str, int] | None:
+        """
+        Returns the version of a range along the first dimension, the same version the block cache keys its tiles on:
+        the newest fragment that wrote to it. Results derived from the range can be cached under this version.
+
+        :param bands: Slice along the first dimension (bands, or periods of a rollup).
+        :return: tuple containing the location of the tile database and the write timestamp of the newest fragment,
+        or None if the tile database isn't open (yet).
+        """
+        handle = self._handle
+        if handle is None:
+            return None
+        return self.uri, max((timestamp for first, last, timestamp in handle.fragment_bands
+                              if first < bands.stop and last >= bands.start), default=0)
+
+    def _fragments(self) -> tiledb.FragmentInfoList:
+        """
+        Lists the fragments currently stored in the tile database.
+
+        :return: FragmentInfoList containing the uri, domain and timestamps of every fragment.
+        """
+        return tiledb.array_fragments(self.uri, ctx=self._ctx)
+
+    def _open(self) -> None:
+        """
+        Opens a new handle if the fragments of the tile database changed since the current handle was opened.
+
+        :return: None
+        """
+        fragments = self._fragments()
+        if self._handle is not None and self._handle.fragments == frozenset(fragments.uri):
+            return
+        handle = _ArrayHandle(tiledb.open(self.uri, mode='r', ctx=self._ctx), fragments)
+        with self._lock:
+            previous, self._handle = self._handle, handle
+            if previous is not None:
+                previous.retired = True
+                if not previous.readers:
+                    previous.array.close()
+        self._ready.set()
+
+    def _run(self) -> None:
+        """
+        Background loop that opens the tile database and keeps it up to date. Failed opens are retried with a growing
+        interval and a failure is only printed when it differs from the previous one, a missing tile database is
+        checked for once every refresh interval.
+
+        :return: None
+        """
+        retry = 10
+        while not self._stopped.is_set():
+            try:
+                if self._handle is None and not tiledb.array_exists(self.uri, ctx=self._ctx):
+                    if not self._missing:
+                        print(f"{self.uri} doesn't exist, checking again every {self._refresh_interval} seconds")
+                    self._missing = True
+                    self._error = FileNotFoundError(self.uri)
+                    self._checked.set()
+                    self._stopped.wait(self._refresh_interval)
+                    continue
+                self._open()
+                self._missing, self._error, retry = False, None, 10
+            except Exception as e:
+                if str(e) != str(self._error):
+                    print(f"Failed to open {self.uri}: {e}")
+                self._error = e
+                retry = min(retry * 2, self._refresh_interval)
+            self._checked.set()
+            self._stopped.wait(self._refresh_interval if self.is_ready else retry)
+
+    def start(self) -> None:
+        """
+        Starts opening the tile database in the background. Requests can be served as soon as it is ready.
+
+        :return: None
+        """
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name=f"ImergDataset({self.uri})", daemon=True)
+            self._thread.start()
+
+    def close(self) -> None:
+        """
+        Stops the background thread and closes the current handle.
+
+        :return: None
+        """
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        with self._lock:
+            if self._handle is not None:
+                self._handle.retired = True
+                if not self._handle.readers:
+                    self._handle.array.close()
+                self._handle = None
+        self._ready.clear()
+        self._checked.clear()
+
+    @contextmanager
+    def reader(self) -> Iterator[tiledb.DenseArray]:
+        """
+        Lends the shared handle to a request. A handle that gets replaced while in use stays open until every request
+        reading from it is finished. With a block cache, slicing reads of the request are served through the cache.
+        A tile database that doesn't exist fails as soon as the background thread has checked for it, instead of after
+        the open timeout.
+
+        :return: Opened tile database.
+        """
+        deadline = time.monotonic() + self._open_timeout
+        if not self._checked.wait(self._open_timeout) or self.is_missing or \
+                not self._ready.wait(max(0.0, deadline - time.monotonic())):
+            raise DatasetNotReady(self.uri, self._error)
+        with self._lock:
+            handle = self._handle
+            if handle is None:
+                raise DatasetNotReady(self.uri, self._error)
+            handle.readers += 1
+        try:
+            yield handle.array if self._cache is None else CachedArray(handle.array, self._cache, handle.fragment_bands)
+        finally:
+            with self._lock:
+                handle.readers -= 1
+                if handle.retired and not handle.readers:
+                    handle.array.close()
+
+
+class ImergLayouts:
+    def __init__(self, *datasets: ImergDataset) -> None:
+        """
+        The same IMERG data stored in differently tiled tile databases, for example one tiled for spatial snapshots and
+        one tiled for long time series. Every read is served by the layout that fetches the fewest bytes for the
+        requested subarray.
+
+        :param datasets: The tile databases, the first one has to hold the full dataset.
+        """
+        self._datasets = datasets
+
+    def start(self) -> None:
+        for dataset in self._datasets:
+            dataset.start()
+
+    def close(self) -> None:
+        for dataset in self._datasets:
+            dataset.close()
+
+    @property
+    def availability(self) -> Availability | None:
+        return self._datasets[0].availability if self._datasets else None
+
+    def version(self, bands: slice) -> tuple[tuple[str, int] | None, ...]:
+        return tuple(dataset.version(bands) for dataset in self._datasets)
+
+    @contextmanager
+    def reader(self, subarray: tuple[slice, slice, slice]) -> Iterator[tiledb.DenseArray]:
+        """
+        Lends the handle of the layout best suited for reading the subarray. Layouts that are still being opened or
+        don't hold the whole subarray are skipped.
+
+        :param subarray: Slice for the bands, rows and columns that will be read.
+        :return: Opened tile database.
+        """
+        with ExitStack() as stack:
+            best_array, best_bytes = None, math.inf
+            for dataset in self._datasets:
+                if best_array is not None and not dataset.is_ready:
+                    continue
+                array = stack.enter_context(dataset.reader())
+                if covers(array, subarray) and bytes_touched(array, subarray) < best_bytes:
+                    best_array, best_bytes = array, bytes_touched(array, subarray)
+            if best_array is None:
+                raise DatasetNotReady(', '.join(str(dataset) for dataset in self._datasets) or 'IMERG')
+            yield best_array
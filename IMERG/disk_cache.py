@@ -0,0 +1,130 @@
+"""
+disk_cache.py: Contains the class 'DiskBlockCache' which keeps tiles of the S3-backed IMERG tile databases on disk.
+
+Every read from S3 pays the latency of a request to eu-west-1 and egress for every byte. Tiles written to a local SSD
+are served at disk speed and survive restarts of the API, so a worker that comes back up doesn't download its hot
+regions again. The directory is bounded in bytes and the least recently used tiles are removed first.
+"""
+
+__author__ = "Tim Rietdijk"
+__email__ = "tim.is@live.nl"
+__status__ = "Development"
+
+# standard imports:
+import hashlib
+import os
+import pathlib
+import threading
+import time
+from collections import OrderedDict
+
+# third-party imports:
+import numpy as np
+
+
+class DiskBlockCache:
+    def __init__(self, directory: str, max_bytes: int) -> None:
+        """
+        A least-recently-used store of tiles in a local directory, one .npy file per tile named after the hash of its
+        key. The recency of the files is kept in their modification time, so the order survives restarts. Workers
+        sharing the directory each keep to max_bytes for the tiles they know of, give every worker its own directory
+        for a strict cap.
+
+        :param directory: Directory the tiles are stored in, created if it doesn't exist yet.
+        :param max_bytes: Maximum number of bytes of tiles kept on disk.
+        """
+        self.directory = pathlib.Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._files: OrderedDict[str, int] = OrderedDict()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        for path in sorted(self.directory.glob('*.npy'), key=lambda p: p.stat().st_mtime):
+            self._files[path.name] = path.stat().st_size
+            self.bytes += path.stat().st_size
+        # Temporary files left behind by a crashed worker, the ones of running workers are recent.
+        for path in self.directory.glob('*.tmp'):
+            if path.stat().st_mtime < time.time() - 3600:
+                path.unlink(missing_ok=True)
+
+    def stats(self) -> dict[str, int]:
+        """
+        Returns the counters of the disk cache.
+
+        :return: Dictionary containing the size, hit, miss and eviction counters.
+        """
+        with self._lock:
+            return {'max_bytes': self.max_bytes, 'bytes': self.bytes, 'blocks': len(self._files), 'hits': self.hits,
+                    'misses': self.misses, 'evictions': self.evictions}
+
+    @staticmethod
+    def _name(key: tuple) -> str:
+        return hashlib.sha1(repr(key).encode()).hexdigest() + '.npy'
+
+    def contains(self, key: tuple) -> bool:
+        with self._lock:
+            return self._name(key) in self._files
+
+    def get(self, key: tuple) -> np.ndarray | None:
+        """
+        Loads a tile from disk and marks it as recently used.
+
+        :param key: Key of the tile.
+        :return: Array containing the tile, or None if it isn't stored.
+        """
+        name = self._name(key)
+        with self._lock:
+            if name not in self._files:
+                self.misses += 1
+                return None
+            self._files.move_to_end(name)
+        try:
+            block = np.load(self.directory / name)
+            os.utime(self.directory / name)
+        except (OSError, ValueError):
+            with self._lock:
+                self.bytes -= self._files.pop(name, 0)
+                self.misses += 1
+            return None
+        with self._lock:
+            self.hits += 1
+        return block
+
+    def put(self, key: tuple, block: np.ndarray) -> None:
+        """
+        Writes a tile to disk and removes the least recently used tiles while the directory is over its size. Tiles
+        are written to a temporary file first, so a crash never leaves a partial tile behind.
+
+        :param key: Key of the tile.
+        :param block: Array containing the tile.
+        :return: None
+        """
+        name = self._name(key)
+        if block.nbytes > self.max_bytes:
+            return
+        with self._lock:
+            if name in self._files:
+                return
+        temporary = self.directory / f"{name}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            with open(temporary, 'wb') as file:
+                np.save(file, block)
+            os.replace(temporary, self.directory / name)
+            size = (self.directory / name).stat().st_size
+        except OSError as e:
+            print(f"Failed to write {name} to the disk cache: {e}")
+            temporary.unlink(missing_ok=True)
+            return
+        with self._lock:
+            if name in self._files:
+                return
+            self._files[name] = size
+            self.bytes += size
+            while self.bytes > self.max_bytes:
+                evicted, evicted_size = self._files.popitem(last=False)
+                (self.directory / evicted).unlink(missing_ok=True)
+                self.bytes -= evicted_size
+                self.evictions += 1
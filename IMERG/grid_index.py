@@ -0,0 +1,109 @@
+"""
+grid_index.py: Contains the class 'GridIndex' which maps coordinates to the cells of a regular lat/lon tile database.
+"""
+
+__author__ = "Tim Rietdijk"
+__email__ = "tim.is@live.nl"
+__status__ = "Development"
+
+# third-party imports:
+import numpy as np
+import shapely
+from geopandas import GeoSeries
+from scipy import sparse
+
+
+class GridIndex:
+    def __init__(self, west: float, north: float, resolution: float, n_rows: int, n_cols: int) -> None:
+        """
+        A regular lat/lon lattice of which row 0 is the northernmost row and column 0 the westernmost column. Every
+        lookup is done with arithmetic, so no grid file has to be read or joined.
+
+        :param west: Longitude of the western edge of the grid.
+        :param north: Latitude of the northern edge of the grid.
+        :param resolution: Width and height of a cell in degrees.
+        :param n_rows: Number of rows (latitude) of the grid.
+        :param n_cols: Number of columns (longitude) of the grid.
+        """
+        self.west = west
+        self.north = north
+        self.resolution = resolution
+        self.n_rows = n_rows
+        self.n_cols = n_cols
+
+    def _to_index(self, distance: np.ndarray, size: int) -> np.ndarray:
+        """
+        Converts distances from the grid origin to cell indexes. Rounding to 9 decimals prevents coordinates on a cell
+        edge from ending up in the previous cell because of floating point errors.
+        """
+        return np.clip(np.floor(np.round(distance / self.resolution, 9)).astype(np.int64), 0, size - 1)
+
+    def cell(self, lon: float | np.ndarray, lat: float | np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Returns the row and column of the cells containing the coordinates.
+
+        :param lon: Longitude(s) in EPSG:4326.
+        :param lat: Latitude(s) in EPSG:4326.
+        :return: tuple containing the row index(es) and the column index(es).
+        """
+        return self._to_index(self.north - np.asarray(lat), self.n_rows), \
+            self._to_index(np.asarray(lon) - self.west, self.n_cols)
+
+    def slices(self, bounds: tuple[float, float, float, float] | np.ndarray) -> tuple[slice, slice]:
+        """
+        Returns the row and column ranges of the cells that intersect with the bounds.
+
+        :param bounds: tuple containing minx, miny, maxx, maxy in EPSG:4326.
+        :return: tuple containing the row slice and the column slice.
+        """
+        minx, miny, maxx, maxy = bounds
+        (first_row, last_row), (first_col, last_col) = self.cell(np.array([minx, maxx]), np.array([maxy, miny]))
+        return slice(int(first_row), int(last_row) + 1), slice(int(first_col), int(last_col) + 1)
+
+    def cells(self, row_slice: slice, col_slice: slice) -> np.ndarray:
+        """
+        Creates the polygons of the cells within the row and column ranges in row-major order.
+
+        :param row_slice: Range of rows.
+        :param col_slice: Range of columns.
+        :return: Array containing a shapely box for every cell.
+        """
+        rows, cols = np.meshgrid(np.arange(row_slice.start, row_slice.stop), np.arange(col_slice.start, col_slice.stop),
+                                 indexing='ij')
+        west = self.west + cols.ravel() * self.resolution
+        north = self.north - rows.ravel() * self.resolution
+        return shapely.box(west, north - self.resolution, west + self.resolution, north)
+
+    def coverage(self, polygons: GeoSeries) -> tuple[slice, slice, sparse.csr_matrix]:
+        """
+        Calculates what fraction of each polygon's area lies within each cell of the polygons' bounding box.
+        Intersection areas are scaled by the cosine of the cell's latitude, so cells further north, which cover less
+        ground, get a proportionally lower weight. The fractions are stored in a sparse matrix with one row for every
+        cell of the bounding box (in row-major order) and one column for every polygon.
+
+        :param polygons: GeoSeries (EPSG:4326) containing the polygons you want the cell weights of.
+        :return: tuple containing the row slice and column slice of the bounding box and the sparse (cells x polygons)
+        weight matrix.
+        """
+        row_slice, col_slice = self.slices(polygons.total_bounds)
+        cells = self.cells(row_slice, col_slice)
+        n_cols = col_slice.stop - col_slice.start
+        latitudes = self.north - (np.arange(row_slice.start, row_slice.stop) + 0.5) * self.resolution
+        row_scale = np.repeat(np.cos(np.radians(latitudes)), n_cols)
+
+        cell_indexes, polygon_indexes, fractions = [], [], []
+        for polygon_index, polygon in enumerate(polygons):
+            candidates = np.flatnonzero(shapely.intersects(cells, polygon))
+            areas = shapely.area(shapely.intersection(cells[candidates], polygon)) * row_scale[candidates]
+            covered = areas > 0
+            cell_indexes.append(candidates[covered])
+            polygon_indexes.append(np.full(covered.sum(), polygon_index))
+            fractions.append(areas[covered] / areas[covered].sum())
+
+        weights = sparse.csr_matrix((np.concatenate(fractions), (np.concatenate(cell_indexes),
+                                                                 np.concatenate(polygon_indexes))),
+                                    shape=(len(cells), len(polygons)))
+        return row_slice, col_slice, weights
+
+
+IMERG_GRID = GridIndex(west=-180, north=90, resolution=0.1, n_rows=1800, n_cols=3600)
@@ -0,0 +1,268 @@
+"""
+imerg_api.py: Contains all the functions to read historical precipitation from the IMERG tile database.
+"""
+
+__author__ = "Tim Rietdijk"
+__email__ = "tim.is@live.nl"
+__status__ = "Development"
+
+# standard imports:
+from functools import partial
+from typing import Callable
+
+# third-party imports:
+import numpy as np
+import tiledb
+from geopandas import GeoSeries
+from scipy import sparse
+
+# local imports:
+from date_range import DateRange, DateRanges
+from IMERG.grid_index import IMERG_GRID
+from IMERG.parallel import ImergScheduler
+from IMERG.rollups import HOURLY, Rollup, aggregate, period_offsets
+from IMERG.time_axis import IMERG_TIME_AXIS, TimeAxis
+
+IMERG_ATTRIBUTE = 'precipitationCal'
+
+
+def half_hour_to_hour(values: np.ndarray, out: np.ndarray | None = None) -> np.ndarray:
+    """
+    Sums every pair of half-hourly values along the first axis into hourly values in one pass, without creating
+    intermediate copies.
+
+    :param values: Array with an even number of half-hourly entries along its first axis.
+    :param out: (optional) Preallocated array to write the hourly values to.
+    :return: Array containing the hourly precipitation.
+    """
+    return np.add(values[0::2], values[1::2], out=out)
+
+
+def to_output(values: np.ndarray) -> np.ndarray:
+    """
+    Converts precipitation to the values returned by the API: missing values become -1 and everything is rounded to 5
+    decimals. Values read as float32 are widened to float64 first, so the rounding isn't undone by float32 noise.
+
+    :param values: Array containing the precipitation, NaN where it is missing.
+    :return: Array (float64) containing the rounded precipitation.
+    """
+    values = values.astype(np.float64, copy=False)
+    np.nan_to_num(values, copy=False, nan=-1)
+    return values.round(5, out=values)
+
+
+def get_point_precipitation(array: tiledb.DenseArray, row: int, col: int, date_range: DateRange,
+                            source: TimeAxis | Rollup = IMERG_TIME_AXIS, aggregation: Rollup = HOURLY,
+                            scheduler: ImergScheduler | None = None) -> np.ndarray:
+    """
+    Reads the precipitation of one cell from the tile database and sums it to the periods of the aggregation.
+    Half-hourly data is summed to hourly values in one pass over a preallocated buffer. Periods containing a missing
+    half-hour are set to -1. With a scheduler the time range is read as parallel, tile-aligned chunks.
+
+    :param array: Opened IMERG tile database (half-hourly or a rollup).
+    :param row: Row (latitude) index of the cell.
+    :param col: Column (longitude) index of the cell.
+    :param date_range: The date range of which the user wants the historic precipitation.
+    :param source: Temporal axis of the tile database.
+    :param aggregation: The periods the precipitation gets summed to.
+    :param scheduler: (optional) Scheduler used to read the time range in parallel.
+    :return: Array containing the precipitation of every period.
+    """
+    subarray = source.slice(date_range), slice(row, row + 1), slice(col, col + 1)
+    if scheduler is None:
+        values = array[subarray][IMERG_ATTRIBUTE].reshape(-1)
+    else:
+        values = scheduler.read(array, subarray, np.ravel)
+    if source is IMERG_TIME_AXIS and aggregation is HOURLY:
+        periods = half_hour_to_hour(values, out=np.empty(values.size // 2, dtype=values.dtype))
+    else:
+        periods = aggregate(values, period_offsets(source, aggregation, date_range))
+    return to_output(periods)
+
+
+def _weighted_mean(block: np.ndarray, weights: sparse.csr_matrix) -> np.ndarray:
+    """
+    Reduces a (time x rows x columns) block to the weighted mean of every polygon per time step. Missing cells are
+    left out of the mean, time steps without any valid cell are NaN.
+
+    :param block: Array containing the precipitation of the bounding box of the polygons.
+    :param weights: Sparse (cells x polygons) weight matrix of the bounding box.
+    :return: Array (time x polygons) containing the weighted mean.
+    """
+    block = block.reshape(block.shape[0], -1)
+    missing = np.isnan(block)
+    weighted = weights.T.dot(np.where(missing, 0, block).T).T
+    valid_weight = weights.T.dot((~missing).T.astype(block.dtype)).T
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return np.where(valid_weight > 0, weighted / valid_weight, np.nan)
+
+
+def get_polygon_precipitation(array: tiledb.DenseArray, polygons: GeoSeries, date_range: DateRange,
+                              source: TimeAxis | Rollup = IMERG_TIME_AXIS, aggregation: Rollup = HOURLY,
+                              scheduler: ImergScheduler | None = None) -> np.ndarray:
+    """
+    Reads the bounding box of the polygons from the tile database in a single query and reduces the
+    (time x cells) block to an area-weighted series per polygon with a sparse matrix multiplication. Missing
+    cells are left out of the weighted mean, periods containing a time step without any valid cell are set to -1.
+    With a scheduler the time range is read as parallel, tile-aligned chunks that are each reduced right away.
+
+    :param array: Opened IMERG tile database (half-hourly or a rollup).
+    :param polygons: GeoSeries (EPSG:4326) containing the polygons you want the precipitation of.
+    :param date_range: The date range of which the user wants the historic precipitation.
+    :param source: Temporal axis of the tile database.
+    :param aggregation: The periods the precipitation gets summed to.
+    :param scheduler: (optional) Scheduler used to read the time range in parallel.
+    :return: Array (periods x polygons) containing the area-weighted precipitation.
+    """
+    row_slice, col_slice, weights = IMERG_GRID.coverage(polygons)
+    subarray = source.slice(date_range), row_slice, col_slice
+    if scheduler is None:
+        means = _weighted_mean(array[subarray][IMERG_ATTRIBUTE], weights)
+    else:
+        means = scheduler.read(array, subarray, partial(_weighted_mean, weights=weights))
+    results = aggregate(means, period_offsets(source, aggregation, date_range))
+    return to_output(results)
+
+
+def _to_ranges(indexes: np.ndarray) -> list[tuple[int, int]]:
+    """
+    Merges sorted, unique indexes into inclusive (start, end) ranges of consecutive indexes.
+
+    :param indexes: Sorted array of unique indexes.
+    :return: List containing the inclusive ranges.
+    """
+    breaks = np.flatnonzero(np.diff(indexes) != 1) + 1
+    return [(int(run[0]), int(run[-1])) for run in np.split(indexes, breaks)]
+
+
+def get_multi_point_precipitation(array: tiledb.DenseArray, rows: np.ndarray, cols: np.ndarray, date_range: DateRange,
+                                  source: TimeAxis | Rollup = IMERG_TIME_AXIS, aggregation: Rollup = HOURLY,
+                                  max_read_values: int = 2 ** 25) -> np.ndarray:
+    """
+    Reads the precipitation of many cells at once and sums it to the periods of the aggregation. Points that share
+    a cell are read once, and the distinct cells are grouped by the spatial tile they lie in. Every group is fetched
+    with one multi-range query over its rows and columns. Such a query reads the cross product of its rows and
+    columns, so grouping by tile bounds the cost by the tiles the points touch instead of growing with the product
+    of all distinct rows and columns. Long date ranges are split into consecutive time chunks of at most
+    max_read_values values, so memory stays bounded. Periods containing a missing half-hour are set to -1.
+
+    :param array: Opened IMERG tile database (half-hourly or a rollup).
+    :param rows: Row (latitude) index of every point.
+    :param cols: Column (longitude) index of every point.
+    :param date_range: The date range of which the user wants the historic precipitation.
+    :param source: Temporal axis of the tile database.
+    :param aggregation: The periods the precipitation gets summed to.
+    :param max_read_values: Maximum number of values read from the tile database per query.
+    :return: Array (points x periods) containing the precipitation.
+    """
+    cells, point_cells = np.unique(np.stack([rows, cols], axis=1), axis=0, return_inverse=True)
+    row_dim, col_dim = array.schema.domain.dim(1), array.schema.domain.dim(2)
+    tiles = np.stack([(cells[:, 0] - int(row_dim.domain[0])) // int(row_dim.tile),
+                      (cells[:, 1] - int(col_dim.domain[0])) // int(col_dim.tile)], axis=1)
+    _, cell_tiles = np.unique(tiles, axis=0, return_inverse=True)
+    cell_tiles = cell_tiles.ravel()
+
+    time_slice = source.slice(date_range)
+    dtype = array.attr(IMERG_ATTRIBUTE).dtype
+    to_hours = source is IMERG_TIME_AXIS and aggregation is HOURLY
+    values = np.empty(((time_slice.stop - time_slice.start) // (2 if to_hours else 1), len(cells)), dtype=dtype)
+    for tile in range(cell_tiles.max() + 1):
+        tile_cells = np.flatnonzero(cell_tiles == tile)
+        unique_rows, cell_rows = np.unique(cells[tile_cells, 0], return_inverse=True)
+        unique_cols, cell_cols = np.unique(cells[tile_cells, 1], return_inverse=True)
+        row_ranges, col_ranges = _to_ranges(unique_rows), _to_ranges(unique_cols)
+        chunk = max(2, max_read_values // (len(unique_rows) * len(unique_cols)) // 2 * 2)
+        for start in range(time_slice.start, time_slice.stop, chunk):
+            stop = min(start + chunk, time_slice.stop)
+            block = array.query(attrs=[IMERG_ATTRIBUTE]).multi_index[[(start, stop - 1)], row_ranges, col_ranges]
+            block = block[IMERG_ATTRIBUTE][:, cell_rows, cell_cols]
+            if to_hours:
+                values[(start - time_slice.start) // 2:(stop - time_slice.start) // 2, tile_cells] = \
+                    half_hour_to_hour(block)
+            else:
+                values[start - time_slice.start:stop - time_slice.start, tile_cells] = block
+
+    periods = values if to_hours else aggregate(values, period_offsets(source, aggregation, date_range))
+    return to_output(periods)[:, point_cells.ravel()].T
+
+
+def get_multi_window_precipitation(array: tiledb.DenseArray, row_slice: slice, col_slice: slice,
+                                   reduce: Callable[[np.ndarray], np.ndarray], date_ranges: DateRanges,
+                                   source: TimeAxis | Rollup = IMERG_TIME_AXIS, aggregation: Rollup = HOURLY,
+                                   max_read_values: int = 2 ** 25) -> list[np.ndarray]:
+    """
+    Reads the precipitation of several date ranges (windows) and sums it to the periods of the aggregation per
+    window. The windows are fetched together with a single multi-range query over the temporal axis, instead of one
+    query per window. Only when the windows hold more than max_read_values values they are split over several
+    queries of consecutive windows. Periods containing a missing half-hour are set to -1.
+
+    :param array: Opened IMERG tile database (half-hourly or a rollup).
+    :param row_slice: Rows that are read.
+    :param col_slice: Columns that are read.
+    :param reduce: Function reducing a (time x rows x columns) block to a (time x series) array.
+    :param date_ranges: The windows of which the user wants the historic precipitation.
+    :param source: Temporal axis of the tile database.
+    :param aggregation: The periods the precipitation gets summed to.
+    :param max_read_values: Maximum number of values read from the tile database per query.
+    :return: List containing an array (periods x series) with the precipitation of every window.
+    """
+    windows = list(date_ranges)
+    time_slices = [source.slice(window) for window in windows]
+    n_cells = (row_slice.stop - row_slice.start) * (col_slice.stop - col_slice.start)
+    groups, values = [[]], 0
+    for index, time_slice in enumerate(time_slices):
+        length = (time_slice.stop - time_slice.start) * n_cells
+        if groups[-1] and values + length > max_read_values:
+            groups.append([])
+            values = 0
+        groups[-1].append(index)
+        values += length
+
+    results = []
+    for group in groups:
+        block = array.query(attrs=[IMERG_ATTRIBUTE]).multi_index[
+            [(time_slices[index].start, time_slices[index].stop - 1) for index in group],
+            [(row_slice.start, row_slice.stop - 1)], [(col_slice.start, col_slice.stop - 1)]][IMERG_ATTRIBUTE]
+        series = reduce(block)
+        lengths = [time_slices[index].stop - time_slices[index].start for index in group]
+        for index, part in zip(group, np.split(series, np.cumsum(lengths)[:-1])):
+            results.append(to_output(aggregate(part, period_offsets(source, aggregation, windows[index]))))
+    return results
+
+
+def get_point_window_precipitation(array: tiledb.DenseArray, row: int, col: int, date_ranges: DateRanges,
+                                   source: TimeAxis | Rollup = IMERG_TIME_AXIS,
+                                   aggregation: Rollup = HOURLY) -> list[np.ndarray]:
+    """
+    Reads the precipitation of one cell for every window, see get_multi_window_precipitation.
+
+    :param array: Opened IMERG tile database (half-hourly or a rollup).
+    :param row: Row (latitude) index of the cell.
+    :param col: Column (longitude) index of the cell.
+    :param date_ranges: The windows of which the user wants the historic precipitation.
+    :param source: Temporal axis of the tile database.
+    :param aggregation: The periods the precipitation gets summed to.
+    :return: List containing an array with the precipitation of every period of every window.
+    """
+    results = get_multi_window_precipitation(array, slice(row, row + 1), slice(col, col + 1),
+                                             lambda block: block.reshape(block.shape[0], 1), date_ranges, source,
+                                             aggregation)
+    return [result[:, 0] for result in results]
+
+
+def get_polygon_window_precipitation(array: tiledb.DenseArray, polygons: GeoSeries, date_ranges: DateRanges,
+                                     source: TimeAxis | Rollup = IMERG_TIME_AXIS,
+                                     aggregation: Rollup = HOURLY) -> list[np.ndarray]:
+    """
+    Reads the area-weighted precipitation of every polygon for every window, see get_multi_window_precipitation.
+
+    :param array: Opened IMERG tile database (half-hourly or a rollup).
+    :param polygons: GeoSeries (EPSG:4326) containing the polygons you want the precipitation of.
+    :param date_ranges: The windows of which the user wants the historic precipitation.
+    :param source: Temporal axis of the tile database.
+    :param aggregation: The periods the precipitation gets summed to.
+    :return: List containing an array (periods x polygons) with the precipitation of every window.
+    """
+    row_slice, col_slice, weights = IMERG_GRID.coverage(polygons)
+    return get_multi_window_precipitation(array, row_slice, col_slice, partial(_weighted_mean, weights=weights),
+                                          date_ranges, source, aggregation)
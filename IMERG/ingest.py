@@ -0,0 +1,219 @@
+"""
+ingest.py: Contains the pipeline that appends new half-hourly IMERG HDF5 granules to the IMERG tile database.
+
+Only granules after the last band stored in the tile database are read, so keeping the dataset current doesn't require
+rebuilding it. Granules are decoded in a process pool and written in chunks that line up with the tiles of the array.
+
+Usage: python -m IMERG.ingest <hdf5 directory> <tile database uri> --workers 8 --rollups
+"""
+
+__author__ = "Tim Rietdijk"
+__email__ = "tim.is@live.nl"
+__status__ = "Development"
+
+# standard imports:
+import argparse
+import glob
+import multiprocessing
+import os
+import pathlib
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+
+# third-party imports:
+import h5py
+import numpy as np
+import tiledb
+from dotenv import dotenv_values
+from numpy import datetime64
+
+# local imports:
+from exceptions import DateRangeOutOfBounds
+from IMERG.availability import Availability, update_availability
+from IMERG.dataset import get_tiledb_options
+from IMERG.grid_index import IMERG_GRID
+from IMERG.imerg_api import IMERG_ATTRIBUTE
+from IMERG.rollups import update_rollups
+from IMERG.time_axis import IMERG_TIME_AXIS
+
+IMERG_FILE_FORMAT = '%Y%m%d-S%H%M'
+IMERG_LAST_DATE = datetime64('2050-01-01T00:00', 'm')
+IMERG_DTYPE = np.float32
+# Shuffling the bits groups the (mostly zero) exponents and mantissas of neighbouring values, which compresses well.
+IMERG_FILTERS = (tiledb.BitShuffleFilter(), tiledb.ZstdFilter(level=7))
+
+
+def create_imerg_array(uri: str, ctx: tiledb.Ctx, time_tile: int = 48, space_tile: int = 100,
+                       dtype: np.dtype = IMERG_DTYPE, filters: tuple[tiledb.Filter, ...] = IMERG_FILTERS) -> None:
+    """
+    Creates an empty IMERG tile database. The temporal axis runs from the IMERG epoch up to 2050, so new granules can
+    keep being appended. The precipitation is stored as compressed float32 by default, the precision of the HDF5
+    granules, which takes a fraction of the bytes of uncompressed float64.
+
+    :param uri: Location of the tile database.
+    :param ctx: TileDB context containing the (S3) VFS options.
+    :param time_tile: Number of bands per tile.
+    :param space_tile: Number of rows and columns per tile.
+    :param dtype: Data type of the precipitation attribute.
+    :param filters: Filters (compression) applied to the precipitation attribute.
+    :return: None
+    """
+    n_bands = IMERG_TIME_AXIS.index(IMERG_LAST_DATE)
+    dom = tiledb.Domain(
+        tiledb.Dim(name='BANDS', domain=(0, n_bands - n_bands % time_tile - 1), tile=time_tile, dtype=np.uint64),
+        tiledb.Dim(name='X', domain=(0, IMERG_GRID.n_rows - 1), tile=space_tile, dtype=np.uint64),
+        tiledb.Dim(name='Y', domain=(0, IMERG_GRID.n_cols - 1), tile=space_tile, dtype=np.uint64), ctx=ctx)
+    attr = tiledb.Attr(name=IMERG_ATTRIBUTE, dtype=dtype, filters=tiledb.FilterList(filters))
+    schema = tiledb.ArraySchema(domain=dom, sparse=False, attrs=[attr], ctx=ctx)
+    tiledb.DenseArray.create(uri, schema, ctx=ctx)
+
+
+def list_granules(directory: str) -> dict[int, str]:
+    """
+    Lists the IMERG HDF5 granules in a directory by the band they belong to. Files whose name isn't a timestamp on the
+    half-hourly axis are skipped.
+
+    :param directory: Directory containing HDF5 files named YYYYMMDD-SHHMM.HDF5.
+    :return: Dictionary mapping the band index of every granule to its path.
+    """
+    granules = {}
+    for path in glob.glob(os.path.join(directory, '*.HDF5')):
+        try:
+            timestamp = datetime64(datetime.strptime(pathlib.Path(path).stem, IMERG_FILE_FORMAT), 'm')
+        except ValueError:
+            print(f"Skipping {path}: file name doesn't match {IMERG_FILE_FORMAT}")
+            continue
+        try:
+            granules[IMERG_TIME_AXIS.index(timestamp)] = path
+        except (ValueError, DateRangeOutOfBounds) as e:
+            print(f"Skipping {path}: {e}")
+    return granules
+
+
+def read_granule(path: str) -> np.ndarray:
+    """
+    Reads the precipitation of one granule and rotates it into the (rows, columns) orientation of the tile database,
+    with the northernmost row first. Fill values are replaced by NaN.
+
+    :param path: Location of the HDF5 granule.
+    :return: Array (rows x columns) containing the half-hourly precipitation.
+    """
+    with h5py.File(path, 'r') as file:
+        image = file['/Grid/precipitationCal'][0]
+    image = np.where(image > -9999, image, np.nan)
+    return np.rot90(image, 1)
+
+
+def ingest_granules(directory: str, uri: str, ctx: tiledb.Ctx, workers: int | None = None,
+                    max_chunk_bytes: int = 2 * 1024 ** 3, consolidate_every: int = 48) -> list[int]:
+    """
+    Appends every granule after the last stored band to the tile database. Granules are decoded in a process pool and
+    collected into chunks of consecutive granules that don't cross a tile boundary of the temporal axis (and fit in
+    max_chunk_bytes). Every chunk is written as one fragment. Fragments are consolidated and vacuumed after every
+    consolidate_every writes and once more at the end. Missing granules aren't written and read as NaN. The written
+    bands are added to the availability of the tile database along with every consolidation.
+
+    :param directory: Directory containing the HDF5 granules.
+    :param uri: Location of the tile database, created if it doesn't exist yet.
+    :param ctx: TileDB context containing the (S3) VFS options.
+    :param workers: Number of processes used to decode granules (default: number of cores).
+    :param max_chunk_bytes: Maximum size of a chunk kept in memory before it is written.
+    :param consolidate_every: Number of written fragments after which the tile database is consolidated.
+    :return: List containing the bands that were written.
+    """
+    if not tiledb.array_exists(uri, ctx=ctx):
+        create_imerg_array(uri, ctx)
+    with tiledb.open(uri, ctx=ctx) as array:
+        non_empty = array.nonempty_domain()
+        first_band = int(non_empty[0][1]) + 1 if non_empty else 0
+        time_tile = int(array.schema.domain.dim(0).tile)
+        dtype = array.attr(IMERG_ATTRIBUTE).dtype
+
+    granules = {band: path for band, path in list_granules(directory).items() if band >= first_band}
+    if not granules:
+        return []
+    granule_bytes = IMERG_GRID.n_rows * IMERG_GRID.n_cols * dtype.itemsize
+    chunk_bands = max(1, min(time_tile, max_chunk_bytes // granule_bytes))
+
+    # Chunks never span a missing granule: bands that are never written read as NaN, so gaps cost nothing.
+    chunks = []
+    for band in sorted(granules):
+        if chunks and chunks[-1][1] == band and band % time_tile and band - chunks[-1][0] < chunk_bands:
+            chunks[-1][1] = band + 1
+        else:
+            chunks.append([band, band + 1])
+
+    written, recorded, run_start = [], 0, int(time.time() * 1000)
+    # TileDB contexts don't survive a fork, so the workers are spawned.
+    with ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context('spawn')) as executor:
+        def submit(start: int, stop: int):
+            return [executor.submit(read_granule, granules[band]) for band in range(start, stop)]
+
+        pending = submit(*chunks[0])
+        for index, (chunk_start, chunk_stop) in enumerate(chunks):
+            images = pending
+            # Decoding of the next chunk already starts while this one is being collected and written.
+            if index + 1 < len(chunks):
+                pending = submit(*chunks[index + 1])
+            chunk = np.empty((chunk_stop - chunk_start, IMERG_GRID.n_rows, IMERG_GRID.n_cols), dtype=dtype)
+            for index_in_chunk, image in enumerate(images):
+                chunk[index_in_chunk] = image.result()
+            with tiledb.open(uri, 'w', ctx=ctx) as array:
+                array[chunk_start:chunk_stop] = {IMERG_ATTRIBUTE: chunk}
+            written.extend(range(chunk_start, chunk_stop))
+            if (index + 1) % consolidate_every == 0:
+                consolidate(uri, ctx, run_start)
+                update_availability(uri, ctx, written[recorded:])
+                recorded = len(written)
+    consolidate(uri, ctx, run_start)
+    update_availability(uri, ctx, written[recorded:])
+    return written
+
+
+def consolidate(uri: str, ctx: tiledb.Ctx, timestamp_start: int = 0) -> None:
+    """
+    Consolidates the fragments of the tile database written since timestamp_start and removes the consolidated
+    fragments. Limiting consolidation to recent fragments avoids rewriting the whole dataset on every run.
+
+    :param uri: Location of the tile database.
+    :param ctx: TileDB context containing the (S3) VFS options.
+    :param timestamp_start: Unix time in milliseconds from which fragments are consolidated.
+    :return: None
+    """
+    tiledb.consolidate(uri, config=tiledb.Config({'sm.consolidation.timestamp_start': str(timestamp_start)}), ctx=ctx)
+    tiledb.vacuum(uri, ctx=ctx)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Append new IMERG HDF5 granules to the IMERG tile database.")
+    parser.add_argument('directory', help="Directory containing the HDF5 granules")
+    parser.add_argument('uri', help="Location of the IMERG tile database")
+    parser.add_argument('--workers', type=int, help="Number of processes decoding granules (default: all cores)")
+    parser.add_argument('--consolidate-every', type=int, default=48,
+                        help="Number of written fragments after which the tile database is consolidated")
+    parser.add_argument('--rollups', action='store_true',
+                        help="Update the hourly, daily and monthly rollups afterwards")
+    parser.add_argument('--rebuild-availability', action='store_true',
+                        help="Record the availability of the ingested granules first, for tile databases ingested "
+                             "before it was kept")
+    parser.add_argument('--bounds', nargs=4, type=float, default=(4, 57.9, 31.5, 71.3),
+                        metavar=('MINX', 'MINY', 'MAXX', 'MAXY'), help="Area of new rollups (default: Norway)")
+    args = parser.parse_args()
+
+    context = tiledb.Ctx(tiledb.Config(get_tiledb_options(dotenv_values('.env'))))
+    if args.rebuild_availability and tiledb.array_exists(args.uri, ctx=context):
+        with tiledb.open(args.uri, ctx=context) as imerg:
+            non_empty = imerg.nonempty_domain()
+        last_band = int(non_empty[0][1]) if non_empty else -1
+        stored = [band for band in list_granules(args.directory) if band <= last_band]
+        Availability.from_bands(stored).write(args.uri, context)
+        print(f"Recorded the availability of {len(stored)} granules")
+    start_time = time.time()
+    ingested = ingest_granules(args.directory, args.uri, context, workers=args.workers,
+                               consolidate_every=args.consolidate_every)
+    print(f"Ingested {len(ingested)} granules in {time.time() - start_time} seconds")
+    if args.rollups and ingested:
+        start_time = time.time()
+        update_rollups(args.uri, context, slice(min(ingested), max(ingested) + 1), *IMERG_GRID.slices(args.bounds))
+        print(f"Updated rollups in {time.time() - start_time} seconds")
@@ -0,0 +1,140 @@
+"""
+migrate.py: Contains the tool that rewrites an IMERG tile database into the compact (compressed float32) format.
+
+The first IMERG tile databases store the precipitation as uncompressed float64, while the HDF5 granules only hold
+float32. Rewriting them as compressed float32 cuts the bytes every query fetches from S3 without losing anything. For
+a further cut, the lowest bits of every mantissa can be zeroed (--keep-bits), which makes the values compress much
+better at the cost of a small, reported, error.
+
+Usage: python -m IMERG.migrate <source uri> <target uri> --keep-bits 12
+"""
+
+__author__ = "Tim Rietdijk"
+__email__ = "tim.is@live.nl"
+__status__ = "Development"
+
+# standard imports:
+import argparse
+import time
+
+# third-party imports:
+import numpy as np
+import tiledb
+from dotenv import dotenv_values
+
+# local imports:
+from IMERG.dataset import get_tiledb_options
+from IMERG.ingest import IMERG_DTYPE, IMERG_FILTERS
+
+
+def trim_mantissa(values: np.ndarray, keep_bits: int) -> np.ndarray:
+    """
+    Rounds float32 values to keep_bits bits of mantissa by zeroing the bits below them. The relative error stays below
+    2 ** -(keep_bits + 1), NaN stays NaN.
+
+    :param values: Array (float32) containing the values.
+    :param keep_bits: Number of mantissa bits kept (0 - 23).
+    :return: Array (float32) containing the rounded values.
+    """
+    if keep_bits >= 23:
+        return values
+    drop_bits = 23 - keep_bits
+    bits = values.view(np.uint32)
+    rounded = ((bits + np.uint32(1 << (drop_bits - 1))) & np.uint32(~((1 << drop_bits) - 1) & 0xFFFFFFFF))
+    return np.where(np.isnan(values), values, rounded.view(np.float32))
+
+
+def create_compact_array(source_uri: str, target_uri: str, ctx: tiledb.Ctx,
+                         filters: tuple[tiledb.Filter, ...] = IMERG_FILTERS) -> None:
+    """
+    Creates an empty tile database with the domain, tiling and metadata of the source, storing its attribute as
+    compressed float32.
+
+    :param source_uri: Location of the original tile database.
+    :param target_uri: Location of the compact tile database.
+    :param ctx: TileDB context containing the (S3) VFS options.
+    :param filters: Filters (compression) applied to the attribute.
+    :return: None
+    """
+    with tiledb.open(source_uri, ctx=ctx) as source:
+        domain = source.schema.domain
+        attr = source.schema.attr(0)
+        meta = dict(source.meta.items())
+    schema = tiledb.ArraySchema(domain=domain, sparse=False,
+                                attrs=[tiledb.Attr(name=attr.name, dtype=IMERG_DTYPE,
+                                                   filters=tiledb.FilterList(filters))], ctx=ctx)
+    tiledb.DenseArray.create(target_uri, schema, ctx=ctx)
+    with tiledb.open(target_uri, 'w', ctx=ctx) as target:
+        for key, value in meta.items():
+            target.meta[key] = value
+
+
+def migrate(source_uri: str, target_uri: str, ctx: tiledb.Ctx, keep_bits: int = 23,
+            max_read_bytes: int = 2 * 1024 ** 3) -> dict[str, float]:
+    """
+    Copies the non-empty domain of the source into the compact tile database. Every write covers whole time tiles
+    over a strip of rows of at most max_read_bytes. Every strip is compared with the values that were written, so the
+    report holds the largest absolute error introduced by the migration.
+
+    :param source_uri: Location of the original tile database.
+    :param target_uri: Location of the compact tile database, created if it doesn't exist yet.
+    :param ctx: TileDB context containing the (S3) VFS options.
+    :param keep_bits: Number of mantissa bits kept (23 keeps the full float32 precision).
+    :param max_read_bytes: Maximum number of bytes read from the source at once.
+    :return: Dictionary containing the maximum absolute error, whether missing values were preserved, whether every
+    band of the non-empty domain was copied, the size of both tile databases and the time the migration took.
+    """
+    start_time = time.time()
+    if not tiledb.array_exists(target_uri, ctx=ctx):
+        create_compact_array(source_uri, target_uri, ctx)
+
+    max_abs_error, missing_preserved, copied_bands = 0.0, True, 0
+    with tiledb.open(source_uri, ctx=ctx) as source, tiledb.open(target_uri, 'w', ctx=ctx) as target:
+        attribute = source.schema.attr(0).name
+        (band_start, band_stop), (row_start, row_stop), (col_start, col_stop) = \
+            ((int(start), int(stop) + 1) for start, stop in source.nonempty_domain())
+        band_dim = source.schema.domain.dim(0)
+        time_tile = int(band_dim.tile)
+        itemsize = source.schema.attr(0).dtype.itemsize
+        strip_rows = max(1, max_read_bytes // (time_tile * (col_stop - col_start) * itemsize))
+        # Writes follow the time tiles, which are counted from the start of the domain. The first and last write are
+        # cut to the non-empty domain when it doesn't start or end on a tile boundary.
+        first_tile = band_start - (band_start - int(band_dim.domain[0])) % time_tile
+        for tile_start in range(first_tile, band_stop, time_tile):
+            bands = slice(max(tile_start, band_start), min(tile_start + time_tile, band_stop))
+            copied_bands += bands.stop - bands.start
+            for row in range(row_start, row_stop, strip_rows):
+                rows = slice(row, min(row + strip_rows, row_stop))
+                original = source[bands, rows, col_start:col_stop][attribute]
+                compact = trim_mantissa(original.astype(IMERG_DTYPE), keep_bits)
+                target[bands, rows, col_start:col_stop] = {attribute: compact}
+                missing = np.isnan(original)
+                missing_preserved &= bool(np.array_equal(missing, np.isnan(compact)))
+                if not missing.all():
+                    max_abs_error = max(max_abs_error,
+                                        float(np.abs(compact[~missing].astype(np.float64) - original[~missing]).max()))
+    tiledb.consolidate(target_uri, ctx=ctx)
+    tiledb.vacuum(target_uri, ctx=ctx)
+
+    vfs = tiledb.VFS(ctx=ctx)
+    return {'max_abs_error': max_abs_error, 'missing_preserved': missing_preserved,
+            'complete': copied_bands == band_stop - band_start, 'source_bytes': vfs.dir_size(source_uri),
+            'target_bytes': vfs.dir_size(target_uri),
+            'seconds': time.time() - start_time}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Rewrite an IMERG tile database as compressed float32.")
+    parser.add_argument('source', help="Location of the original IMERG tile database")
+    parser.add_argument('target', help="Location of the compact IMERG tile database")
+    parser.add_argument('--keep-bits', type=int, default=23,
+                        help="Mantissa bits to keep, lower values compress better (default: 23, lossless float32)")
+    args = parser.parse_args()
+
+    context = tiledb.Ctx(tiledb.Config(get_tiledb_options(dotenv_values('.env'))))
+    report = migrate(args.source, args.target, context, keep_bits=args.keep_bits)
+    print(f"Migrated {args.source} to {args.target} in {report['seconds']} seconds")
+    print(f"Size: {report['source_bytes']} -> {report['target_bytes']} bytes "
+          f"({report['source_bytes'] / max(report['target_bytes'], 1):.1f}x smaller)")
+    print(f"Maximum absolute error: {report['max_abs_error']}, "
+          f"missing values preserved: {report['missing_preserved']}, all bands copied: {report['complete']}")
@@ -0,0 +1,127 @@
+"""
+parallel.py: Contains the class 'ImergScheduler' which reads long IMERG time ranges as parallel, tile-aligned chunks.
+
+A single slice over a multi-year range is one serial query that waits on S3 for every tile in turn. Splitting the range
+on the tile boundaries of the temporal axis turns it into independent reads that run concurrently, so all cores are used
+and the latency of the requests to S3 overlaps. Every chunk is reduced (to hourly values or polygon means) as soon as it
+is read, so only the small reduced chunks are kept in memory.
+"""
+
+__author__ = "Tim Rietdijk"
+__email__ = "tim.is@live.nl"
+__status__ = "Development"
+
+# standard imports:
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable
+
+# third-party imports:
+import dask
+import numpy as np
+import tiledb
+
+
+class _ArraySnapshot:
+    def __init__(self, array: tiledb.DenseArray) -> None:
+        """
+        A picklable reference to the state of an opened tile database, used by the workers of a distributed scheduler
+        to open the same snapshot the request is reading from.
+        """
+        self.uri = array.uri
+        self.config = array.ctx.config().dict()
+        self.timestamp = array.timestamp_range
+
+    def __getitem__(self, subarray: tuple[slice, ...]) -> dict[str, np.ndarray]:
+        with tiledb.open(self.uri, ctx=tiledb.Ctx(tiledb.Config(self.config)), timestamp=self.timestamp) as array:
+            return array[subarray]
+
+
+def tile_chunks(array: tiledb.DenseArray, time_slice: slice, chunk_tiles: int = 1) -> list[slice]:
+    """
+    Splits a range of bands on the tile boundaries of the temporal axis, so no tile is fetched by two chunks.
+
+    :param array: Opened tile database.
+    :param time_slice: Bands that will be read.
+    :param chunk_tiles: Number of tiles per chunk.
+    :return: List containing a slice of bands for every chunk.
+    """
+    band_dim = array.schema.domain.dim(0)
+    domain_start, step = int(band_dim.domain[0]), int(band_dim.tile) * chunk_tiles
+    boundaries = range(time_slice.start - (time_slice.start - domain_start) % step + step, time_slice.stop, step)
+    starts = [time_slice.start, *boundaries]
+    return [slice(start, stop) for start, stop in zip(starts, [*boundaries, time_slice.stop])]
+
+
+def _read_chunk(array: tiledb.DenseArray | _ArraySnapshot, subarray: tuple[slice, ...], attribute: str,
+                reduce: Callable[[np.ndarray], np.ndarray]) -> np.ndarray:
+    return reduce(array[subarray][attribute])
+
+
+class ImergScheduler:
+    def __init__(self, address: str | None = None, workers: int | None = None, chunk_tiles: int = 1) -> None:
+        """
+        The scheduler shared by all requests that read in parallel. By default chunks are read by a local pool of
+        threads, which share the opened tile database of the request. When the address of a Dask scheduler is given the
+        chunks are read by its (distributed) workers instead, each opening the same snapshot of the tile database.
+
+        :param address: Address of a Dask distributed scheduler, for example tcp://127.0.0.1:8786.
+        :param workers: Number of threads of the local pool (default: number of cores + 4).
+        :param chunk_tiles: Number of tiles of the temporal axis read by one task.
+        """
+        self.address = address
+        self.workers = workers
+        self.chunk_tiles = chunk_tiles
+        self._pool: ThreadPoolExecutor | None = None
+        self._client = None
+
+    def __str__(self):
+        return self.address or f"threads({self.workers or 'auto'})"
+
+    def start(self) -> None:
+        """
+        Starts the thread pool or connects to the distributed scheduler.
+
+        :return: None
+        """
+        if self.address and self._client is None:
+            from dask.distributed import Client
+            self._client = Client(self.address)
+        elif not self.address and self._pool is None:
+            self._pool = ThreadPoolExecutor(self.workers, thread_name_prefix='ImergScheduler')
+
+    def close(self) -> None:
+        """
+        Shuts the thread pool down or disconnects from the distributed scheduler.
+
+        :return: None
+        """
+        if self._client is not None:
+            self._client.close()
+            self._client = None
+        if self._pool is not None:
+            self._pool.shutdown()
+            self._pool = None
+
+    def read(self, array: tiledb.DenseArray, subarray: tuple[slice, slice, slice],
+             reduce: Callable[[np.ndarray], np.ndarray]) -> np.ndarray:
+        """
+        Reads the subarray as tile-aligned chunks of bands in parallel. Every chunk is reduced as soon as it is read
+        and the reduced chunks are concatenated along the first axis, so the reduction must keep the bands of a chunk
+        together.
+
+        :param array: Opened tile database.
+        :param subarray: Slice for the bands, rows and columns that will be read.
+        :param reduce: Function applied to every chunk (bands x rows x columns).
+        :return: Array containing the concatenated reduced chunks.
+        """
+        self.start()
+        time_slice, row_slice, col_slice = subarray
+        source = array if self._client is None else _ArraySnapshot(array)
+        attribute = array.schema.attr(0).name
+        tasks = [dask.delayed(_read_chunk)(source, (chunk, row_slice, col_slice), attribute, reduce)
+                 for chunk in tile_chunks(array, time_slice, self.chunk_tiles)]
+        if self._client is not None:
+            chunks = dask.compute(*tasks, scheduler=self._client)
+        else:
+            chunks = dask.compute(*tasks, scheduler='threads', pool=self._pool)
+        return np.concatenate(chunks, axis=0)
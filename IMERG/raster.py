@@ -0,0 +1,184 @@
+"""
+raster.py: Contains the functions that read IMERG precipitation fields and render them as map tiles.
+
+Animating rainfall on a map needs the whole field of every time step, which per-point queries would fetch pixel by
+pixel. A field is read here with a single query: one band of the half-hourly tile database or one period of a rollup
+over the requested area. Fields are returned as NumPy arrays or as coloured PNGs, either on the IMERG grid (bbox) or
+resampled to web mercator XYZ tiles, which the API keeps in a disk cache.
+"""
+
+__author__ = "Tim Rietdijk"
+__email__ = "tim.is@live.nl"
+__status__ = "Development"
+
+# standard imports:
+import io
+import struct
+import zlib
+
+# third-party imports:
+import numpy as np
+from numpy import datetime64
+
+# local imports:
+from exceptions import DateRangeOutOfBounds
+from IMERG.dataset import ImergDataset, ImergLayouts, covers
+from IMERG.grid_index import IMERG_GRID
+from IMERG.imerg_api import IMERG_ATTRIBUTE
+from IMERG.rollups import Rollup
+from IMERG.time_axis import IMERG_TIME_AXIS
+
+TILE_SIZE = 256
+# Mean intensity (mm/h) at which every colour starts, below the first level the pixel is transparent.
+RAIN_LEVELS = np.array([0.1, 0.5, 1, 2, 4, 8, 16, 32])
+RAIN_COLOURS = np.array([[0, 0, 0, 0], [166, 219, 255, 160], [99, 180, 255, 190], [33, 120, 240, 210],
+                         [20, 170, 80, 220], [250, 220, 30, 230], [250, 140, 20, 240], [230, 30, 30, 250],
+                         [170, 0, 170, 255]], dtype=np.uint8)
+
+
+def period_bands(timestamp: datetime64, aggregation: Rollup | None) -> slice:
+    """
+    Returns the half-hourly bands of the period containing the timestamp.
+
+    :param timestamp: Timestamp within the period.
+    :param aggregation: The rollup the period belongs to, None for the half-hour starting at the timestamp.
+    :return: Slice of the half-hourly bands of the period.
+    """
+    if aggregation is None:
+        band = IMERG_TIME_AXIS.index(timestamp)
+        return slice(band, band + 1)
+    period = aggregation.index(timestamp)
+    return slice(IMERG_TIME_AXIS.index(aggregation.timestamp(period)),
+                 IMERG_TIME_AXIS.index(aggregation.timestamp(period + 1)))
+
+
+def tile_pixels(z: int, x: int, y: int, size: int = TILE_SIZE) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Returns the cells of the IMERG grid under the centres of the pixels of a web mercator (XYZ) tile.
+
+    :param z: Zoom level of the tile.
+    :param x: Column of the tile.
+    :param y: Row of the tile, counted from the north.
+    :param size: Number of pixels along each side of the tile.
+    :return: tuple containing the grid row of every row of pixels and the grid column of every column of pixels.
+    """
+    n_pixels = size * 2 ** z
+    lons = (x * size + np.arange(size) + 0.5) / n_pixels * 360 - 180
+    lats = np.degrees(np.arctan(np.sinh(np.pi * (1 - 2 * (y * size + np.arange(size) + 0.5) / n_pixels))))
+    rows, _ = IMERG_GRID.cell(np.zeros(size), lats)
+    _, cols = IMERG_GRID.cell(lons, np.zeros(size))
+    return rows, cols
+
+
+def read_field(layouts: ImergLayouts, rollups: dict[str, ImergDataset], timestamp: datetime64,
+               aggregation: Rollup | None, row_slice: slice, col_slice: slice,
+               max_read_values: int = 2 ** 27) -> tuple[np.ndarray, int]:
+    """
+    Reads the precipitation of one period over an area with a single query. Aggregated periods are read from their
+    rollup when it holds the area, otherwise the half-hourly bands of the period are read in one slab and summed.
+    Cells with a missing half-hour are NaN.
+
+    :param layouts: The half-hourly IMERG tile databases.
+    :param rollups: The rollup tile databases by rollup name.
+    :param timestamp: Timestamp within the period.
+    :param aggregation: The rollup the period belongs to, None for a single half-hour.
+    :param row_slice: Rows of the area.
+    :param col_slice: Columns of the area.
+    :param max_read_values: Maximum number of half-hourly values read for one field.
+    :return: tuple containing the (rows x columns) field and the number of half-hours summed into it.
+    """
+    bands = period_bands(timestamp, aggregation)
+    availability = layouts.availability
+    if availability is not None and not availability.contains(bands):
+        raise DateRangeOutOfBounds(timestamp, IMERG_TIME_AXIS.timestamp(availability.first),
+                                   IMERG_TIME_AXIS.timestamp(availability.last))
+    n_bands = bands.stop - bands.start
+    dataset = rollups.get(aggregation.name) if aggregation is not None else None
+    if dataset is not None and dataset.is_ready:
+        period = aggregation.index(timestamp)
+        with dataset.reader() as array:
+            if covers(array, (slice(period, period + 1), row_slice, col_slice)):
+                return array[period:period + 1, row_slice, col_slice][IMERG_ATTRIBUTE][0], n_bands
+    if n_bands * (row_slice.stop - row_slice.start) * (col_slice.stop - col_slice.start) > max_read_values:
+        raise ValueError(f"The area is too large to sum {n_bands} half-hours without the {aggregation} rollup")
+    with layouts.reader((bands, row_slice, col_slice)) as array:
+        return array[bands, row_slice, col_slice][IMERG_ATTRIBUTE].sum(axis=0, dtype=np.float64), n_bands
+
+
+def read_tile(layouts: ImergLayouts, rollups: dict[str, ImergDataset], timestamp: datetime64,
+              aggregation: Rollup | None, z: int, x: int, y: int) -> tuple[np.ndarray, int]:
+    """
+    Reads the precipitation of one period resampled (nearest cell) to a web mercator tile. The cells under the tile
+    are read with a single query.
+
+    :param layouts: The half-hourly IMERG tile databases.
+    :param rollups: The rollup tile databases by rollup name.
+    :param timestamp: Timestamp within the period.
+    :param aggregation: The rollup the period belongs to, None for a single half-hour.
+    :param z: Zoom level of the tile.
+    :param x: Column of the tile.
+    :param y: Row of the tile, counted from the north.
+    :return: tuple containing the (pixels x pixels) field and the number of half-hours summed into it.
+    """
+    rows, cols = tile_pixels(z, x, y)
+    row_slice, col_slice = slice(int(rows.min()), int(rows.max()) + 1), slice(int(cols.min()), int(cols.max()) + 1)
+    field, n_bands = read_field(layouts, rollups, timestamp, aggregation, row_slice, col_slice)
+    return field[np.ix_(rows - row_slice.start, cols - col_slice.start)], n_bands
+
+
+def encode_png(rgba: np.ndarray) -> bytes:
+    """
+    Encodes an RGBA image as PNG, with zlib from the standard library.
+
+    :param rgba: Array (height x width x 4) of uint8 containing the image.
+    :return: Bytes of the PNG file.
+    """
+    height, width = rgba.shape[:2]
+    scanlines = np.concatenate([np.zeros((height, 1), dtype=np.uint8), rgba.reshape(height, -1)], axis=1)
+
+    def chunk(kind: bytes, data: bytes) -> bytes:
+        return struct.pack('>I', len(data)) + kind + data + struct.pack('>I', zlib.crc32(kind + data))
+
+    return b'\x89PNG\r\n\x1a\n' + chunk(b'IHDR', struct.pack('>IIBBBBB', width, height, 8, 6, 0, 0, 0)) + \
+        chunk(b'IDAT', zlib.compress(scanlines.tobytes(), 6)) + chunk(b'IEND', b'')
+
+
+def render_png(field: np.ndarray, n_bands: int) -> bytes:
+    """
+    Colours a precipitation field by its mean intensity, so the colours mean the same for every aggregation. Dry and
+    missing cells are transparent.
+
+    :param field: Array (rows x columns) containing the summed half-hourly precipitation.
+    :param n_bands: Number of half-hours summed into the field.
+    :return: Bytes of the PNG file.
+    """
+    with np.errstate(invalid='ignore'):
+        levels = np.searchsorted(RAIN_LEVELS, field / n_bands, side='right')
+    levels[np.isnan(field)] = 0
+    return encode_png(RAIN_COLOURS[levels])
+
+
+def encode_npy(field: np.ndarray) -> bytes:
+    """
+    Encodes a precipitation field as a float32 .npy file, NaN where it is missing.
+
+    :param field: Array (rows x columns) containing the precipitation.
+    :return: Bytes of the .npy file.
+    """
+    stream = io.BytesIO()
+    np.save(stream, field.astype(np.float32), allow_pickle=False)
+    return stream.getvalue()
+
+
+def field_bounds(row_slice: slice, col_slice: slice) -> tuple[float, float, float, float]:
+    """
+    Returns the outer edges of the cells of a field, which are the bounds a client places the field at.
+
+    :param row_slice: Rows of the field.
+    :param col_slice: Columns of the field.
+    :return: tuple containing minx, miny, maxx, maxy in EPSG:4326.
+    """
+    return (round(IMERG_GRID.west + col_slice.start * IMERG_GRID.resolution, 6),
+            round(IMERG_GRID.north - row_slice.stop * IMERG_GRID.resolution, 6),
+            round(IMERG_GRID.west + col_slice.stop * IMERG_GRID.resolution, 6),
+            round(IMERG_GRID.north - row_slice.start * IMERG_GRID.resolution, 6))
@@ -0,0 +1,285 @@
+"""
+rollups.py: Contains the pre-aggregated (hourly, daily and monthly) companion tile databases of the IMERG dataset.
+
+Every rollup stores the precipitation sum per cell for one calendar period and is built from the next finer one: the
+hourly rollup from the half-hourly bands, the daily rollup from the hourly one and the monthly rollup from the daily
+one. A period containing a missing half-hour sums to NaN. Reads are answered from the coarsest rollup of which the
+periods line up with the requested date range.
+
+Usage: python -m IMERG.rollups <tile database uri> --bands 0 17520
+"""
+
+__author__ = "Tim Rietdijk"
+__email__ = "tim.is@live.nl"
+__status__ = "Development"
+
+# standard imports:
+import argparse
+import time
+from contextlib import contextmanager, ExitStack
+from datetime import datetime
+from typing import Iterator
+
+# third-party imports:
+import numpy as np
+import tiledb
+from dotenv import dotenv_values
+from numpy import datetime64
+
+# local imports:
+from date_range import DateRange, DateRanges
+from IMERG.dataset import ImergDataset, ImergLayouts, covers, get_tiledb_options
+from IMERG.grid_index import IMERG_GRID
+from IMERG.time_axis import IMERG_EPOCH, IMERG_STEP, IMERG_TIME_AXIS, TimeAxis
+
+
+class Rollup:
+    def __init__(self, name: str, unit: str, time_tile: int, space_tile: int) -> None:
+        """
+        A temporal axis of calendar periods (hours, days or months) starting at the IMERG epoch.
+
+        :param name: Name of the rollup, used as suffix of its tile database.
+        :param unit: Numpy datetime unit of a period ('h', 'D' or 'M').
+        :param time_tile: Number of periods per tile.
+        :param space_tile: Number of rows and columns per tile.
+        """
+        self.name = name
+        self.unit = unit
+        self.time_tile = time_tile
+        self.space_tile = space_tile
+        self.epoch = IMERG_EPOCH.astype(f'M8[{unit}]')
+
+    def __str__(self):
+        return self.name
+
+    def index(self, timestamp: datetime64) -> int:
+        """
+        Returns the index of the period containing the timestamp.
+
+        :param timestamp: Timestamp within the period.
+        :return: Integer representing the index of the period.
+        """
+        return int((timestamp.astype(f'M8[{self.unit}]') - self.epoch).astype(np.int64))
+
+    def timestamp(self, index: int) -> datetime64:
+        """
+        Returns the first timestamp of a period.
+
+        :param index: Index of the period.
+        :return: Datetime64 (minutes) representing the start of the period.
+        """
+        return (self.epoch + np.timedelta64(index, self.unit)).astype('M8[m]')
+
+    def slice(self, date_range: DateRange) -> slice:
+        """
+        Returns the periods that overlap with the date range.
+
+        :param date_range: The date range of which the user wants the historic precipitation.
+        :return: Slice from the first up to and including the last period of the date range.
+        """
+        return slice(self.index(date_range.min_date), self.index(date_range.max_date) + 1)
+
+    def lines_up_with(self, date_range: DateRange) -> bool:
+        """
+        Checks whether the date range starts and ends on period boundaries, so the periods hold exactly the data of
+        the date range.
+
+        :param date_range: The date range of which the user wants the historic precipitation.
+        :return: Boolean representing whether the date range consists of whole periods.
+        """
+        time_slice = self.slice(date_range)
+        return self.timestamp(time_slice.start) == date_range.min_date and \
+            self.timestamp(time_slice.stop) == date_range.max_date + IMERG_STEP
+
+
+HOURLY = Rollup('hourly', 'h', time_tile=720, space_tile=16)
+DAILY = Rollup('daily', 'D', time_tile=366, space_tile=16)
+MONTHLY = Rollup('monthly', 'M', time_tile=12, space_tile=64)
+ROLLUPS = {rollup.name: rollup for rollup in (HOURLY, DAILY, MONTHLY)}
+
+
+def rollup_uri(uri: str, rollup: Rollup) -> str:
+    """
+    Returns the location of a rollup of a tile database.
+
+    :param uri: Location of the half-hourly tile database.
+    :param rollup: The rollup.
+    :return: String representing the location of the rollup.
+    """
+    return f"{uri.rstrip('/')}_{rollup.name}"
+
+
+def period_starts(aggregation: Rollup, date_range: DateRange) -> list[datetime64]:
+    """
+    Returns the start of every period of the aggregation within the date range. The first period is clipped to the
+    start of the date range.
+
+    :param aggregation: The periods the values get aggregated to.
+    :param date_range: The date range of which the user wants the historic precipitation.
+    :return: List containing the start of every (clipped) period.
+    """
+    periods = aggregation.slice(date_range)
+    return [max(aggregation.timestamp(index), date_range.min_date) for index in range(periods.start, periods.stop)]
+
+
+def period_offsets(source: TimeAxis | Rollup, aggregation: Rollup, date_range: DateRange) -> np.ndarray:
+    """
+    Calculates where every period of the aggregation starts within the date range, as offsets into the values read
+    from the source axis.
+
+    :param source: Temporal axis of the values that get aggregated.
+    :param aggregation: The periods the values get aggregated to.
+    :param date_range: The date range of which the user wants the historic precipitation.
+    :return: Array containing the offsets for np.add.reduceat.
+    """
+    first_index = source.index(date_range.min_date)
+    return np.array([source.index(start) - first_index for start in period_starts(aggregation, date_range)])
+
+
+def aggregate(values: np.ndarray, offsets: np.ndarray) -> np.ndarray:
+    """
+    Sums the values along the first axis into the periods starting at the offsets. The sums are accumulated in
+    float64, so long periods of float32 values don't lose precision.
+
+    :param values: Array of which the first axis is time.
+    :param offsets: Index of the first value of every period.
+    :return: Array (float64) containing the sum of every period.
+    """
+    return np.add.reduceat(values, offsets, axis=0, dtype=np.float64)
+
+
+def unix_list(timestamps: list[datetime64]) -> list[int]:
+    """
+    Converts timestamps to unix time in milliseconds, the same way DateRange.unix_list does.
+
+    :param timestamps: List of datetime64 timestamps.
+    :return: List of unix time integers.
+    """
+    return [int(time.mktime(t.astype(datetime).timetuple())) * 1000 for t in timestamps]
+
+
+@contextmanager
+def aggregation_reader(layouts: ImergLayouts, rollups: dict[str, ImergDataset], aggregation: Rollup | None,
+                       date_range: DateRange | DateRanges, row_slice: slice, col_slice: slice) \
+        -> Iterator[tuple[tiledb.DenseArray, TimeAxis | Rollup]]:
+    """
+    Lends the tile database best suited to answer the request at the given aggregation: the coarsest rollup that isn't
+    coarser than the aggregation, lines up with the date range and holds the requested cells. Falls back to the
+    half-hourly layouts. Date ranges outside the availability of the half-hourly tile database are rejected. With
+    several windows the tile database has to line up with, and hold, every window.
+
+    :param layouts: The half-hourly IMERG tile databases.
+    :param rollups: The rollup tile databases by rollup name.
+    :param aggregation: The periods the user wants the precipitation summed to, None for the half-hourly bands.
+    :param date_range: The date range, or windows, of which the user wants the historic precipitation.
+    :param row_slice: Rows that will be read.
+    :param col_slice: Columns that will be read.
+    :return: tuple containing the opened tile database and its temporal axis.
+    """
+    windows = list(date_range) if isinstance(date_range, DateRanges) else [date_range]
+
+    def span(source: TimeAxis | Rollup) -> slice:
+        return slice(source.slice(windows[0]).start, source.slice(windows[-1]).stop)
+
+    availability = layouts.availability
+    if availability is not None:
+        for window in windows:
+            availability.check(window)
+    candidates = list(ROLLUPS.values())[:list(ROLLUPS.values()).index(aggregation) + 1] if aggregation else []
+    with ExitStack() as stack:
+        for rollup in reversed(candidates):
+            dataset = rollups.get(rollup.name)
+            if dataset is None or not dataset.is_ready or not all(rollup.lines_up_with(window) for window in windows):
+                continue
+            array = stack.enter_context(dataset.reader())
+            if covers(array, (span(rollup), row_slice, col_slice)):
+                yield array, rollup
+                return
+        array = stack.enter_context(layouts.reader((span(IMERG_TIME_AXIS), row_slice, col_slice)))
+        yield array, IMERG_TIME_AXIS
+
+
+def create_rollup_array(uri: str, rollup: Rollup, ctx: tiledb.Ctx, row_slice: slice, col_slice: slice) -> None:
+    """
+    Creates an empty rollup tile database reaching as far into the future as the half-hourly tile database.
+
+    :param uri: Location of the half-hourly tile database.
+    :param rollup: The rollup that gets created.
+    :param ctx: TileDB context containing the (S3) VFS options.
+    :param row_slice: Rows of the half-hourly tile database that will be aggregated.
+    :param col_slice: Columns of the half-hourly tile database that will be aggregated.
+    :return: None
+    """
+    with tiledb.open(uri, ctx=ctx) as source:
+        band_dim, row_dim, col_dim = source.schema.domain
+        attr = source.schema.attr(0)
+    n_periods = rollup.index(IMERG_TIME_AXIS.timestamp(int(band_dim.domain[1]))) + 1
+    dom = tiledb.Domain(
+        tiledb.Dim(name=band_dim.name, domain=(0, -(-n_periods // rollup.time_tile) * rollup.time_tile - 1),
+                   tile=rollup.time_tile, dtype=band_dim.dtype),
+        tiledb.Dim(name=row_dim.name, domain=row_dim.domain, tile=rollup.space_tile, dtype=row_dim.dtype),
+        tiledb.Dim(name=col_dim.name, domain=col_dim.domain, tile=rollup.space_tile, dtype=col_dim.dtype), ctx=ctx)
+    schema = tiledb.ArraySchema(domain=dom, sparse=False,
+                                attrs=[tiledb.Attr(name=attr.name, dtype=attr.dtype, filters=attr.filters)], ctx=ctx)
+    tiledb.DenseArray.create(rollup_uri(uri, rollup), schema, ctx=ctx)
+    with tiledb.open(rollup_uri(uri, rollup), 'w', ctx=ctx) as target:
+        target.meta['rows'] = (row_slice.start, row_slice.stop)
+        target.meta['cols'] = (col_slice.start, col_slice.stop)
+        target.meta['bands'] = (0, 0)
+
+
+def update_rollups(uri: str, ctx: tiledb.Ctx, band_slice: slice, row_slice: slice, col_slice: slice,
+                   max_read_bytes: int = 2 * 1024 ** 3) -> None:
+    """
+    Recalculates every period of every rollup that contains one of the changed half-hourly bands. Each rollup is
+    built from the next finer one, reading the finer periods in strips of rows of at most max_read_bytes. Rollups
+    that don't exist yet are created over the given rows and columns.
+
+    :param uri: Location of the half-hourly tile database.
+    :param ctx: TileDB context containing the (S3) VFS options.
+    :param band_slice: Half-hourly bands that changed.
+    :param row_slice: Rows to aggregate when a rollup gets created.
+    :param col_slice: Columns to aggregate when a rollup gets created.
+    :param max_read_bytes: Maximum number of bytes read from the finer tile database at once.
+    :return: None
+    """
+    source_uri, source, changed = uri, IMERG_TIME_AXIS, band_slice
+    for rollup in ROLLUPS.values():
+        target_uri = rollup_uri(uri, rollup)
+        if not tiledb.array_exists(target_uri, ctx=ctx):
+            create_rollup_array(uri, rollup, ctx, row_slice, col_slice)
+        with tiledb.open(target_uri, ctx=ctx) as target:
+            row_start, row_stop = target.meta['rows']
+            col_start, col_stop = target.meta['cols']
+            first_period, last_period = target.meta['bands']
+            attribute = target.schema.attr(0).name
+            dtype = target.schema.attr(0).dtype
+
+        periods = slice(rollup.index(source.timestamp(changed.start)),
+                        rollup.index(source.timestamp(changed.stop - 1)) + 1)
+        offsets = np.array([source.index(rollup.timestamp(index)) for index in range(periods.start, periods.stop + 1)])
+        strip_rows = max(1, max_read_bytes // ((offsets[-1] - offsets[0]) * (col_stop - col_start) * dtype.itemsize))
+        with tiledb.open(source_uri, ctx=ctx) as finer, tiledb.open(target_uri, 'w', ctx=ctx) as target:
+            for row in range(row_start, row_stop, strip_rows):
+                rows = slice(row, min(row + strip_rows, row_stop))
+                values = finer[offsets[0]:offsets[-1], rows, col_start:col_stop][attribute]
+                sums = aggregate(values, offsets[:-1] - offsets[0]).astype(dtype, copy=False)
+                target[periods, rows, col_start:col_stop] = {attribute: sums}
+            target.meta['bands'] = (periods.start if first_period == last_period else min(first_period, periods.start),
+                                    max(last_period, periods.stop))
+        source_uri, source, changed = target_uri, rollup, periods
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Update the hourly, daily and monthly IMERG rollups.")
+    parser.add_argument('uri', help="Location of the half-hourly IMERG tile database")
+    parser.add_argument('--bands', nargs=2, type=int, metavar=('START', 'STOP'), required=True,
+                        help="Half-hourly bands that changed")
+    parser.add_argument('--bounds', nargs=4, type=float, default=(4, 57.9, 31.5, 71.3),
+                        metavar=('MINX', 'MINY', 'MAXX', 'MAXY'), help="Area of new rollups (default: Norway)")
+    args = parser.parse_args()
+
+    context = tiledb.Ctx(tiledb.Config(get_tiledb_options(dotenv_values('.env'))))
+    start_time = time.time()
+    update_rollups(args.uri, context, slice(*args.bands), *IMERG_GRID.slices(args.bounds))
+    print(f"Updated rollups in {time.time() - start_time} seconds")
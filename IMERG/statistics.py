@@ -0,0 +1,202 @@
+"""
+statistics.py: Contains the reductions of IMERG precipitation that are computed inside the service: maxima of rolling
+window sums, threshold exceedances and annual maxima.
+
+IDF and design-storm analyses only need a handful of numbers per location, but computing them client-side means
+downloading the full half-hourly series first. Here the series is streamed through the tile database in tile-aligned
+chunks and every chunk is folded into the running statistics, so memory stays bounded and only the result is returned.
+"""
+
+__author__ = "Tim Rietdijk"
+__email__ = "tim.is@live.nl"
+__status__ = "Development"
+
+# standard imports:
+from functools import partial
+from typing import Callable
+
+# third-party imports:
+import numpy as np
+import tiledb
+from geopandas import GeoSeries
+
+# local imports:
+from date_range import DateRange
+from IMERG.grid_index import IMERG_GRID
+from IMERG.imerg_api import IMERG_ATTRIBUTE, _weighted_mean, to_output
+from IMERG.parallel import tile_chunks
+from IMERG.time_axis import IMERG_STEP, IMERG_TIME_AXIS
+
+DEFAULT_DURATIONS = (0.5, 1, 3, 6, 12, 24)
+
+
+def duration_bands(durations: list[float]) -> list[int]:
+    """
+    Converts window durations in hours to a number of half-hourly bands.
+
+    :param durations: Durations in hours, multiples of half an hour.
+    :return: List containing the number of bands of every duration.
+    """
+    bands = [duration * 60 / IMERG_STEP.astype(int) for duration in durations]
+    if any(band != int(band) or band < 1 for band in bands):
+        raise ValueError(f"Durations have to be positive multiples of {IMERG_STEP} ({durations})")
+    return [int(band) for band in bands]
+
+
+class RollingStatistics:
+    def __init__(self, windows: list[int], n_series: int, threshold: float | None = None) -> None:
+        """
+        Running statistics of the rolling sums of one or more half-hourly series. Chunks of consecutive bands are added
+        with update, the last bands of every chunk are kept so windows spanning two chunks are counted too. Windows
+        containing a missing band are left out, every window counts for the year its last band lies in.
+
+        :param windows: Number of bands of every rolling window.
+        :param n_series: Number of series (points or polygons).
+        :param threshold: (optional) Rolling sums above this value are counted as exceedances.
+        """
+        self.windows = windows
+        self.n_series = n_series
+        self.threshold = threshold
+        self.total = np.zeros(n_series)
+        self.missing = np.zeros(n_series, dtype=np.int64)
+        self._annual: dict[int, tuple[np.ndarray, np.ndarray]] = {}
+        self._tail = np.empty((0, n_series))
+
+    def _year(self, year: int) -> tuple[np.ndarray, np.ndarray]:
+        if year not in self._annual:
+            self._annual[year] = (np.full((len(self.windows), self.n_series), np.nan),
+                                  np.zeros((len(self.windows), self.n_series), dtype=np.int64))
+        return self._annual[year]
+
+    def update(self, values: np.ndarray, first_band: int) -> None:
+        """
+        Adds the next chunk of bands. The rolling sums of every window ending in the chunk are taken from the
+        difference of two cumulative sums, which costs the same for every duration.
+
+        :param values: Array (bands x series) containing the half-hourly precipitation, NaN where it is missing.
+        :param first_band: Band of the first row of values, directly after the previous chunk.
+        :return: None
+        """
+        values = values.astype(np.float64, copy=False)
+        missing = np.isnan(values)
+        self.total += np.where(missing, 0, values).sum(axis=0)
+        self.missing += missing.sum(axis=0)
+
+        block = np.concatenate([self._tail, values])
+        zero = np.zeros((1, self.n_series))
+        sums = np.concatenate([zero, np.nan_to_num(block).cumsum(axis=0)])
+        gaps = np.concatenate([zero, np.isnan(block).cumsum(axis=0)])
+        ends = np.arange(len(self._tail), len(block))
+        years = IMERG_TIME_AXIS.timestamp(first_band - len(self._tail) + ends).astype('M8[Y]').astype(int) + 1970
+        for index, window in enumerate(self.windows):
+            window_ends = ends[ends >= window - 1]
+            if not len(window_ends):
+                continue
+            window_sums = sums[window_ends + 1] - sums[window_ends + 1 - window]
+            window_sums[gaps[window_ends + 1] - gaps[window_ends + 1 - window] > 0] = np.nan
+            window_years = years[len(ends) - len(window_ends):]
+            starts = np.r_[0, np.flatnonzero(np.diff(window_years)) + 1]
+            annual_maxima = np.fmax.reduceat(window_sums, starts, axis=0)
+            with np.errstate(invalid='ignore'):
+                above = window_sums > self.threshold if self.threshold is not None else np.zeros(window_sums.shape)
+            annual_counts = np.add.reduceat(above, starts, axis=0, dtype=np.int64)
+            for year, maximum, count in zip(window_years[starts], annual_maxima, annual_counts):
+                maxima, exceedances = self._year(int(year))
+                np.fmax(maxima[index], maximum, out=maxima[index])
+                exceedances[index] += count
+        self._tail = block[len(block) - max(self.windows) + 1:] if max(self.windows) > 1 else block[:0]
+
+    def annual_maxima(self) -> tuple[list[int], np.ndarray]:
+        """
+        Returns the maximum rolling sum of every window per year, NaN where a year has no complete window.
+
+        :return: tuple containing the years and an array (years x windows x series) with their maxima.
+        """
+        years = sorted(self._annual)
+        shape = (len(years), len(self.windows), self.n_series)
+        return years, np.array([self._annual[year][0] for year in years]).reshape(shape)
+
+    def result(self, durations: list[float]) -> dict[str, list | dict]:
+        """
+        Returns the statistics in the structure of the API, every value is a list with one entry per series. Maxima of
+        windows that were never complete are -1.
+
+        :param durations: Duration in hours of every window, used as keys.
+        :return: Dictionary containing the total, the number of missing bands and the maximum (and exceedances) of
+        every duration, overall and per year.
+        """
+        keys = [f"{duration:g}" for duration in durations]
+        years, annual_maxima = self.annual_maxima()
+        shape = annual_maxima.shape
+        annual_exceedances = np.array([self._annual[year][1] for year in years], dtype=np.int64).reshape(shape)
+        maxima = np.fmax.reduce(annual_maxima, axis=0) if years else np.full(shape[1:], np.nan)
+        result = {'durations': list(durations), 'total': to_output(self.total).tolist(),
+                  'missing': self.missing.tolist(), 'max': dict(zip(keys, to_output(maxima).tolist())), 'years': years,
+                  'annual_max': dict(zip(keys, to_output(annual_maxima.transpose(1, 2, 0)).tolist()))}
+        if self.threshold is not None:
+            result['threshold'] = self.threshold
+            result['exceedances'] = dict(zip(keys, annual_exceedances.sum(axis=0).tolist()))
+            result['annual_exceedances'] = dict(zip(keys, annual_exceedances.transpose(1, 2, 0).tolist()))
+        return result
+
+
+def get_statistics(array: tiledb.DenseArray, row_slice: slice, col_slice: slice,
+                   reduce: Callable[[np.ndarray], np.ndarray], n_series: int, date_range: DateRange,
+                   durations: list[float], threshold: float | None = None,
+                   chunk_bands: int = 31 * 48) -> dict[str, list]:
+    """
+    Streams the half-hourly precipitation of the date range through the running statistics. The range is read in
+    chunks of about chunk_bands bands, split on the tile boundaries of the temporal axis, and every chunk is reduced
+    to its series before it is added.
+
+    :param array: Opened half-hourly IMERG tile database.
+    :param row_slice: Rows that are read.
+    :param col_slice: Columns that are read.
+    :param reduce: Function reducing a (bands x rows x columns) block to a (bands x series) array.
+    :param n_series: Number of series returned by reduce.
+    :param date_range: The date range of which the user wants the statistics.
+    :param durations: Durations of the rolling windows in hours.
+    :param threshold: (optional) Rolling sums above this value are counted as exceedances.
+    :param chunk_bands: Approximate number of bands read per query.
+    :return: Dictionary containing the statistics of every series.
+    """
+    statistics = RollingStatistics(duration_bands(durations), n_series, threshold)
+    time_tile = int(array.schema.domain.dim(0).tile)
+    for chunk in tile_chunks(array, IMERG_TIME_AXIS.slice(date_range), max(1, chunk_bands // time_tile)):
+        block = array[chunk, row_slice, col_slice][IMERG_ATTRIBUTE]
+        statistics.update(reduce(block), chunk.start)
+    return statistics.result(durations)
+
+
+def get_point_statistics(array: tiledb.DenseArray, row: int, col: int, date_range: DateRange, durations: list[float],
+                         threshold: float | None = None) -> dict[str, list]:
+    """
+    Computes the rolling window statistics of the precipitation of one cell.
+
+    :param array: Opened half-hourly IMERG tile database.
+    :param row: Row (latitude) index of the cell.
+    :param col: Column (longitude) index of the cell.
+    :param date_range: The date range of which the user wants the statistics.
+    :param durations: Durations of the rolling windows in hours.
+    :param threshold: (optional) Rolling sums above this value are counted as exceedances.
+    :return: Dictionary containing the statistics of the cell.
+    """
+    return get_statistics(array, slice(row, row + 1), slice(col, col + 1),
+                          lambda block: block.reshape(block.shape[0], 1), 1, date_range, durations, threshold)
+
+
+def get_polygon_statistics(array: tiledb.DenseArray, polygons: GeoSeries, date_range: DateRange,
+                           durations: list[float], threshold: float | None = None) -> dict[str, list]:
+    """
+    Computes the rolling window statistics of the area-weighted precipitation of every polygon.
+
+    :param array: Opened half-hourly IMERG tile database.
+    :param polygons: GeoSeries (EPSG:4326) containing the polygons you want the statistics of.
+    :param date_range: The date range of which the user wants the statistics.
+    :param durations: Durations of the rolling windows in hours.
+    :param threshold: (optional) Rolling sums above this value are counted as exceedances.
+    :return: Dictionary containing the statistics of every polygon.
+    """
+    row_slice, col_slice, weights = IMERG_GRID.coverage(polygons)
+    return get_statistics(array, row_slice, col_slice, partial(_weighted_mean, weights=weights), len(polygons),
+                          date_range, durations, threshold)
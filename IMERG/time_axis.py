@@ -0,0 +1,67 @@
+"""
+time_axis.py: Contains the class 'TimeAxis' which maps timestamps to indexes on the temporal axis of a tile database.
+"""
+
+__author__ = "Tim Rietdijk"
+__email__ = "tim.is@live.nl"
+__status__ = "Development"
+
+# third-party imports:
+from numpy import datetime64, timedelta64
+
+# local imports:
+from date_range import DateRange
+from exceptions import DateRangeOutOfBounds
+
+IMERG_EPOCH = datetime64('2000-06-01T00:00', 'm')
+IMERG_STEP = timedelta64(30, 'm')
+
+
+class TimeAxis:
+    def __init__(self, epoch: datetime64, step: timedelta64, length: int | None = None) -> None:
+        """
+        A regular temporal axis of a tile database. Indexes are calculated from the epoch and step directly, so mapping
+        a timestamp to an index doesn't depend on the length of the axis.
+
+        :param epoch: Timestamp stored at index 0.
+        :param step: Time between two consecutive indexes.
+        :param length: (optional) Number of indexes that hold data. If given, indexes outside the axis are rejected.
+        """
+        self.epoch = epoch
+        self.step = step
+        self.length = length
+
+    def index(self, timestamp: datetime64) -> int:
+        """
+        Returns the index of a timestamp on this axis.
+
+        :param timestamp: Timestamp that lies on a step of this axis.
+        :return: Integer representing the index of the timestamp.
+        """
+        index, remainder = divmod(timestamp - self.epoch, self.step)
+        if remainder:
+            raise ValueError(f"{timestamp} doesn't lie on a {self.step} step from {self.epoch}")
+        if index < 0 or (self.length is not None and index >= self.length):
+            raise DateRangeOutOfBounds(timestamp, self.epoch, self.timestamp(self.length - 1) if self.length else None)
+        return int(index)
+
+    def timestamp(self, index: int) -> datetime64:
+        """
+        Returns the timestamp stored at an index of this axis.
+
+        :param index: Index on this axis.
+        :return: Datetime64 representing the timestamp of the index.
+        """
+        return self.epoch + index * self.step
+
+    def slice(self, date_range: DateRange) -> slice:
+        """
+        Returns the slice of this axis that covers the date range.
+
+        :param date_range: The date range of which the user wants the historic precipitation.
+        :return: Slice from the first up to and including the last timestamp of the date range.
+        """
+        return slice(self.index(date_range.min_date), self.index(date_range.max_date) + 1)
+
+
+IMERG_TIME_AXIS = TimeAxis(IMERG_EPOCH, IMERG_STEP)
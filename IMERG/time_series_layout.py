@@ -0,0 +1,121 @@
+"""
+time_series_layout.py: Contains the tool that derives a time-series-optimized copy of the IMERG tile database.
+
+The original tile database is tiled for spatial snapshots: a tile holds a few bands over a large area, so reading a
+long series at one point touches one tile for every few bands. The derived array holds long time extents over small
+spatial blocks instead, so a multi-year point series only touches a handful of tiles.
+
+Usage: python -m IMERG.time_series_layout <source uri> <target uri> --bounds 4 57.9 31.5 71.3
+"""
+
+__author__ = "Tim Rietdijk"
+__email__ = "tim.is@live.nl"
+__status__ = "Development"
+
+# standard imports:
+import argparse
+import time
+
+# third-party imports:
+import tiledb
+from dotenv import dotenv_values
+
+# local imports:
+from IMERG.dataset import get_tiledb_options
+from IMERG.grid_index import IMERG_GRID
+
+TIME_SERIES_TIME_TILE = 17520
+TIME_SERIES_SPACE_TILE = 4
+
+
+def create_time_series_array(source_uri: str, target_uri: str, ctx: tiledb.Ctx, row_slice: slice, col_slice: slice,
+                             time_tile: int = TIME_SERIES_TIME_TILE, space_tile: int = TIME_SERIES_SPACE_TILE) -> None:
+    """
+    Creates an empty tile database with the same domain and attribute as the source, tiled for long time series.
+
+    :param source_uri: Location of the original IMERG tile database.
+    :param target_uri: Location of the time-series tile database.
+    :param ctx: TileDB context containing the (S3) VFS options.
+    :param row_slice: Rows of the source that will be copied.
+    :param col_slice: Columns of the source that will be copied.
+    :param time_tile: Number of bands per tile.
+    :param space_tile: Number of rows and columns per tile.
+    :return: None
+    """
+    with tiledb.open(source_uri, ctx=ctx) as source:
+        band_dim, row_dim, col_dim = source.schema.domain
+        attr = source.schema.attr(0)
+    dom = tiledb.Domain(
+        tiledb.Dim(name=band_dim.name, domain=band_dim.domain, tile=time_tile, dtype=band_dim.dtype),
+        tiledb.Dim(name=row_dim.name, domain=row_dim.domain, tile=space_tile, dtype=row_dim.dtype),
+        tiledb.Dim(name=col_dim.name, domain=col_dim.domain, tile=space_tile, dtype=col_dim.dtype), ctx=ctx)
+    schema = tiledb.ArraySchema(domain=dom, sparse=False,
+                                attrs=[tiledb.Attr(name=attr.name, dtype=attr.dtype, filters=attr.filters)], ctx=ctx)
+    tiledb.DenseArray.create(target_uri, schema, ctx=ctx)
+    with tiledb.open(target_uri, 'w', ctx=ctx) as target:
+        target.meta['rows'] = (row_slice.start, row_slice.stop)
+        target.meta['cols'] = (col_slice.start, col_slice.stop)
+        target.meta['bands'] = (0, 0)
+
+
+def copy_to_time_series_array(source_uri: str, target_uri: str, ctx: tiledb.Ctx, band_slice: slice) -> float:
+    """
+    Copies the bands of the source into the time-series tile database. Every write covers whole target tiles: one time
+    tile over a strip of tile rows, so the source is read in large spatial slabs, which is what its layout is good at.
+    The written fragments are consolidated afterwards.
+
+    :param source_uri: Location of the original IMERG tile database.
+    :param target_uri: Location of the time-series tile database.
+    :param ctx: TileDB context containing the (S3) VFS options.
+    :param band_slice: Bands that will be copied, must continue where the previous copy stopped.
+    :return: a float representing the time it took to copy the bands.
+    """
+    start_time = time.time()
+    with tiledb.open(target_uri, ctx=ctx) as target:
+        first_band, last_band = target.meta['bands']
+        row_start, row_stop = target.meta['rows']
+        col_start, col_stop = target.meta['cols']
+        attribute = target.schema.attr(0).name
+        time_tile, space_tile = (int(dim.tile) for dim in list(target.schema.domain)[:2])
+        band_origin = int(target.schema.domain.dim(0).domain[0])
+    if first_band != last_band and band_slice.start != last_band:
+        raise ValueError(f"Copy has to continue at band {last_band}, not {band_slice.start}")
+
+    with tiledb.open(source_uri, ctx=ctx) as source, tiledb.open(target_uri, 'w', ctx=ctx) as target:
+        first_tile = band_slice.start - (band_slice.start - band_origin) % time_tile
+        for tile_start in range(first_tile, band_slice.stop, time_tile):
+            bands = slice(max(tile_start, band_slice.start), min(tile_start + time_tile, band_slice.stop))
+            for row in range(row_start, row_stop, space_tile):
+                rows = slice(row, min(row + space_tile, row_stop))
+                block = source[bands, rows, col_start:col_stop][attribute]
+                target[bands, rows, col_start:col_stop] = {attribute: block}
+        target.meta['bands'] = (first_band if first_band != last_band else band_slice.start, band_slice.stop)
+    tiledb.consolidate(target_uri, ctx=ctx)
+    tiledb.vacuum(target_uri, ctx=ctx)
+    return time.time() - start_time
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Derive a time-series-optimized copy of the IMERG tile database.")
+    parser.add_argument('source', help="Location of the original IMERG tile database")
+    parser.add_argument('target', help="Location of the time-series tile database")
+    parser.add_argument('--bounds', nargs=4, type=float, default=(4, 57.9, 31.5, 71.3),
+                        metavar=('MINX', 'MINY', 'MAXX', 'MAXY'), help="Area to copy (default: Norway)")
+    parser.add_argument('--bands', nargs=2, type=int, metavar=('START', 'STOP'),
+                        help="Bands to copy (default: everything after the last copied band)")
+    parser.add_argument('--time-tile', type=int, default=TIME_SERIES_TIME_TILE)
+    parser.add_argument('--space-tile', type=int, default=TIME_SERIES_SPACE_TILE)
+    args = parser.parse_args()
+
+    context = tiledb.Ctx(tiledb.Config(get_tiledb_options(dotenv_values('.env'))))
+    if not tiledb.array_exists(args.target, ctx=context):
+        create_time_series_array(args.source, args.target, context, *IMERG_GRID.slices(args.bounds),
+                                 time_tile=args.time_tile, space_tile=args.space_tile)
+    if args.bands:
+        bands = slice(*args.bands)
+    else:
+        with tiledb.open(args.source, ctx=context) as source_array, \
+                tiledb.open(args.target, ctx=context) as target_array:
+            bands = slice(target_array.meta['bands'][1], source_array.nonempty_domain()[0][1] + 1)
+    print(f"Copied bands {bands.start}-{bands.stop} in "
+          f"{copy_to_time_series_array(args.source, args.target, context, bands)} seconds")
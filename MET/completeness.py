@@ -0,0 +1,250 @@
+"""
+completeness.py: Contains the class 'CompletenessIndex' which records which hours of every MET station have an hourly
+precipitation observation.
+
+The nearest station with complete precipitation data used to be found by downloading the series of the 50 nearest
+stations and throwing away every incomplete one. The index keeps, per station and month, which hours have been checked
+and which of those hold exactly one observation of sum(precipitation_amount PT1H), so the complete and incomplete
+stations of a date range are known without downloading their series. It is filled by every series the API downloads
+and can be filled ahead of time with the command below. Hours younger than the settle period are never recorded,
+because FROST still receives late observations for them.
+
+Usage: python -m MET.completeness 2020-01 2023-12
+"""
+
+__author__ = "Tim Rietdijk"
+__email__ = "tim.is@live.nl"
+__status__ = "Development"
+
+# standard imports:
+import argparse
+import os
+import sqlite3
+import time
+from contextlib import closing
+
+# third-party imports:
+import httpx
+import numpy as np
+from dotenv import dotenv_values
+from numpy import datetime64
+
+# local imports:
+from date_range import DateRange
+from MET.observation_matrix import parse_observation_matrix
+from MET.station_catalog import PRECIPITATION_ELEMENT, station_catalog
+from upstream import UpstreamClient, upstream
+
+FROST_OBSERVATION_ENDPOINT = 'https://frost.met.no/observations/v0.jsonld'
+# FROST returns at most 100.000 observations per request.
+MAX_OBSERVATIONS = 100_000
+secrets = dotenv_values('.env')
+
+
+def date_range_hours(date_range: DateRange) -> np.ndarray:
+    """
+    Returns the hours of a date range, the same hours as DateRange.unix_list.
+
+    :param date_range: The date range.
+    :return: Array of datetime64[h] containing every hour within the date range.
+    """
+    return np.arange(date_range.min_date, date_range.max_date, np.timedelta64(1, 'h')).astype('M8[h]')
+
+
+def month_date_range(month: datetime64) -> DateRange:
+    """
+    Returns the date range of a calendar month.
+
+    :param month: The month (datetime64[M]).
+    :return: DateRange from the first to the last day of the month.
+    """
+    return DateRange(f"{month.astype('M8[D]')}/{(month + 1).astype('M8[D]') - 1}")
+
+
+class CompletenessIndex:
+    def __init__(self, path: str, settle_days: float = 7) -> None:
+        """
+        The per-station, per-month completeness index, stored in an SQLite database shared by the workers.
+
+        :param path: File of the SQLite database, created on first use.
+        :param settle_days: Number of days after which the observations of an hour are considered final.
+        """
+        self.path = path
+        self.settle = np.timedelta64(int(settle_days * 24), 'h')
+        self._created = False
+
+    def _connect(self) -> sqlite3.Connection:
+        if not self._created:
+            os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        connection = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        if not self._created:
+            connection.execute("CREATE TABLE IF NOT EXISTS completeness (station TEXT NOT NULL, month TEXT NOT NULL, "
+                               "known BLOB NOT NULL, observed BLOB NOT NULL, PRIMARY KEY (station, month))")
+            self._created = True
+        return connection
+
+    @staticmethod
+    def _read(connection: sqlite3.Connection, ids: list[str],
+              months: np.ndarray) -> dict[tuple[str, str], tuple[np.ndarray, np.ndarray]]:
+        """
+        Reads the hour masks of the stations in the months.
+
+        :param connection: Connection to the database.
+        :param ids: Ids of the stations.
+        :param months: Array of datetime64[M] containing the months.
+        :return: Dictionary containing the known and observed hours (boolean arrays over the hours of the month) by
+        station and month, stations that were never checked in a month are left out.
+        """
+        if not ids:
+            return {}
+        month_names = [str(month) for month in months]
+        rows = connection.execute(f"SELECT station, month, known, observed FROM completeness "
+                                  f"WHERE station IN ({','.join('?' * len(ids))}) "
+                                  f"AND month IN ({','.join('?' * len(month_names))})", [*ids, *month_names])
+        masks = {}
+        for station, month, known, observed in rows:
+            n_hours = int(((datetime64(month, 'M') + 1).astype('M8[h]') - datetime64(month, 'M').astype('M8[h]')) /
+                          np.timedelta64(1, 'h'))
+            masks[station, month] = (np.unpackbits(np.frombuffer(known, np.uint8), count=n_hours).astype(bool),
+                                     np.unpackbits(np.frombuffer(observed, np.uint8), count=n_hours).astype(bool))
+        return masks
+
+    def status(self, ids: list[str], date_range: DateRange) -> dict[str, bool | None]:
+        """
+        Looks up whether the stations observed every hour of the date range.
+
+        :param ids: Ids of the stations.
+        :param date_range: The date range.
+        :return: Dictionary containing by station id True if every hour is observed, False if an hour is known to be
+        missing and None if the index doesn't know yet.
+        """
+        hours = date_range_hours(date_range)
+        months = np.unique(hours.astype('M8[M]'))
+        with closing(self._connect()) as connection:
+            masks = self._read(connection, ids, months)
+        status = {}
+        for station in ids:
+            complete = True
+            for month in months:
+                month_hours = hours[hours.astype('M8[M]') == month]
+                offsets = slice(int((month_hours[0] - month.astype('M8[h]')) / np.timedelta64(1, 'h')),
+                                int((month_hours[-1] - month.astype('M8[h]')) / np.timedelta64(1, 'h')) + 1)
+                known, observed = masks.get((station, str(month)), (None, None))
+                if known is None or not known[offsets].all():
+                    complete = None
+                if known is not None and (known[offsets] & ~observed[offsets]).any():
+                    complete = False
+                    break
+            status[station] = complete
+        return status
+
+    def to_fetch(self, ids: list[str], date_range: DateRange) -> list[str]:
+        """
+        Returns the stations whose series have to be downloaded to find the first complete station: the nearest
+        station known to be complete and every station before it that the index doesn't know yet. Stations known to
+        be incomplete are skipped.
+
+        :param ids: Ids of the candidate stations, closest first.
+        :param date_range: The date range.
+        :return: List containing the ids of the stations to download, closest first.
+        """
+        status = self.status(ids, date_range)
+        fetch = []
+        for station in ids:
+            if status[station] is False:
+                continue
+            fetch.append(station)
+            if status[station]:
+                break
+        return fetch
+
+    def record(self, ids: list[str], hours: np.ndarray, observed: np.ndarray) -> None:
+        """
+        Records which of the hours the stations observed. Hours within the settle period are left out.
+
+        :param ids: Ids of the stations that were requested.
+        :param hours: Array of datetime64[h] containing the consecutive hours that were requested.
+        :param observed: Array (stations x hours) of booleans representing whether the station observed the hour
+        exactly once, as returned by parse_observation_matrix.
+        """
+        settled = hours < datetime64('now', 'h') - self.settle
+        hours, observed_hours = hours[settled], observed[:, settled]
+        if not len(hours) or not ids:
+            return
+        months = np.unique(hours.astype('M8[M]'))
+        with closing(self._connect()) as connection:
+            connection.execute("BEGIN IMMEDIATE")
+            try:
+                masks = self._read(connection, ids, months)
+                for month in months:
+                    in_month = hours.astype('M8[M]') == month
+                    positions = ((hours[in_month] - month.astype('M8[h]')) / np.timedelta64(1, 'h')).astype(np.int64)
+                    n_hours = int(((month + 1).astype('M8[h]') - month.astype('M8[h]')) / np.timedelta64(1, 'h'))
+                    for row, station in enumerate(ids):
+                        known, observed = masks.get((station, str(month)), (np.zeros(n_hours, dtype=bool),
+                                                                            np.zeros(n_hours, dtype=bool)))
+                        known[positions] = True
+                        observed[positions] = observed_hours[row, in_month]
+                        connection.execute("INSERT OR REPLACE INTO completeness VALUES (?, ?, ?, ?)",
+                                           (station, str(month), np.packbits(known).tobytes(),
+                                            np.packbits(observed).tobytes()))
+                connection.execute("COMMIT")
+            except BaseException:
+                connection.execute("ROLLBACK")
+                raise
+
+    def record_response(self, ids: list[str], hours: np.ndarray, r: httpx.Response) -> None:
+        """
+        Records the hours observed in a response of the FROST observations endpoint. FROST answers 404 when none of
+        the stations observed anything, other errors aren't recorded.
+
+        :param ids: Ids of the stations that were requested.
+        :param hours: Array of datetime64[h] containing the consecutive hours that were requested.
+        :param r: Response of the FROST observations endpoint.
+        """
+        if r.status_code in (200, 404):
+            self.record(ids, hours, parse_observation_matrix(r.json()['data'] if r.status_code == 200 else [], hours,
+                                                             ids)[2])
+
+    def build(self, month: datetime64, ids: list[str], client: UpstreamClient = upstream) -> None:
+        """
+        Fills the index for a month by downloading only the reference time and value of the observations of the
+        stations.
+
+        :param month: The month (datetime64[M]).
+        :param ids: Ids of the stations.
+        :param client: The upstream client the FROST requests are sent with.
+        """
+        date_range = month_date_range(month)
+        batch_size = max(1, MAX_OBSERVATIONS // len(date_range_hours(date_range)))
+        for start in range(0, len(ids), batch_size):
+            batch = ids[start:start + batch_size]
+            r = client.get(FROST_OBSERVATION_ENDPOINT,
+                           {'sources': ','.join(batch), 'elements': PRECIPITATION_ELEMENT,
+                            'referencetime': str(date_range), 'fields': 'referenceTime, sourceId, value'},
+                           auth=(secrets['MET_FROST_CLIENT_ID'], ''))
+            self.record_response(batch, date_range_hours(date_range), r)
+
+
+"""
+The index is stored in MET_COMPLETENESS_INDEX_PATH (default: data/met_completeness.sqlite) and observations are final
+after MET_COMPLETENESS_SETTLE_DAYS days (default: 7).
+"""
+completeness_index = CompletenessIndex(secrets.get('MET_COMPLETENESS_INDEX_PATH') or
+                                       os.path.join('data', 'met_completeness.sqlite'),
+                                       float(secrets.get('MET_COMPLETENESS_SETTLE_DAYS') or 7))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Fill the MET station completeness index for a range of months.")
+    parser.add_argument('first_month', help="First month (YYYY-MM)")
+    parser.add_argument('last_month', help="Last month (YYYY-MM)")
+    args = parser.parse_args()
+
+    if not station_catalog.is_ready:
+        station_catalog.refresh()
+    for month in np.arange(datetime64(args.first_month, 'M'), datetime64(args.last_month, 'M') + 1):
+        start = time.time()
+        ids = station_catalog.ids(month_date_range(month))
+        completeness_index.build(month, ids)
+        print(f"Indexed {len(ids)} stations for {month} in {round(time.time() - start, 1)} seconds")
@@ -1,20 +1,37 @@
 """
-forecast_api.py: Contains all the functions to interact with MET's FROST API.
+forecast_api.py: Contains all the functions to interact with MET's locationforecast API.
+
+The forecasts are requested on the shared upstream client (see upstream.py) instead of through metno_locationforecast,
+which opens a new connection for every forecast. Like that package, a forecast is kept until it expires and is then
+refreshed with an If-Modified-Since request, as the terms of service of api.met.no ask. At most MAX_FORECASTS places
+are kept, expired forecasts are dropped first and then the ones stored longest ago.
 """
 
 __author__ = "Tim Rietdijk"
 __email__ = "tim.is@live.nl"
 __status__ = "Development"
 
-# local imports:
-from metno_locationforecast import Place, Forecast
-
 # standard imports:
+import threading
 import time
+from datetime import datetime, timedelta, timezone
+from email.utils import parsedate_to_datetime
 
 # third-party imports:
+import httpx
 from geopandas import GeoDataFrame
 
+# local imports:
+from upstream import upstream
+
+LOCATIONFORECAST_ENDPOINT = 'https://api.met.no/weatherapi/locationforecast/2.0/compact'
+USER_AGENT = "smart-culvert-api/0.1 tim.is@live.nl"
+# Kept when a response has no Expires header, api.met.no updates the compact forecast about every half hour.
+DEFAULT_EXPIRES = timedelta(minutes=30)
+MAX_FORECASTS = 10_000
+_forecasts: dict[tuple[float, float], tuple[datetime, str, list[list[int | float]]]] = {}
+_forecasts_lock = threading.Lock()
+
 
 def get_forecast(features: GeoDataFrame) -> list[list[list[int | float]]]:
     """
@@ -35,6 +52,57 @@ def get_forecast(features: GeoDataFrame) -> list[list[list[int | float]]]:
     return forecasts
 
 
+def parse_forecast(response: dict) -> list[list[int | float]]:
+    """
+    Takes the precipitation of the shortest interval given for every timestep of a locationforecast response.
+
+    :param response: The decoded locationforecast response.
+    :return: A list containing the timestamp (unix time in milliseconds) and precipitation of every timestep.
+    """
+    data = []
+    for timestep in response['properties']['timeseries']:
+        start_time = datetime.strptime(timestep['time'], "%Y-%m-%dT%H:%M:%S%z")
+        for interval in ('next_1_hours', 'next_6_hours', 'next_12_hours'):
+            if interval in timestep['data']:
+                details = timestep['data'][interval].get('details', {})
+                if 'precipitation_amount' in details:
+                    data.append([int(time.mktime(start_time.timetuple()) * 1000), details['precipitation_amount']])
+                break
+    return data
+
+
+def _expires(r: httpx.Response) -> datetime:
+    """
+    Returns when a locationforecast response expires.
+
+    :param r: Response of the locationforecast endpoint.
+    :return: The Expires header, or DEFAULT_EXPIRES from now when it is missing or invalid.
+    """
+    try:
+        return parsedate_to_datetime(r.headers['Expires'])
+    except (KeyError, TypeError, ValueError):
+        return datetime.now(timezone.utc) + DEFAULT_EXPIRES
+
+
+def _store_forecast(place: tuple[float, float], forecast: tuple[datetime, str, list[list[int | float]]]) -> None:
+    """
+    Stores the forecast of a place, dropping expired forecasts and then the oldest ones when there are more than
+    MAX_FORECASTS. Call with the lock held.
+
+    :param place: Rounded latitude and longitude of the place.
+    :param forecast: tuple containing the expiry, the Last-Modified header and the forecast series.
+    :return: None
+    """
+    _forecasts.pop(place, None)
+    _forecasts[place] = forecast
+    if len(_forecasts) > MAX_FORECASTS:
+        now = datetime.now(timezone.utc)
+        for expired in [key for key, (expires, _, _) in _forecasts.items() if expires <= now]:
+            del _forecasts[expired]
+        while len(_forecasts) > MAX_FORECASTS:
+            del _forecasts[next(iter(_forecasts))]
+
+
 def get_forecast_data(y, x) -> list[list[int | float]]:
     """
     Formats the forecast data send by the API.
@@ -43,11 +111,20 @@ def get_forecast_data(y, x) -> list[list[int | float]]:
     :param x: X coordinate of a geofeature.
     :return: A list containing the formatted forecast series.
     """
-    data = []
-    temp = Place("culvert", y, x)
-    forecast = Forecast(temp, "metno-locationforecast/1.0 https://github.com/Rory-Sullivan/metno-locationforecast")
-    forecast.update()
-    for i in forecast.data.intervals:
-        if "precipitation_amount" in i.variables:
-            data.append([int(time.mktime(i.start_time.timetuple()) * 1000), i.variables["precipitation_amount"].value])
+    place = (round(y, 4), round(x, 4))
+    with _forecasts_lock:
+        cached = _forecasts.get(place)
+    if cached is not None and cached[0] > datetime.now(timezone.utc):
+        return cached[2]
+    headers = {'User-Agent': USER_AGENT}
+    if cached is not None:
+        headers['If-Modified-Since'] = cached[1]
+    r = upstream.get(LOCATIONFORECAST_ENDPOINT, {'lat': place[0], 'lon': place[1]}, headers=headers)
+    if r.status_code == 304:
+        data = cached[2]
+    else:
+        r.raise_for_status()
+        data = parse_forecast(r.json())
+    with _forecasts_lock:
+        _store_forecast(place, (_expires(r), r.headers.get('Last-Modified', cached[1] if cached else ''), data))
     return data
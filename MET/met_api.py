@@ -4,7 +4,7 @@ from sqlite3 import ProgrammingError
 import numpy as np
 import pandas
 import pandas as pd
-import requests
+import httpx
 import shapely
 from dotenv import dotenv_values
 from geopandas import GeoDataFrame as gpd, GeoDataFrame, points_from_xy, GeoSeries
@@ -13,78 +13,91 @@ from scipy.spatial import cKDTree
 from shapely import wkt
 from shapely.geometry import Point
 from sqlalchemy import create_engine
+from blocking import BlockingExecutor
 from date_range import DateRange
 from exceptions import InvalidLocationIdList
+from MET.completeness import completeness_index, date_range_hours
+from MET.observation_matrix import parse_observation_matrix, precipitation_lists
+from MET.observation_store import StoredObservations, hours_interval, observation_store
+from MET.station_catalog import station_catalog
+from upstream import UpstreamClient, upstream
 
 frost_station_endpoint = 'https://frost.met.no/sources/v0.jsonld'
 frost_observation_endpoint = 'https://frost.met.no/observations/v0.jsonld'
 secrets = dotenv_values('.env')
 
 
-def get_station_observations(ids: str, date_range: DateRange) \
-        -> list[dict]:
-    """
-    This function gets the historical precipitation measured by the requested weather stations
-
-    :param ids: List of weather station ids
-    :param date_range: The date range of which the user wants the historic precipitation.
-    :return: returns a list of dictionaries, where a dictionary contains a historic precipitation observation.
-    """
-    print(ids)
-    parameters = {
+def _observation_parameters(ids: str, referencetime: str) -> dict[str, str | list[str]]:
+    return {
         'sources': [ids],
         'elements': 'sum(precipitation_amount PT1H)',
-        'referencetime': date_range,
+        'referencetime': referencetime,
         'fields': 'geometry, value, referenceTime, sourceId',
     }
-    try:
-        r = requests.get(frost_observation_endpoint, parameters, auth=(secrets['MET_FROST_CLIENT_ID'], ''))
-        print(r)
-        if r.status_code == 200:
-            response = r.json()
-            df = pd.json_normalize(response['data'])
-            df.rename(columns={'sourceId': 'id'}, inplace=True)
-            df['id'] = [i[:7] for i in df.id]
-            df['precipitation'] = [[i[0]['value']] for i in df['observations']]
-            agg_functions = {'id': 'first', 'precipitation': 'sum'}
-            dff = df.groupby(df.id).aggregate(agg_functions).reset_index(drop=True)
-            dfff = dff[dff['precipitation'].apply(lambda x: len(x) == len(date_range.unix_list))]
-            return dfff
-        if r.status_code == 412:
-            json = r.json()
-            data = 'FROST API (Observations): ' + json['error']['reason']
-            return data
-        if r.status_code == 404:
-            json = r.json()
-            data = 'FROST API (Observations): ' + json['error']['reason']
-            return data
-        if r.status_code == 400:
-            json = r.json()
-            data = 'FROST API (Observations): ' + json['error']['reason']
-            return data
-    except Exception as e:
-        print(f"Something is really wrong :( ({e})")
-
-
-def get_nearest_stations_to_point(point: Series, date_range: DateRange, number_of_nearest_stations: int) \
-        -> pandas.DataFrame:
+
+
+def parse_station_observations(r: httpx.Response, date_range: DateRange) -> DataFrame | str | None:
     """
-    Gets a defined number of weather stations that are close to the selected point on the map.
+    Turns the response of the FROST observations endpoint into the hourly precipitation of every station with a
+    complete observation list.
 
-    :param point: A row of the geodataframe containing the information of one point.
+    :param r: Response of the FROST observations endpoint.
     :param date_range: The date range of which the user wants the historic precipitation.
-    :param number_of_nearest_stations: The number of weather stations near the selected point.
-    :return: list containing a defined number of weather stations
+    :return: DataFrame containing the 'id' and 'precipitation' of every complete station, or the reason FROST gave
+    for not returning observations.
     """
-    parameters = {
+    if r.status_code == 200:
+        ids, precipitation, observed = parse_observation_matrix(r.json()['data'], date_range_hours(date_range))
+        complete = observed.all(axis=1)
+        return DataFrame({'id': [station for station, keep in zip(ids, complete) if keep],
+                          'precipitation': precipitation_lists(precipitation[complete])})
+    if r.status_code in (400, 404, 412):
+        json = r.json()
+        data = 'FROST API (Observations): ' + json['error']['reason']
+        return data
+
+
+def get_station_observations(ids: str, date_range: DateRange, client: UpstreamClient = upstream) -> DataFrame | str:
+    """
+    This function gets the historical precipitation measured by the requested weather stations. Hours held in the
+    observation store are read locally, only the missing hours are fetched from FROST.
+
+    :param ids: List of weather station ids
+    :param date_range: The date range of which the user wants the historic precipitation.
+    :param client: (optional) The upstream client the FROST requests are sent with.
+    :return: DataFrame containing the 'id' and 'precipitation' of every complete station, or the reason FROST gave
+    for not returning observations.
+    """
+    observations = StoredObservations(observation_store, ids.split(','), date_range)
+    for stations, hours in observations.requests:
+        r = client.get(frost_observation_endpoint, _observation_parameters(",".join(stations), hours_interval(hours)),
+                       auth=(secrets['MET_FROST_CLIENT_ID'], ''))
+        observed = observations.add(stations, hours, r)
+        if observed is not None:
+            completeness_index.record(stations, hours, observed)
+    return observations.result()
+
+
+def _nearest_station_parameters(point: Series, date_range: DateRange,
+                                number_of_nearest_stations: int) -> dict[str, str | int]:
+    return {
         'types': 'SensorSystem',
         'elements': 'sum(precipitation_amount PT1H)',
         'nearestmaxcount': number_of_nearest_stations,
         'geometry': f'nearest({point[0]})',
         'fields': 'geometry, distance, id, name',
-        'validtime': date_range
+        'validtime': str(date_range)
     }
-    r = requests.get(frost_station_endpoint, parameters, auth=(secrets['MET_FROST_CLIENT_ID'], ''))
+
+
+def parse_stations(r: httpx.Response) -> DataFrame | None:
+    """
+    Turns the response of the FROST sources endpoint into a DataFrame of weather stations.
+
+    :param r: Response of the FROST sources endpoint.
+    :return: DataFrame containing the id, name, distance and geometry of every station, or None if FROST returned an
+    error.
+    """
     if r.status_code == 200:
         response = r.json()
         df = pd.json_normalize(response['data'], max_level=0)
@@ -92,20 +105,60 @@ def get_nearest_stations_to_point(point: Series, date_range: DateRange, number_o
         return df
 
 
-def get_processed_station_observations(point: Series, date_range: DateRange) \
-        -> DataFrame:
+def get_nearest_stations_to_point(point: Series, date_range: DateRange, number_of_nearest_stations: int,
+                                  client: UpstreamClient = upstream) -> pandas.DataFrame:
+    """
+    Gets a defined number of weather stations that are close to the selected point on the map.
+
+    :param point: A row of the geodataframe containing the information of one point.
+    :param date_range: The date range of which the user wants the historic precipitation.
+    :param number_of_nearest_stations: The number of weather stations near the selected point.
+    :param client: (optional) The upstream client the FROST requests are sent with.
+    :return: list containing a defined number of weather stations
+    """
+    if station_catalog.is_ready:
+        return station_catalog.nearest(point.iloc[0], number_of_nearest_stations, date_range)
+    parameters = _nearest_station_parameters(point, date_range, number_of_nearest_stations)
+    r = client.get(frost_station_endpoint, parameters, auth=(secrets['MET_FROST_CLIENT_ID'], ''))
+    return parse_stations(r)
+
+
+def get_processed_station_observations(point: Series, date_range: DateRange,
+                                       client: UpstreamClient = upstream) -> DataFrame:
     """
     loops through all the weather stations with a complete observation list and returns the closest station to the
     point.
 
     :param point: A row of the geodataframe containing the information of one point.
     :param date_range: The date range of which the user wants the historic precipitation.
+    :param client: (optional) The upstream client the FROST requests are sent with.
     :return: A dictionary representin the closest weather station with a complete observation list to the point
     """
-    possible_stations_of_feature = get_nearest_stations_to_point(point, date_range, 50)
-    observations = get_station_observations(",".join(possible_stations_of_feature.id), date_range)
-    closest_stations_with_full_result_range = pd.merge(possible_stations_of_feature, observations, on=["id"])
-    return closest_stations_with_full_result_range
+    possible_stations_of_feature = get_nearest_stations_to_point(point, date_range, 50, client)
+    remaining = list(possible_stations_of_feature.id)
+    while ids := completeness_index.to_fetch(remaining, date_range):
+        observations = get_station_observations(",".join(ids), date_range, client)
+        if isinstance(observations, DataFrame):
+            closest_stations_with_full_result_range = pd.merge(possible_stations_of_feature, observations, on=["id"])
+            if not closest_stations_with_full_result_range.empty:
+                return closest_stations_with_full_result_range
+        remaining = [station for station in remaining if station not in ids]
+    return possible_stations_of_feature.iloc[0:0]
+
+
+async def get_processed_station_observations_async(point: Series, date_range: DateRange, client: UpstreamClient,
+                                                   executor: BlockingExecutor) -> DataFrame:
+    """
+    Non-blocking version of get_processed_station_observations for async endpoints. The search runs on the executor,
+    so the event loop keeps serving other requests while the FROST requests are sent and the responses are parsed.
+
+    :param point: A row of the geodataframe containing the information of one point.
+    :param date_range: The date range of which the user wants the historic precipitation.
+    :param client: The upstream client the FROST requests are sent with.
+    :param executor: The executor the search runs on.
+    :return: A dictionary representin the closest weather station with a complete observation list to the point
+    """
+    return await executor.run(get_processed_station_observations, point, date_range, client)
 
 
 def get_processed_station_observations_poly(point: Series, date_range: DateRange) \
@@ -119,7 +172,11 @@ def get_processed_station_observations_poly(point: Series, date_range: DateRange
     :return: A dictionary representin the closest weather station with a complete observation list to the point
     """
     possible_stations_of_feature = get_station_within_polygon(point, date_range)
-    observations = get_station_observations(",".join(possible_stations_of_feature.id), date_range)
+    status = completeness_index.status(list(possible_stations_of_feature.id), date_range)
+    ids = [station for station in possible_stations_of_feature.id if status[station] is not False]
+    observations = get_station_observations(",".join(ids), date_range)
+    if not isinstance(observations, DataFrame):
+        return possible_stations_of_feature.iloc[0:0]
     closest_stations_with_full_result_range = pd.merge(possible_stations_of_feature, observations, on=["id"])
     return closest_stations_with_full_result_range
 
@@ -132,14 +189,16 @@ def get_station_within_polygon(polygon: Series, date_range: DateRange) -> DataFr
     :param date_range: The date range of which the user wants the historic precipitation.
     :return: list containing all weather stations within the defined polygon.
     """
+    if station_catalog.is_ready:
+        return station_catalog.within(list(polygon), date_range)
     parameters = {
         'types': 'SensorSystem',
         'elements': 'sum(precipitation_amount PT1H)',
-        'geometry': polygon,
+        'geometry': [geometry.wkt for geometry in polygon],
         'fields': 'geometry, distance, id, name',
         'validtime': date_range
     }
-    r = requests.get(frost_station_endpoint, parameters, auth=(secrets['MET_FROST_CLIENT_ID'], ''))
+    r = upstream.get(frost_station_endpoint, parameters, auth=(secrets['MET_FROST_CLIENT_ID'], ''))
     if r.status_code == 404:
         json = r.json()
         print('FROST API (Stations): ' + json['error']['reason'])
@@ -178,14 +237,14 @@ def get_geo_dataframe(location_ids: list[str], validation=None) -> gpd | None:
 def get_idf_from_raster(pointer: GeoSeries):
     parameters = {
         'sources': 'idf_bma1km',
-        'location': pointer.geometry,
+        'location': [geometry.wkt for geometry in pointer.geometry],
         'unit': 'l/s*Ha'
     }
-    r = requests.get('https://frost.met.no/frequencies/rainfall/v0.jsonld', parameters,
+    r = upstream.get('https://frost.met.no/frequencies/rainfall/v0.jsonld', parameters,
                      auth=(secrets['MET_FROST_CLIENT_ID'], ''))
     response = r.json()
     parameters['unit'] = 'mm'
-    r = requests.get('https://frost.met.no/frequencies/rainfall/v0.jsonld', parameters,
+    r = upstream.get('https://frost.met.no/frequencies/rainfall/v0.jsonld', parameters,
                      auth=(secrets['MET_FROST_CLIENT_ID'], ''))
     response2 = r.json()
     df = pd.json_normalize(response['data'][0]['values'], max_level=0)
@@ -211,11 +270,11 @@ def get_idf_curve_from_nearest_station(row: GeoSeries) -> str:
         'sources': nearest_station['id'],
         'unit': 'l/s*Ha'
     }
-    r = requests.get('https://frost.met.no/frequencies/rainfall/v0.jsonld', parameters,
+    r = upstream.get('https://frost.met.no/frequencies/rainfall/v0.jsonld', parameters,
                      auth=(secrets['MET_FROST_CLIENT_ID'], ''))
     response = r.json()
     parameters['unit'] = 'mm'
-    r = requests.get('https://frost.met.no/frequencies/rainfall/v0.jsonld', parameters,
+    r = upstream.get('https://frost.met.no/frequencies/rainfall/v0.jsonld', parameters,
                      auth=(secrets['MET_FROST_CLIENT_ID'], ''))
     response2 = r.json()
     df = pd.json_normalize(response['data'][0]['values'], max_level=0)
@@ -258,7 +317,7 @@ def load_idf_stations() -> GeoDataFrame:
 
     :return: GeoDataFrame with all available MET IDF stations.
     """
-    r = requests.get('https://frost.met.no/frequencies/rainfall/availableSources/v0.jsonld', {},
+    r = upstream.get('https://frost.met.no/frequencies/rainfall/availableSources/v0.jsonld', {},
                      auth=(secrets['MET_FROST_CLIENT_ID'], ''))
     response = r.json()
     df = pd.json_normalize(response['data'], max_level=0)
@@ -269,7 +328,7 @@ def load_idf_stations() -> GeoDataFrame:
         'ids': ",".join(df.id),
         'fields': 'geometry, id'
     }
-    r = requests.get('https://frost.met.no/sources/v0.jsonld?', parameters, auth=(secrets['MET_FROST_CLIENT_ID'], ''))
+    r = upstream.get('https://frost.met.no/sources/v0.jsonld?', parameters, auth=(secrets['MET_FROST_CLIENT_ID'], ''))
     response = r.json()
     df2 = pd.json_normalize(response['data'], max_level=0)
     df3 = pd.merge(df, df2, on=["id"])
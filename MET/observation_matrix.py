@@ -0,0 +1,71 @@
+"""
+observation_matrix.py: Contains the function that parses FROST observations into a (stations x hours) matrix.
+
+Parsing the observations with pd.json_normalize, one single-element list per observation and a groupby concatenating
+those lists took seconds and several times the memory of the response for polygons with many stations and long date
+ranges. The observations are instead written straight into a preallocated float32 matrix: one pass over the response
+collects the station, hour and value of every observation, the distinct stations and reference times are looked up once
+each and the values are scattered into the matrix with NumPy.
+"""
+
+__author__ = "Tim Rietdijk"
+__email__ = "tim.is@live.nl"
+__status__ = "Development"
+
+# third-party imports:
+import numpy as np
+
+# float32 keeps 7 significant digits. Hourly precipitation (mm) has at most one decimal, so rounding the float32 values
+# to this number of decimals gives back the values FROST sent.
+PRECIPITATION_DECIMALS = 4
+
+
+def parse_observation_matrix(data: list[dict], hours: np.ndarray,
+                             ids: list[str] | None = None) -> tuple[list[str], np.ndarray, np.ndarray]:
+    """
+    Parses the observations of a FROST observations response into a matrix of stations by hours.
+
+    :param data: The 'data' of the FROST observations response, at least the sourceId, referenceTime and value of
+    every observation.
+    :param hours: Array of datetime64[h] containing the consecutive hours of the matrix.
+    :param ids: (optional) Ids of the stations (rows) of the matrix, observations of other stations are left out.
+    Defaults to every station in the response, in the order they first appear.
+    :return: tuple containing the station ids, the precipitation (stations x hours, float32, NaN where the station has
+    no single observation) and the mask of the hours the station observed exactly once.
+    """
+    rows = {station: row for row, station in enumerate(ids)} if ids is not None else {}
+    sources, times = {}, {}
+    n_observations = len(data)
+    source_indexes = np.empty(n_observations, dtype=np.int64)
+    time_indexes = np.empty(n_observations, dtype=np.int64)
+    values = np.empty(n_observations, dtype=np.float32)
+    for i, item in enumerate(data):
+        source_indexes[i] = sources.setdefault(item['sourceId'], len(sources))
+        time_indexes[i] = times.setdefault(item['referenceTime'], len(times))
+        values[i] = item['observations'][0]['value']
+    if ids is None:
+        for source in sources:
+            rows.setdefault(source.split(':')[0], len(rows))
+    source_rows = np.array([rows.get(source.split(':')[0], -1) for source in sources], dtype=np.int64)
+    time_offsets = ((np.array([time[:13] for time in times], dtype='M8[h]') - hours[0]) /
+                    np.timedelta64(1, 'h')).astype(np.int64)
+    stations, offsets = source_rows[source_indexes], time_offsets[time_indexes]
+    inside = (stations >= 0) & (offsets >= 0) & (offsets < len(hours))
+    cells = stations[inside] * len(hours) + offsets[inside]
+    n_cells = len(rows) * len(hours)
+    counts = np.bincount(cells, minlength=n_cells).reshape(len(rows), len(hours))
+    matrix = np.full((len(rows), len(hours)), np.nan, dtype=np.float32)
+    matrix.reshape(-1)[cells] = values[inside]
+    observed = counts == 1
+    matrix[~observed] = np.nan
+    return list(rows), matrix, observed
+
+
+def precipitation_lists(matrix: np.ndarray) -> list[list[float]]:
+    """
+    Returns the rows of a precipitation matrix as lists of floats, for the JSON and CSV outputs.
+
+    :param matrix: Array (stations x hours) containing the float32 precipitation.
+    :return: List containing the precipitation of every station.
+    """
+    return matrix.astype(np.float64).round(PRECIPITATION_DECIMALS).tolist()
@@ -0,0 +1,240 @@
+"""
+observation_store.py: Contains the class 'ObservationStore' which keeps the hourly precipitation downloaded from FROST
+locally, and the class 'StoredObservations' which fetches only the hours the store doesn't hold yet.
+
+Historic observations don't change, yet every MET precipitation request downloaded its whole date range again, while
+most requests of the dashboards repeat or overlap earlier ones. The store keeps, per station and month, which hours
+were downloaded and the precipitation of those hours in an SQLite database (NaN where the station has no single
+observation, float32). A request reads the stations from the store first and fetches only the consecutive hours that are
+missing for any of its stations. Hours younger than the settle period are never stored, because FROST still receives
+late observations for them.
+"""
+
+__author__ = "Tim Rietdijk"
+__email__ = "tim.is@live.nl"
+__status__ = "Development"
+
+# standard imports:
+import os
+import sqlite3
+from contextlib import closing
+
+# third-party imports:
+import httpx
+import numpy as np
+from dotenv import dotenv_values
+from numpy import datetime64
+from pandas import DataFrame
+
+# local imports:
+from date_range import DateRange
+from MET.completeness import date_range_hours
+from MET.observation_matrix import parse_observation_matrix, precipitation_lists
+
+secrets = dotenv_values('.env')
+
+
+def hours_interval(hours: np.ndarray) -> str:
+    """
+    Returns consecutive hours as the referencetime interval of FROST.
+
+    :param hours: Array of datetime64[h] containing consecutive hours.
+    :return: String representing the interval (YYYY-MM-DDTHH:MM/YYYY-MM-DDTHH:MM), the end is exclusive.
+    """
+    return f"{hours[0].astype('M8[m]')}/{(hours[-1] + 1).astype('M8[m]')}"
+
+
+def _month_offsets(hours: np.ndarray, month: datetime64) -> tuple[np.ndarray, np.ndarray, int]:
+    """
+    Locates the hours of a month within consecutive hours.
+
+    :param hours: Array of datetime64[h] containing consecutive hours.
+    :param month: The month (datetime64[M]).
+    :return: tuple containing the positions of the hours of the month within the hours, their positions within the
+    month and the number of hours in the month.
+    """
+    in_month = np.flatnonzero(hours.astype('M8[M]') == month)
+    start = month.astype('M8[h]')
+    n_hours = int(((month + 1).astype('M8[h]') - start) / np.timedelta64(1, 'h'))
+    return in_month, ((hours[in_month] - start) / np.timedelta64(1, 'h')).astype(np.int64), n_hours
+
+
+class ObservationStore:
+    def __init__(self, path: str, settle_days: float = 7) -> None:
+        """
+        The local store of the hourly precipitation of the MET stations, stored in an SQLite database shared by the
+        workers.
+
+        :param path: File of the SQLite database, created on first use.
+        :param settle_days: Number of days after which the observations of an hour are considered final.
+        """
+        self.path = path
+        self.settle = np.timedelta64(int(settle_days * 24), 'h')
+        self._created = False
+
+    def _connect(self) -> sqlite3.Connection:
+        if not self._created:
+            os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        connection = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        if not self._created:
+            connection.execute("CREATE TABLE IF NOT EXISTS observations (station TEXT NOT NULL, month TEXT NOT NULL, "
+                               "held BLOB NOT NULL, precipitation BLOB NOT NULL, PRIMARY KEY (station, month))")
+            self._created = True
+        return connection
+
+    @staticmethod
+    def _read_months(connection: sqlite3.Connection, ids: list[str],
+                     months: np.ndarray) -> dict[tuple[str, str], tuple[np.ndarray, np.ndarray]]:
+        """
+        Reads the stored months of the stations.
+
+        :param connection: Connection to the database.
+        :param ids: Ids of the stations.
+        :param months: Array of datetime64[M] containing the months.
+        :return: Dictionary containing the held hours and the precipitation (arrays over the hours of the month) by
+        station and month, months without stored hours are left out.
+        """
+        if not ids:
+            return {}
+        month_names = [str(month) for month in months]
+        rows = connection.execute(f"SELECT station, month, held, precipitation FROM observations "
+                                  f"WHERE station IN ({','.join('?' * len(ids))}) "
+                                  f"AND month IN ({','.join('?' * len(month_names))})", [*ids, *month_names])
+        stored = {}
+        for station, month, held, precipitation in rows:
+            precipitation = np.frombuffer(precipitation, np.float32).copy()
+            stored[station, month] = (np.unpackbits(np.frombuffer(held, np.uint8),
+                                                    count=len(precipitation)).astype(bool), precipitation)
+        return stored
+
+    def read(self, ids: list[str], hours: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Reads the stored precipitation of the stations.
+
+        :param ids: Ids of the stations.
+        :param hours: Array of datetime64[h] containing consecutive hours.
+        :return: tuple containing the held hours (stations x hours, boolean) and the precipitation (stations x hours,
+        float32, NaN where it isn't held or the station has no single observation).
+        """
+        held = np.zeros((len(ids), len(hours)), dtype=bool)
+        values = np.full((len(ids), len(hours)), np.nan, dtype=np.float32)
+        months = np.unique(hours.astype('M8[M]'))
+        with closing(self._connect()) as connection:
+            stored = self._read_months(connection, ids, months)
+        for month in months:
+            positions, offsets, _ = _month_offsets(hours, month)
+            for row, station in enumerate(ids):
+                if (station, str(month)) in stored:
+                    month_held, month_values = stored[station, str(month)]
+                    held[row, positions] = month_held[offsets]
+                    values[row, positions] = month_values[offsets]
+        values[~held] = np.nan
+        return held, values
+
+    def write(self, ids: list[str], hours: np.ndarray, values: np.ndarray) -> None:
+        """
+        Stores the downloaded precipitation of the stations. Hours within the settle period are left out.
+
+        :param ids: Ids of the stations that were downloaded.
+        :param hours: Array of datetime64[h] containing the consecutive hours that were downloaded.
+        :param values: Array (stations x hours) containing the float32 precipitation, NaN where the station has no
+        single observation.
+        """
+        settled = hours < datetime64('now', 'h') - self.settle
+        hours, values = hours[settled], values[:, settled]
+        if not len(hours) or not ids:
+            return
+        months = np.unique(hours.astype('M8[M]'))
+        with closing(self._connect()) as connection:
+            connection.execute("BEGIN IMMEDIATE")
+            try:
+                stored = self._read_months(connection, ids, months)
+                for month in months:
+                    positions, offsets, n_hours = _month_offsets(hours, month)
+                    for row, station in enumerate(ids):
+                        held, precipitation = stored.get((station, str(month)), (
+                            np.zeros(n_hours, dtype=bool), np.full(n_hours, np.nan, dtype=np.float32)))
+                        held[offsets] = True
+                        precipitation[offsets] = values[row, positions]
+                        connection.execute("INSERT OR REPLACE INTO observations VALUES (?, ?, ?, ?)",
+                                           (station, str(month), np.packbits(held).tobytes(),
+                                            precipitation.tobytes()))
+                connection.execute("COMMIT")
+            except BaseException:
+                connection.execute("ROLLBACK")
+                raise
+
+
+class StoredObservations:
+    def __init__(self, store: ObservationStore, ids: list[str], date_range: DateRange) -> None:
+        """
+        The precipitation of stations in a date range, read from the store and completed with the hours fetched from
+        FROST. Every consecutive run of hours that is missing for any station is one request, for the stations missing
+        (part of) it.
+
+        :param store: The observation store.
+        :param ids: Ids of the stations.
+        :param date_range: The date range.
+        """
+        self.store = store
+        self.ids = ids
+        self.hours = date_range_hours(date_range)
+        self.held, self.values = store.read(ids, self.hours)
+        self.error: str | None = None
+        missing = ~self.held.all(axis=0)
+        edges = np.flatnonzero(np.diff(np.concatenate([[False], missing, [False]]).astype(np.int8)))
+        self.requests = []
+        for start, stop in zip(edges[::2], edges[1::2]):
+            stations = [station for station, held in zip(ids, self.held[:, start:stop]) if not held.all()]
+            self.requests.append((stations, self.hours[start:stop]))
+
+    def add(self, ids: list[str], hours: np.ndarray, r: httpx.Response) -> np.ndarray | None:
+        """
+        Adds the response of one of the requests and stores the downloaded hours. FROST answers 404 when none of the
+        stations observed anything.
+
+        :param ids: Ids of the stations of the request.
+        :param hours: Array of datetime64[h] containing the hours of the request.
+        :param r: Response of the FROST observations endpoint.
+        :return: Array (stations x hours) of booleans representing whether the station observed the hour exactly once,
+        or None if FROST returned an error.
+        """
+        if r.status_code not in (200, 404):
+            if r.status_code in (400, 412):
+                self.error = 'FROST API (Observations): ' + r.json()['error']['reason']
+            else:
+                self.error = f'FROST API (Observations): status {r.status_code}'
+            return None
+        _, downloaded, observed = parse_observation_matrix(r.json()['data'] if r.status_code == 200 else [], hours, ids)
+        self.store.write(ids, hours, downloaded)
+        columns = slice(int((hours[0] - self.hours[0]) / np.timedelta64(1, 'h')),
+                        int((hours[-1] - self.hours[0]) / np.timedelta64(1, 'h')) + 1)
+        row_of = {station: row for row, station in enumerate(self.ids)}
+        for row, station in enumerate(ids):
+            target = row_of[station]
+            fetched = ~self.held[target, columns]
+            self.values[target, columns] = np.where(fetched, downloaded[row], self.values[target, columns])
+            self.held[target, columns] = True
+        return observed
+
+    def result(self) -> DataFrame | str:
+        """
+        Returns the stations with a complete observation list, in the structure of parse_station_observations.
+
+        :return: DataFrame containing the 'id' and 'precipitation' of every complete station, or the reason FROST gave
+        for not returning observations.
+        """
+        if self.error is not None:
+            return self.error
+        complete = self.held.all(axis=1) & ~np.isnan(self.values).any(axis=1)
+        return DataFrame({'id': [station for station, keep in zip(self.ids, complete) if keep],
+                          'precipitation': precipitation_lists(self.values[complete])})
+
+
+"""
+The store is kept in MET_OBSERVATION_STORE_PATH (default: data/met_observations.sqlite), observations are final after
+the settle period of the completeness index (MET_COMPLETENESS_SETTLE_DAYS, default: 7).
+"""
+observation_store = ObservationStore(secrets.get('MET_OBSERVATION_STORE_PATH') or
+                                     os.path.join('data', 'met_observations.sqlite'),
+                                     float(secrets.get('MET_COMPLETENESS_SETTLE_DAYS') or 7))
@@ -0,0 +1,274 @@
+"""
+station_catalog.py: Contains the class 'StationCatalog' which mirrors the MET precipitation stations locally.
+
+Locating the stations near a point or within a polygon used to cost a request to frost.met.no/sources on every API
+call, while the station network only changes a few times a year. The catalog keeps the coordinates and valid-time
+interval of every sensor system measuring hourly precipitation in memory. Nearest-k lookups use a KD-tree over the
+stations on the unit sphere, polygon lookups a bounding box filter followed by a vectorised containment test. The
+catalog is refreshed in the background (a conditional request, so an unchanged catalog isn't downloaded again) and
+stored on disk, so a restarted worker can answer lookups before the first refresh.
+"""
+
+__author__ = "Tim Rietdijk"
+__email__ = "tim.is@live.nl"
+__status__ = "Development"
+
+# standard imports:
+import json
+import os
+import threading
+import time
+
+# third-party imports:
+import numpy as np
+import pandas as pd
+import shapely
+from dotenv import dotenv_values
+from pandas import DataFrame
+from scipy.spatial import cKDTree
+from shapely.geometry import Point
+from shapely.geometry.base import BaseGeometry
+
+# local imports:
+from date_range import DateRange
+from upstream import UpstreamClient, upstream
+
+FROST_STATION_ENDPOINT = 'https://frost.met.no/sources/v0.jsonld'
+PRECIPITATION_ELEMENT = 'sum(precipitation_amount PT1H)'
+EARTH_RADIUS_KM = 6371.0
+secrets = dotenv_values('.env')
+
+
+def _unit_vectors(lons: np.ndarray, lats: np.ndarray) -> np.ndarray:
+    lons, lats = np.radians(lons), np.radians(lats)
+    return np.stack([np.cos(lats) * np.cos(lons), np.cos(lats) * np.sin(lons), np.sin(lats)], axis=-1)
+
+
+class _Stations:
+    def __init__(self, stations: list[dict]) -> None:
+        """
+        An immutable snapshot of the catalog together with its spatial index, swapped as a whole on refresh.
+
+        :param stations: List containing the id, name, lon, lat, valid_from and valid_to of every station.
+        """
+        self.records = stations
+        self.ids = np.array([station['id'] for station in stations], dtype=object)
+        self.names = np.array([station['name'] for station in stations], dtype=object)
+        self.lons = np.array([station['lon'] for station in stations], dtype=np.float64)
+        self.lats = np.array([station['lat'] for station in stations], dtype=np.float64)
+        self.valid_from = np.array([station['valid_from'] or 'NaT' for station in stations], dtype='M8[m]')
+        self.valid_to = np.array([station['valid_to'] or 'NaT' for station in stations], dtype='M8[m]')
+        self.tree = cKDTree(_unit_vectors(self.lons, self.lats)) if stations else None
+
+    def valid(self, indexes: np.ndarray, date_range: DateRange | None) -> np.ndarray:
+        """
+        Checks which stations measured during (part of) the date range, stations without an end are still active.
+
+        :param indexes: Indexes of the stations.
+        :param date_range: (optional) The date range, None accepts every station.
+        :return: Boolean array representing whether every station is valid.
+        """
+        if date_range is None:
+            return np.ones(len(indexes), dtype=bool)
+        valid_from, valid_to = self.valid_from[indexes], self.valid_to[indexes]
+        return (np.isnat(valid_from) | (valid_from <= date_range.max_date)) & \
+            (np.isnat(valid_to) | (valid_to >= date_range.min_date))
+
+    def frame(self, indexes: np.ndarray, distances: np.ndarray | None = None) -> DataFrame:
+        """
+        Returns stations in the structure of the FROST sources endpoint, as parsed by parse_stations.
+
+        :param indexes: Indexes of the stations.
+        :param distances: (optional) Distance in km of every station.
+        :return: DataFrame containing the id, name, geometry (and distance) of the stations.
+        """
+        df = DataFrame({'id': self.ids[indexes], 'name': self.names[indexes],
+                        'geometry': [Point(lon, lat) for lon, lat in zip(self.lons[indexes], self.lats[indexes])]})
+        if distances is not None:
+            df['distance'] = distances
+        return df
+
+
+class StationCatalog:
+    def __init__(self, path: str | None = None, refresh_interval: float = 24 * 3600,
+                 client: UpstreamClient = upstream) -> None:
+        """
+        The local mirror of the MET stations measuring hourly precipitation, shared by all requests of a worker.
+
+        :param path: (optional) File the catalog is stored in, so it survives a restart.
+        :param refresh_interval: Seconds between two refreshes from FROST.
+        :param client: The upstream client the FROST requests are sent with.
+        """
+        self.path = path
+        self.refresh_interval = refresh_interval
+        self._client = client
+        self._stations: _Stations | None = None
+        self._etag: str | None = None
+        self._last_modified: str | None = None
+        self.refreshed_at: float | None = None
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._thread: threading.Thread | None = None
+        if path and os.path.exists(path):
+            self._load()
+
+    @property
+    def is_ready(self) -> bool:
+        return self._stations is not None
+
+    def __len__(self) -> int:
+        return len(self._stations.ids) if self._stations is not None else 0
+
+    def _load(self) -> None:
+        with open(self.path) as file:
+            stored = json.load(file)
+        self._stations = _Stations(stored['stations'])
+        self._etag, self._last_modified = stored.get('etag'), stored.get('last_modified')
+        self.refreshed_at = stored.get('refreshed_at')
+
+    def _save(self) -> None:
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        temporary = f"{self.path}.tmp"
+        with open(temporary, 'w') as file:
+            json.dump({'stations': self._stations.records, 'etag': self._etag, 'last_modified': self._last_modified,
+                       'refreshed_at': self.refreshed_at}, file)
+        os.replace(temporary, self.path)
+
+    def refresh(self) -> bool:
+        """
+        Downloads the catalog from FROST. The request is conditional on the previous download, so an unchanged
+        catalog answers 304 and isn't transferred again.
+
+        :return: Boolean representing whether the catalog changed.
+        """
+        with self._lock:
+            headers = {}
+            if self._stations is not None and self._etag:
+                headers['If-None-Match'] = self._etag
+            if self._stations is not None and self._last_modified:
+                headers['If-Modified-Since'] = self._last_modified
+            r = self._client.get(FROST_STATION_ENDPOINT,
+                                 {'types': 'SensorSystem', 'elements': PRECIPITATION_ELEMENT,
+                                  'fields': 'id, name, geometry, validFrom, validTo'},
+                                 headers=headers, auth=(secrets['MET_FROST_CLIENT_ID'], ''))
+            changed = r.status_code != 304
+            if changed:
+                r.raise_for_status()
+                stations = [{'id': source['id'], 'name': source.get('name', ''),
+                             'lon': source['geometry']['coordinates'][0], 'lat': source['geometry']['coordinates'][1],
+                             'valid_from': source.get('validFrom', '')[:16] or None,
+                             'valid_to': source.get('validTo', '')[:16] or None}
+                            for source in r.json()['data'] if source.get('geometry')]
+                changed = self._stations is None or stations != self._stations.records
+                if changed:
+                    self._stations = _Stations(stations)
+                self._etag, self._last_modified = r.headers.get('ETag'), r.headers.get('Last-Modified')
+            self.refreshed_at = time.time()
+            if self.path:
+                self._save()
+            return changed
+
+    def _run(self) -> None:
+        """
+        Background loop that refreshes the catalog when it is older than the refresh interval.
+
+        :return: None
+        """
+        while not self._stopped.is_set():
+            age = time.time() - (self.refreshed_at or 0)
+            if age >= self.refresh_interval:
+                try:
+                    self.refresh()
+                    age = 0
+                except Exception as e:
+                    print(f"Failed to refresh the MET station catalog: {e}")
+                    age = self.refresh_interval - 60
+            self._stopped.wait(self.refresh_interval - age)
+
+    def start(self) -> None:
+        """
+        Starts refreshing the catalog in the background.
+
+        :return: None
+        """
+        if self._thread is None:
+            self._stopped.clear()
+            self._thread = threading.Thread(target=self._run, name='StationCatalog', daemon=True)
+            self._thread.start()
+
+    def close(self) -> None:
+        """
+        Stops the background refresh.
+
+        :return: None
+        """
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def nearest(self, point: Point, k: int, date_range: DateRange | None = None) -> DataFrame:
+        """
+        Returns the k stations closest to the point that were valid during the date range, closest first.
+
+        :param point: Point (EPSG:4326).
+        :param k: Number of stations.
+        :param date_range: (optional) The date range the stations have to be valid in.
+        :return: DataFrame containing the id, name, geometry and distance (km) of the stations.
+        """
+        stations = self._stations
+        n_stations = len(stations.ids)
+        if not n_stations or k < 1:
+            return stations.frame(np.zeros(0, dtype=np.int64), np.zeros(0))
+        query = min(n_stations, 2 * k)
+        while True:
+            chords, indexes = stations.tree.query(_unit_vectors(point.x, point.y), k=query)
+            chords, indexes = np.atleast_1d(chords), np.atleast_1d(indexes)
+            valid = stations.valid(indexes, date_range)
+            if valid.sum() >= k or query >= n_stations:
+                break
+            query = min(n_stations, query * 4)
+        chords, indexes = chords[valid][:k], indexes[valid][:k]
+        return stations.frame(indexes, np.round(2 * EARTH_RADIUS_KM * np.arcsin(np.minimum(chords / 2, 1)), 3))
+
+    def within(self, polygons: list[BaseGeometry], date_range: DateRange | None = None) -> DataFrame:
+        """
+        Returns the stations within any of the polygons that were valid during the date range.
+
+        :param polygons: Polygons (EPSG:4326).
+        :param date_range: (optional) The date range the stations have to be valid in.
+        :return: DataFrame containing the id, name and geometry of the stations.
+        """
+        stations = self._stations
+        inside = np.zeros(len(stations.ids), dtype=bool)
+        for polygon in polygons:
+            minx, miny, maxx, maxy = polygon.bounds
+            candidates = np.flatnonzero((stations.lons >= minx) & (stations.lons <= maxx) &
+                                        (stations.lats >= miny) & (stations.lats <= maxy))
+            inside[candidates[shapely.contains_xy(polygon, stations.lons[candidates],
+                                                  stations.lats[candidates])]] = True
+        indexes = np.flatnonzero(inside)
+        return stations.frame(indexes[stations.valid(indexes, date_range)])
+
+    def ids(self, date_range: DateRange | None = None) -> list[str]:
+        """
+        Returns the ids of the stations that were valid during the date range.
+
+        :param date_range: (optional) The date range the stations have to be valid in.
+        :return: List containing the station ids.
+        """
+        stations = self._stations
+        indexes = np.arange(len(stations.ids))
+        return list(stations.ids[indexes[stations.valid(indexes, date_range)]])
+
+    def summary(self) -> dict[str, int | str | None]:
+        return {'stations': len(self),
+                'refreshed_at': pd.Timestamp(self.refreshed_at, unit='s').isoformat() if self.refreshed_at else None}
+
+
+"""
+The catalog is stored in MET_STATION_CATALOG_PATH (default: data/met_stations.json) and refreshed every
+MET_STATION_CATALOG_REFRESH seconds (default: a day).
+"""
+station_catalog = StationCatalog(secrets.get('MET_STATION_CATALOG_PATH') or os.path.join('data', 'met_stations.json'),
+                                 float(secrets.get('MET_STATION_CATALOG_REFRESH') or 24 * 3600))
@@ -4,13 +4,13 @@ from typing import Tuple, Callable, Any
 import geopandas
 import numpy as np
 import pandas as pd
-import requests
 from dotenv import dotenv_values
 from geopandas import GeoDataFrame, GeoSeries, points_from_xy
 from pandas import DataFrame
 from scipy.spatial import cKDTree
 
 from date_range import DateRange
+from upstream import upstream
 
 secrets = dotenv_values('.env')
 
@@ -27,7 +27,7 @@ def get_waterlevel_flow_observations(ids: str, date_range: DateRange):
         "Accept": "application/json",
         "X-API-Key": "JkbAM/hEkk+5Z7mJIlC3fQ==",
     }
-    nve_stations = requests.get(url, parameters, headers=request_headers)
+    nve_stations = upstream.get(url, parameters, headers=request_headers)
     parsed_result = nve_stations.json()
     df = pd.json_normalize(parsed_result['data'])
     return df
@@ -39,7 +39,7 @@ def get_nearest_station_obesrvation(shape: GeoDataFrame, date_range: DateRange):
         "Accept": "application/json",
         "X-API-Key": "JkbAM/hEkk+5Z7mJIlC3fQ==",
     }
-    nve_stations = requests.get(url, headers=request_headers)
+    nve_stations = upstream.get(url, headers=request_headers)
     parsed_result = nve_stations.json()
     df = pd.json_normalize(parsed_result['data'])
     df['parameters'] = [[x['parameter'] for x in i] for i in df.seriesList]
@@ -14,12 +14,12 @@ from typing import List, Any, Dict
 # third-party imports:
 import pandas as pd
 import pytz
-import requests
 from termcolor import colored
 
 from Schemas.schemas_pipelife import CulvertResults
 from exceptions import InvalidPipeLifeCredentials
 from date_range import DateRange
+from upstream import upstream
 
 
 class Culvert(ABC):
@@ -67,7 +67,7 @@ class PipeLifeCulvert(Culvert):
         :return: A dictionary containing the tag data for this location
         """
         api_endpoint = f'https://www.telecontrolnet.nl/api/v1/locations/{self._location_id}/tags'
-        api_request = requests.get(api_endpoint, {'access_token': self._access_token})
+        api_request = upstream.get(api_endpoint, {'access_token': self._access_token})
         response = api_request.json()
         return response
 
@@ -96,7 +96,7 @@ class PipeLifeCulvert(Culvert):
         culvert_result_list = []
         for id in self._water_level_ids:
             api_endpoint = f'https://www.telecontrolnet.nl/api/v1/trend/{id}'
-            values_request = requests.get(api_endpoint,
+            values_request = upstream.get(api_endpoint,
                                           {'access_token': self._access_token, "s": date_range.min_date_unix,
                                            'e': date_range.max_date_unix})
             response = values_request.json()
@@ -117,7 +117,7 @@ class PipeLifeCulvert(Culvert):
         :return: Dataframe containing timestamps and values gathered between the given dates.
         """
         api_endpoint = f'https://www.telecontrolnet.nl/api/v1/locations/{self._location_id}/tags'
-        values_request = requests.get(api_endpoint, {'access_token': self._access_token})
+        values_request = upstream.get(api_endpoint, {'access_token': self._access_token})
         response = values_request.json()
         return response
 
@@ -138,12 +138,12 @@ class PipeLifeCulvert(Culvert):
             return None
         image_id = self._response['tags'][tag_index]['tag']['id']
         api_endpoint = f'https://www.telecontrolnet.nl/api/v1/trend/{image_id}'
-        api_request = requests.get(api_endpoint,
+        api_request = upstream.get(api_endpoint,
                                    {'access_token': self._access_token, "s": date_range.min_date_unix,
                                     'e': date_range.max_date_unix})
         response = api_request.json()
         url = f"https://www.telecontrolnet.nl/api/v1/locations/{self._location_id}/files"
-        response_file = requests.get(url, {'access_token': self._access_token})
+        response_file = upstream.get(url, {'access_token': self._access_token})
         if 'error' in response_file.json():
             print(colored(f"{self._location_id}:", 'white'), colored(f" {response_file.json()['error']}", 'yellow'))
         else:
@@ -207,7 +207,7 @@ class PipeLifeUser:
             'password': self._password,
         }
 
-        token_request = requests.post(token_endpoint, parameters)
+        token_request = upstream.post(token_endpoint, parameters)
         if 'error' in token_request.json():
             raise InvalidPipeLifeCredentials
         return token_request.json()['access_token']
@@ -219,7 +219,7 @@ class PipeLifeUser:
         :return: List containing the culvert classes of the requested locations
         """
         api_endpoint = f'https://www.telecontrolnet.nl/api/v1/locations'
-        api_request = requests.get(api_endpoint, {'access_token': self.access_token})
+        api_request = upstream.get(api_endpoint, {'access_token': self.access_token})
         location_id_list = [
             PipeLifeCulvert(self.access_token, i['location']['id'],
                             [float(i['location']['y']), float(i['location']['x'])]) for i in
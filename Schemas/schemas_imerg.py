@@ -0,0 +1,17 @@
+from pydantic import BaseModel
+
+
+class ImergPoints(BaseModel):
+    date_range: str
+    feature_collection: dict | None = None
+    wkt: list[str] | None = None
+    crs: int = 4326
+    aggregation: str = 'hourly'
+    output: str = 'python'
+
+
+class ImergPointsResults(BaseModel):
+    ids: list[str | int]
+    cells: list[list[int]]
+    timestamp: list[int]
+    precipitation: list[list[float]]
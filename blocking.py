@@ -0,0 +1,65 @@
+"""
+blocking.py: Contains the class 'BlockingExecutor' which runs the blocking work of async endpoints off the event loop.
+
+TileDB reads, geopandas/shapely work and parsing of large upstream responses block the thread they run on. Called from
+an async endpoint they stall the event loop of the worker, and with it every other request. The executor runs them on
+a bounded pool of threads instead, so the event loop keeps serving requests and the number of concurrent reads is
+capped.
+"""
+
+__author__ = "Tim Rietdijk"
+__email__ = "tim.is@live.nl"
+__status__ = "Development"
+
+# standard imports:
+import asyncio
+import functools
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable
+
+
+class BlockingExecutor:
+    def __init__(self, workers: int | None = None, name: str = 'BlockingExecutor') -> None:
+        """
+        The pool of threads shared by all async endpoints of a worker for their blocking work.
+
+        :param workers: Maximum number of blocking calls running at once (default: number of cores + 4). Further
+        calls wait for a free thread without blocking the event loop.
+        :param name: Prefix of the names of the threads.
+        """
+        self.workers = workers
+        self.name = name
+        self._pool: ThreadPoolExecutor | None = None
+
+    def start(self) -> None:
+        """
+        Starts the thread pool.
+
+        :return: None
+        """
+        if self._pool is None:
+            self._pool = ThreadPoolExecutor(self.workers, thread_name_prefix=self.name)
+
+    def close(self) -> None:
+        """
+        Shuts the thread pool down after the running calls are finished.
+
+        :return: None
+        """
+        if self._pool is not None:
+            self._pool.shutdown()
+            self._pool = None
+
+    async def run(self, function: Callable[..., Any], *args, **kwargs) -> Any:
+        """
+        Runs a blocking function on the thread pool and waits for it without blocking the event loop. Exceptions
+        raised by the function are raised here.
+
+        :param function: The blocking function.
+        :param args: Positional arguments of the function.
+        :param kwargs: Keyword arguments of the function.
+        :return: The return value of the function.
+        """
+        self.start()
+        call = functools.partial(function, *args, **kwargs)
+        return await asyncio.get_running_loop().run_in_executor(self._pool, call)
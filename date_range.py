@@ -8,19 +8,15 @@ __status__ = "Development"
 
 import os
 # standard imports:
-import pathlib
 import time
 from datetime import datetime
 
 # third-party imports:
-import glob
 import numpy as np
 import pandas as pd
 from numpy import datetime64
 from pandas import Timestamp
 
-IMERG_PATH = "G:/nasa_rain_data/hdf5/"
-
 
 class DateRange:
     def __init__(self, date_range: str):
@@ -109,6 +105,16 @@ class DateRange:
         hourly_range = np.arange(self.min_date, self.max_date, np.timedelta64(1, "h"))
         return [int(time.mktime(t.astype(datetime).timetuple())) * 1000 for t in hourly_range]
 
+    @property
+    def unix_start(self) -> int:
+        """
+        Returns the first hour of the date range the same way unix_list does, for outputs that describe the hourly
+        range by its start and step instead of listing every timestamp.
+
+        :return: Integer representing the first timestamp within date range as Unix time in milliseconds
+        """
+        return int(time.mktime(self.min_date.astype(datetime).timetuple())) * 1000
+
     @property
     def __datetime_list(self) -> list[datetime]:
         """
@@ -120,29 +126,75 @@ class DateRange:
         hourly_range = np.arange(self.min_date, self.max_date + np.timedelta64(30, 'm'), np.timedelta64(30, "m"))
         return [t.astype(datetime) for t in hourly_range]
 
-    @property
-    def imerg_date_range(self) -> tuple[datetime64, datetime64]:
+    def is_valid(self, min_date: datetime64, max_date: datetime64) -> bool:
         """
-        Gets the fist and last timestamp of IMERG data stored on the 7Analytics server
+        Checks if the range is equal to or within the first and last available timestamp of a dataset, for example the
+        ones recorded in the IMERG availability (see IMERG/availability.py).
 
-        :return: Tuple of first and last selectable timestamps
+        :param min_date: First available timestamp.
+        :param max_date: Last available timestamp.
+        :return: Boolean representing whether the range is within the available range
         """
-        min_date = datetime64(datetime.strptime(pathlib.Path(glob.glob(IMERG_PATH + '*.HDF5')[0]).stem, '%Y%m%d-S%H%M'),
-                              'm')
-        max_date = datetime64(
-            datetime.strptime(pathlib.Path(glob.glob(IMERG_PATH + '*.HDF5')[-1]).stem, '%Y%m%d-S%H%M'), 'm')
-        return min_date, max_date
+        return min_date <= self.min_date <= self.max_date <= max_date
+
 
-    def is_valid(self) -> bool:
+class DateRanges:
+    def __init__(self, date_ranges: list[DateRange]):
         """
-        Checks if the given range is equal to or within 2000-06-01 00:00 and 2021-09-30 23:00.
+        A class representing several date ranges (windows) that are read in one request, for example the same season
+        across many years. The windows are sorted and may not overlap.
 
-        :param daterange: String containing 2 dates in 'YYYY-MM-DD' divided by a '/'
-        :return: Boolean representing whether given range is within IMERG data range
-        """
-        try:
-            imerg_min_date, imerg_max_date = self.imerg_date_range
-            return imerg_min_date <= self.min_date <= self.max_date <= imerg_max_date
-        except Exception as e:
-            print(f'DateRange error: {e}')
-            return False
+        :param date_ranges: List of DateRange objects.
+        """
+        if not date_ranges:
+            raise ValueError("At least one date range is needed")
+        self.windows = sorted(date_ranges, key=lambda date_range: date_range.min_date)
+        for previous, window in zip(self.windows, self.windows[1:]):
+            if window.min_date <= previous.max_date:
+                raise ValueError(f"Date ranges {previous.min_date_str}/{previous.max_date_str} and "
+                                 f"{window.min_date_str}/{window.max_date_str} overlap")
+
+    @classmethod
+    def from_string(cls, date_ranges: str) -> 'DateRanges':
+        """
+        Creates the windows from a list of date ranges.
+
+        :param date_ranges: string with comma separated date ranges (YYYY-MM-DD/YYYY-MM-DD,YYYY-MM-DD/YYYY-MM-DD)
+        :return: DateRanges containing every date range.
+        """
+        windows = [DateRange(date_range.strip()) for date_range in date_ranges.split(',')]
+        for window in windows:
+            if len(window._dates) != 2 or window.min_date > window.max_date:
+                raise ValueError(f"Date range '{window._date_range_str}' not recognized, use YYYY-MM-DD/YYYY-MM-DD")
+        return cls(windows)
+
+    @classmethod
+    def seasonal(cls, years: str, months: str) -> 'DateRanges':
+        """
+        Creates one window per year covering the same consecutive months, for example every July (months '7') or
+        every winter (months '12,1,2'). A season that runs past December ends in the next year.
+
+        :param years: string with the first and last year (YYYY-YYYY) or a single year (YYYY)
+        :param months: string with comma separated, consecutive month numbers (1 - 12)
+        :return: DateRanges containing the season of every year.
+        """
+        first_year, _, last_year = years.partition('-')
+        month_numbers = [int(month) for month in months.split(',')]
+        if any(not 1 <= month <= 12 for month in month_numbers) or len(month_numbers) > 12 or \
+                any((following - month) % 12 != 1 for month, following in zip(month_numbers, month_numbers[1:])):
+            raise ValueError(f"Months '{months}' have to be consecutive month numbers (1 - 12)")
+        windows = []
+        for year in range(int(first_year), int(last_year or first_year) + 1):
+            start = datetime64(f"{year}-{month_numbers[0]:02d}", 'M')
+            end = (start + np.timedelta64(len(month_numbers), 'M')).astype('M8[D]') - np.timedelta64(1, 'D')
+            windows.append(DateRange(f"{start.astype('M8[D]')}/{end}"))
+        return cls(windows)
+
+    def __str__(self) -> str:
+        return ','.join(f"{window.min_date_str}/{window.max_date_str}" for window in self.windows)
+
+    def __iter__(self):
+        return iter(self.windows)
+
+    def __len__(self) -> int:
+        return len(self.windows)
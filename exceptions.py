@@ -40,4 +40,33 @@ class InvalidLocationIdList(Exception):
                 wrong_ids.append(i)
 
         self.message = f"The provided location id list contains these invalid ids: {wrong_ids}"
-        super().__init__(self.message)
\ No newline at end of file
+        super().__init__(self.message)
+
+
+class DateRangeOutOfBounds(Exception):
+    """
+    Exception raised when a date range falls outside the temporal axis of a tile database
+    """
+
+    def __init__(self, timestamp, min_date, max_date=None) -> None:
+        """
+        :param timestamp: The timestamp that couldn't be found in the tile database.
+        :param min_date: First timestamp stored in the tile database.
+        :param max_date: (optional) Last timestamp stored in the tile database.
+        """
+        self.message = f"{timestamp} is outside the available range ({min_date}/{max_date or '...'})"
+        super().__init__(self.message)
+
+
+class DatasetNotReady(Exception):
+    """
+    Exception raised when a tile database hasn't been opened (yet)
+    """
+
+    def __init__(self, uri: str, error: Exception | None = None) -> None:
+        """
+        :param uri: Location of the tile database.
+        :param error: (optional) The error raised while opening the tile database.
+        """
+        self.message = f"Tile database '{uri}' is not available yet" + (f" ({error})" if error else "")
+        super().__init__(self.message)
@@ -1,28 +1,46 @@
 import io
 import itertools
-import time
-from typing import Any, List
+from contextlib import asynccontextmanager
+from typing import Any, Callable, List
 import geopandas
 import pandas as pd
-import requests
 import shapely
 import tiledb
 from fastapi import FastAPI, HTTPException
 from geopandas import GeoSeries
 from geopandas import GeoDataFrame as gpd
 import numpy as np
-from pyogrio import read_dataframe
+from numpy import datetime64
 from sqlalchemy import create_engine
 from starlette.middleware.cors import CORSMiddleware
 from starlette.responses import StreamingResponse, Response
 from dotenv import dotenv_values
 from MET.forecast_api import get_forecast
+from MET.station_catalog import station_catalog
 from NVE.nve_api import get_nearest_station_obesrvation
 from PipeLife.culvert import PipeLifeUser, CulvertResults, PipeLifeCulvert
+from Schemas.schemas_imerg import ImergPoints, ImergPointsResults
 from Schemas.schemas_met import MetStation
-from date_range import DateRange
-from MET.met_api import get_nearest_stations_to_point, get_station_within_polygon, get_processed_station_observations, \
-    get_processed_station_observations_poly, get_idf_curve_from_nearest_station, get_idf_from_raster
+from date_range import DateRange, DateRanges
+from blocking import BlockingExecutor
+from upstream import upstream
+from series_output import BINARY_OUTPUTS, irregular_series_response, regular_series_response
+from IMERG.imerg_api import get_polygon_precipitation, get_point_precipitation, get_multi_point_precipitation, \
+    get_point_window_precipitation, get_polygon_window_precipitation
+from IMERG.block_cache import BlockCache
+from IMERG.disk_cache import DiskBlockCache
+from IMERG.dataset import ImergDataset, ImergLayouts, covers, get_tiledb_options
+from IMERG.grid_index import IMERG_GRID
+from IMERG.parallel import ImergScheduler
+from IMERG.time_axis import IMERG_TIME_AXIS, TimeAxis
+from IMERG.raster import encode_npy, field_bounds, period_bands, read_field, read_tile, render_png
+from IMERG.statistics import duration_bands, get_point_statistics, get_polygon_statistics
+from IMERG.climatology import climatology_uri, get_point_climatology, get_polygon_climatology
+from IMERG.rollups import DAILY, HOURLY, ROLLUPS, Rollup, aggregation_reader, period_starts, rollup_uri, unix_list
+from exceptions import DateRangeOutOfBounds, DatasetNotReady
+from MET.met_api import get_nearest_stations_to_point, get_station_within_polygon, \
+    get_processed_station_observations_async, get_processed_station_observations_poly, \
+    get_idf_curve_from_nearest_station, get_idf_from_raster
 
 secrets = dotenv_values('.env')
 
@@ -53,7 +71,34 @@ tags_metadata = [
     },
 ]
 
-app = FastAPI(title="Smart Culvert API", version="0.1.3", openapi_tags=tags_metadata, docs_url="/")
+
+@asynccontextmanager
+async def lifespan(_: FastAPI):
+    """
+    Opens the shared tile databases and refreshes the MET station catalog in the background when a worker starts and
+    closes them when it shuts down.
+    """
+    imerg_datasets.start()
+    for rollup in imerg_rollups.values():
+        rollup.start()
+    if imerg_climatology is not None:
+        imerg_climatology.start()
+    imerg_scheduler.start()
+    blocking_executor.start()
+    station_catalog.start()
+    yield
+    station_catalog.close()
+    upstream.close()
+    blocking_executor.close()
+    imerg_scheduler.close()
+    imerg_datasets.close()
+    for rollup in imerg_rollups.values():
+        rollup.close()
+    if imerg_climatology is not None:
+        imerg_climatology.close()
+
+
+app = FastAPI(title="Smart Culvert API", version="0.1.3", openapi_tags=tags_metadata, docs_url="/", lifespan=lifespan)
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],
@@ -62,11 +107,7 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-options = {'vfs.s3.aws_access_key_id': secrets['AMAZON_S3_AWS_ACCESS_KEY_ID'],
-           'vfs.s3.aws_secret_access_key': secrets['AMAZON_S3_AWS_SECRET_ACCESS_KEY'],
-           'vfs.s3.scheme': 'https',
-           'vfs.s3.region': 'eu-west-1'
-           }
+options = get_tiledb_options(secrets)
 
 context = tiledb.Config(options)
 
@@ -88,19 +129,63 @@ pipelife_users = [{'TCN_CLIENT_ID': secrets['PIPELIFE_PIPELIFE_CLIENT_ID'],
                    'TCN_MYPASS': secrets['PIPELIFE_svv_PASSWORD']}]
 
 """
-Uncomment the following to line if you intend to use the IMERG interface. Keep in mind that it will take a considerable
-amount of time to load these variables.
+Tiles read from the IMERG tile databases are kept in memory, so repeated requests for the same area and period don't
+reach S3. Its size is set with IMERG_CACHE_BYTES (default 1 GiB per worker), 0 disables the memory cache.
+Set IMERG_DISK_CACHE_DIR to a directory on a local SSD to also keep the tiles on disk (IMERG_DISK_CACHE_BYTES, default
+50 GiB), they are still there after a restart. IMERG_PREFETCH_TILES neighbouring time tiles are fetched along with
+every miss.
 """
-# tbarray = tiledb.open(f'', mode="r", config=context)
-# tbarray_dask = da.from_tiledb(f'',
-#                          storage_options=options, attribute='precipitationCal')
+imerg_cache_bytes = int(secrets.get('IMERG_CACHE_BYTES') or 2 ** 30)
+imerg_disk_cache = DiskBlockCache(secrets['IMERG_DISK_CACHE_DIR'],
+                                  int(secrets.get('IMERG_DISK_CACHE_BYTES') or 50 * 2 ** 30)) \
+    if secrets.get('IMERG_DISK_CACHE_DIR') else None
+imerg_cache = BlockCache(imerg_cache_bytes, disk=imerg_disk_cache,
+                         prefetch_tiles=int(secrets.get('IMERG_PREFETCH_TILES') or 0)) \
+    if imerg_cache_bytes or imerg_disk_cache else None
 
 """
-Uncomment the following line if you want to monitoring the Dask calculations though a Dask diagnostics panel.
+The IMERG tile database takes a considerable amount of time to open. It is opened in the background when the app starts
+and shared by every request, see the lifespan above.
+The optional time-series copy (see IMERG/time_series_layout.py) is used for reads it can serve more cheaply.
+"""
+imerg_datasets = ImergLayouts(*[ImergDataset(secrets[uri], context, cache=imerg_cache) for uri in
+                                ('IMERG_TILEDB_URI', 'IMERG_TIME_SERIES_TILEDB_URI') if secrets.get(uri)])
+"""
+The hourly, daily and monthly rollups (see IMERG/rollups.py) answer aggregated requests without reading the half-hourly
+bands. Rollups that don't exist are never ready and the request falls back to the half-hourly layouts.
 """
+imerg_rollups = {rollup.name: ImergDataset(rollup_uri(secrets['IMERG_TILEDB_URI'], rollup), context,
+                                           cache=imerg_cache)
+                 for rollup in ROLLUPS.values()} if secrets.get('IMERG_TILEDB_URI') else {}
 
+"""
+The climatology grids (see IMERG/climatology.py) are computed by a batch job, the climatology endpoints only read them.
+"""
+imerg_climatology = ImergDataset(climatology_uri(secrets['IMERG_TILEDB_URI']), context) \
+    if secrets.get('IMERG_TILEDB_URI') else None
 
-# client = Client("tcp://127.0.0.1:63883")
+"""
+Requests with dask=true read their time range as parallel, tile-aligned chunks on this shared scheduler. Set
+IMERG_DASK_SCHEDULER to the address of a Dask distributed scheduler (e.g. tcp://127.0.0.1:63883) to read on its
+workers instead of a local thread pool of IMERG_DASK_WORKERS threads.
+"""
+imerg_scheduler = ImergScheduler(secrets.get('IMERG_DASK_SCHEDULER') or None,
+                                 int(secrets['IMERG_DASK_WORKERS']) if secrets.get('IMERG_DASK_WORKERS') else None)
+
+"""
+Async endpoints never block the event loop: TileDB reads, geometry work and upstream API calls (on the shared, pooled
+upstream client, see upstream.py) run on this bounded pool of BLOCKING_WORKERS threads (default: number of cores + 4).
+"""
+blocking_executor = BlockingExecutor(int(secrets['BLOCKING_WORKERS']) if secrets.get('BLOCKING_WORKERS') else None)
+
+"""
+Rendered IMERG map tiles (see /IMERG/tile) are kept in IMERG_TILE_CACHE_DIR (IMERG_TILE_CACHE_BYTES, default 5 GiB), so
+map playback is served from disk. Tiles are cached per period and version of the tile databases (see
+read_imerg_tile), so a re-ingested or migrated period is rendered again.
+"""
+imerg_tile_cache = DiskBlockCache(secrets['IMERG_TILE_CACHE_DIR'],
+                                  int(secrets.get('IMERG_TILE_CACHE_BYTES') or 5 * 2 ** 30)) \
+    if secrets.get('IMERG_TILE_CACHE_DIR') else None
 
 
 @app.get('/PostGIS/get_pour_points', tags=['7A PostGIS'])
@@ -115,6 +200,19 @@ def get_pour_point_feature_collection() -> str:
     return gdf.to_json()
 
 
+def met_series_response(output: str, stations: pd.DataFrame, date_range: DateRange) -> Response:
+    """
+    Creates the binary response of the hourly precipitation of MET stations.
+
+    :param output: 'arrow' or 'npy'.
+    :param stations: DataFrame containing the 'id' and the hourly 'precipitation' of every station.
+    :param date_range: The date range of the observations.
+    :return: Response containing the series in the requested format.
+    """
+    return regular_series_response(output, list(stations['id']), np.stack(stations['precipitation'].to_numpy()),
+                                   start=date_range.unix_start, step=3600 * 1000, filename='MET')
+
+
 @app.get("/MET/point/nearest", tags=['MET.NO'])
 def get_nearest_weather_station(point_wkt: str, date_range: str, crs=4326, output: str = 'python') -> MetStation | None:
     """
@@ -147,11 +245,12 @@ async def get_nearest_full_weather_station(point_wkt: str, date_range: str, crs=
                                            output: str = 'python') -> MetStation | str:
     """
     Returns a **list** or **.CSV** containing the hourly precipitation measured by the weather station closed to the
-    input point with complete precipitation data.
+    input point with complete precipitation data. Set output to 'arrow' or 'npy' for a binary float buffer.
     """
     date_range = DateRange(date_range)
-    point = GeoSeries.from_wkt([point_wkt], crs=crs).to_crs(4326)
-    station_precipitation = get_processed_station_observations(point, date_range)
+    point = await blocking_executor.run(lambda: GeoSeries.from_wkt([point_wkt], crs=crs).to_crs(4326))
+    station_precipitation = await get_processed_station_observations_async(point, date_range, upstream,
+                                                                           blocking_executor)
     station_precipitation['geometry_origin'] = point_wkt
     if station_precipitation.empty:
         raise HTTPException(status_code=204,
@@ -171,6 +270,8 @@ async def get_nearest_full_weather_station(point_wkt: str, date_range: str, crs=
         response = StreamingResponse(iter([stream.getvalue()]), media_type="text/csv")
         response.headers["Content-Disposition"] = f"attachment; filename={station_precipitation.name}.csv"
         return response
+    elif output in BINARY_OUTPUTS:
+        return met_series_response(output, station_precipitation, date_range)
     raise HTTPException(status_code=400, detail=f"Export variable: '{output}' not recognized")
 
 
@@ -210,6 +311,7 @@ def get_all_weather_station(polygon_wkt: str, date_range: str, crs=4326, output:
 def get_all_weather_station_precipitation(polygon_wkt: str, date_range: str, crs=4326, output: str = 'python') -> list[MetStation]:
     """
     Returns a list of the hourly precipitation of all weather stations within the input polygon with full precipitation.
+    Set output to 'arrow' or 'npy' for a binary float buffer.
     """
     date_range = DateRange(date_range)
     polygon = GeoSeries.from_wkt([polygon_wkt], crs=crs).to_crs(4326)
@@ -232,9 +334,23 @@ def get_all_weather_station_precipitation(polygon_wkt: str, date_range: str, crs
         response = StreamingResponse(iter([stream.getvalue()]), media_type="text/csv")
         response.headers["Content-Disposition"] = f"attachment; filename={station_precipitation.name}.csv"
         return response
+    elif output in BINARY_OUTPUTS:
+        return met_series_response(output, station_precipitation, date_range)
     raise HTTPException(status_code=400, detail=f"Export variable: '{output}' not recognized")
 
 
+@app.post("/MET/stations/refresh", tags=['MET.NO'])
+async def refresh_station_catalog() -> dict[str, bool | int | str | None]:
+    """
+    Refreshes the local catalog of MET stations from FROST now instead of waiting for the background refresh.
+    """
+    try:
+        changed = await blocking_executor.run(station_catalog.refresh)
+    except Exception as e:
+        raise HTTPException(status_code=502, detail=f"Failed to refresh the MET station catalog: {e}")
+    return {'changed': changed, **station_catalog.summary()}
+
+
 @app.get("/MET/forecast", tags=['MET.NO'])
 def get_forecast_from_shape(shape_wkt: str, crs=4326) -> list[list[list[int | float]]]:
     """
@@ -245,58 +361,197 @@ def get_forecast_from_shape(shape_wkt: str, crs=4326) -> list[list[list[int | fl
     return forecast
 
 
+def get_aggregation(aggregation: str) -> Rollup:
+    """
+    Looks up the rollup the user asked for.
+
+    :param aggregation: Name of the rollup ('hourly', 'daily' or 'monthly').
+    :return: The rollup.
+    """
+    if aggregation not in ROLLUPS:
+        raise HTTPException(status_code=400, detail=f"aggregation has to be one of: {', '.join(ROLLUPS)}")
+    return ROLLUPS[aggregation]
+
+
+def get_timestamps(date_range: DateRange, aggregation: Rollup) -> list[int]:
+    """
+    Returns the unix timestamp of every period of the aggregation within the date range.
+
+    :param date_range: The date range of which the user wants the historic precipitation.
+    :param aggregation: The periods the precipitation gets summed to.
+    :return: List of unix time integers.
+    """
+    return date_range.unix_list if aggregation is HOURLY else unix_list(period_starts(aggregation, date_range))
+
+
+def get_output(output: str, outputs: tuple[str, ...] = ('python',)) -> str:
+    """
+    Checks whether the requested output format is supported by the endpoint. The binary formats are supported by all
+    time series endpoints.
+
+    :param output: The requested output format.
+    :param outputs: The other output formats of the endpoint.
+    :return: The output format.
+    """
+    if output not in (*outputs, *BINARY_OUTPUTS):
+        raise HTTPException(status_code=400, detail=f"Export variable: '{output}' not recognized")
+    return output
+
+
+def imerg_series_response(output: str, ids: list[str | int], values: np.ndarray, date_range: DateRange,
+                          aggregation: Rollup, metadata: dict[str, str] | None = None) -> Response:
+    """
+    Creates the binary response of IMERG series. Hourly and daily series are described by their start and step,
+    monthly series by the start of every month.
+
+    :param output: 'arrow' or 'npy'.
+    :param ids: Id of every series.
+    :param values: Array (series x periods) containing the precipitation.
+    :param date_range: The date range of which the user wants the historic precipitation.
+    :param aggregation: The periods the precipitation got summed to.
+    :param metadata: (optional) Extra metadata added to the Arrow schema, for example the geometry of the series.
+    :return: Response containing the series in the requested format.
+    """
+    steps = {HOURLY.name: 3600 * 1000, DAILY.name: 24 * 3600 * 1000}
+    if aggregation.name in steps:
+        return regular_series_response(output, ids, values, start=date_range.unix_start, step=steps[aggregation.name],
+                                       filename='IMERG', metadata=metadata)
+    return regular_series_response(output, ids, values, timestamps=get_timestamps(date_range, aggregation),
+                                   filename='IMERG', metadata=metadata)
+
+
+def read_imerg(row_slice: slice, col_slice: slice, date_range: DateRange | DateRanges, aggregation: Rollup | None,
+               read: Callable[[tiledb.DenseArray, TimeAxis | Rollup], Any]) -> Any:
+    """
+    Reads IMERG precipitation from the tile database best suited for the cells, date range and aggregation. Blocks on
+    TileDB, so async endpoints run it on the blocking executor.
+
+    :param row_slice: Rows that will be read.
+    :param col_slice: Columns that will be read.
+    :param date_range: The date range, or windows, of which the user wants the historic precipitation.
+    :param aggregation: The periods the user wants the precipitation summed to, None reads the half-hourly bands.
+    :param read: Function reading the precipitation from the lent tile database and its temporal axis.
+    :return: Array containing the precipitation.
+    """
+    try:
+        with aggregation_reader(imerg_datasets, imerg_rollups, aggregation, date_range, row_slice,
+                                col_slice) as (array, source):
+            return read(array, source)
+    except DateRangeOutOfBounds as e:
+        raise HTTPException(status_code=400, detail=e.message)
+    except DatasetNotReady as e:
+        raise HTTPException(status_code=503, detail=e.message)
+
+
+def read_imerg_point(point_wkt: str, crs: int, date_range: DateRange, aggregation: Rollup,
+                     scheduler: ImergScheduler | None) -> np.ndarray:
+    """
+    Reads the precipitation of the cell containing the point. Blocks on TileDB, so the endpoint runs it on the
+    blocking executor.
+
+    :param point_wkt: String representation of the wkt point.
+    :param crs: The CRS the point is in.
+    :param date_range: The date range of which the user wants the historic precipitation.
+    :param aggregation: The periods the precipitation is summed to.
+    :param scheduler: (optional) The scheduler the time range is read on in parallel chunks.
+    :return: Array containing the precipitation of every period.
+    """
+    point = GeoSeries.from_wkt([point_wkt], crs=crs).to_crs(4326)
+    row, col = IMERG_GRID.cell(point.iloc[0].x, point.iloc[0].y)
+    return read_imerg(slice(row, row + 1), slice(col, col + 1), date_range, aggregation,
+                      lambda array, source: get_point_precipitation(array, row, col, date_range, source, aggregation,
+                                                                    scheduler))
+
+
+def read_imerg_polygon(polygon_wkt: str, crs: int, date_range: DateRange, aggregation: Rollup,
+                       scheduler: ImergScheduler | None) -> np.ndarray:
+    """
+    Reads the area-weighted precipitation of the polygon. Blocks on TileDB, so the endpoint runs it on the blocking
+    executor.
+
+    :param polygon_wkt: String representation of the wkt polygon.
+    :param crs: The CRS the polygon is in.
+    :param date_range: The date range of which the user wants the historic precipitation.
+    :param aggregation: The periods the precipitation is summed to.
+    :param scheduler: (optional) The scheduler the time range is read on in parallel chunks.
+    :return: Array containing the precipitation of every period.
+    """
+    polygon = GeoSeries.from_wkt([polygon_wkt], crs=crs).to_crs(4326)
+    return read_imerg(*IMERG_GRID.slices(polygon.total_bounds), date_range, aggregation,
+                      lambda array, source: get_polygon_precipitation(array, polygon, date_range, source, aggregation,
+                                                                      scheduler)[:, 0])
+
+
 @app.get("/IMERG/point/precipitation", tags=['IMERG'])
 async def get_imerg_precipitation_from_point(point_wkt: str, date_range: str, file: bool = False, crs: int = 4326,
-                                             dask: bool = False):
+                                             dask: bool = False, aggregation: str = 'hourly', output: str = 'python'):
     """
-    Access the full historical IMERG precipitation (2000-06-01/2021-09-31). Keep in mind that this dataset is not fully
-    optimized yet. Thus, the more data you request the longer your request will take.
-    (1 day = 1 second~ | 1 year = 130 seconds~)
+    Access the full historical IMERG precipitation (2000-06-01/2021-09-31). Long time series are read from the
+    time-series copy of the dataset when it is available, which keeps multi-year requests down to seconds.
 
     :param point_wkt: String representation of the wkt point you want to get the precipitation from.
     :param date_range: Define the temporal range of the data you want. Format: YYYY-MM-DD/YYYY-MM-DD.
     :param file: (default = False) If true, the output will be a .csv file instead of a list.
     :param crs: (default = 4326) Define the CRS your wkt point is in.
-    :param dask: (default = False) Not implemented yet!
+    :param dask: (default = False) If true, the time range is read as parallel chunks on the shared Dask scheduler.
+    :param aggregation: (default = 'hourly') Sum the precipitation per 'hourly', 'daily' or 'monthly' period.
+    :param output: (default = 'python') 'arrow' or 'npy' return the series as binary float buffer, see series_output.py.
     :return:
     """
     date_range = DateRange(date_range)
-    point = GeoSeries.from_wkt([point_wkt], crs=crs).to_crs(4326)
-    df_with_geometries = pd.concat([point, point.bounds], axis=1)
-    df_with_geometries.rename(columns={df_with_geometries.columns[0]: 'geometry'}, inplace=True)
-    df_with_geometries['sub_geom'] = df_with_geometries.geometry
-    grid_geometries = read_dataframe('IMERG/Grid.fgb', bbox=(
-        df_with_geometries['minx'], df_with_geometries['miny'], df_with_geometries['maxx'], df_with_geometries['maxy']))
-    gdf = geopandas.GeoDataFrame(grid_geometries).drop_duplicates('label')
-    joined_df = gdf.sjoin(geopandas.GeoDataFrame(
-        df_with_geometries.drop(['minx', 'miny', 'maxx', 'maxy'], axis=1),
-        geometry=df_with_geometries.geometry))
-    joined_df["percent_coverage"] = 1
-    max_interval_list = [t for t in
-                         np.arange(date_range.min_date,
-                                   date_range.max_date + np.timedelta64(30, 'm'),
-                                   np.timedelta64(30, "m"))]
-    max_interval_list.index(date_range.min_date), max_interval_list.index(date_range.max_date)
-    date_index = max_interval_list.index(date_range.min_date), max_interval_list.index(date_range.max_date)
-    joined_df = joined_df.iloc[0]
-    index_list = [int(i) for i in joined_df['label'].split(',')]
-    start_time = time.time()
-    if dask:
-        print("dask")
-        result = tbarray_dask[date_index[0]:date_index[1] + 1, index_list[1]:index_list[1] + 1,
-                 index_list[0]:index_list[0] + 1]
-        reshaped = np.nan_to_num(result.reshape(int(len(result))).compute(), nan=-1)
+    aggregation = get_aggregation(aggregation)
+    output = get_output(output)
+    results = await blocking_executor.run(read_imerg_point, point_wkt, crs, date_range, aggregation,
+                                          imerg_scheduler if dask else None)
+    if output in BINARY_OUTPUTS:
+        return imerg_series_response(output, ['point'], results, date_range, aggregation,
+                                     metadata={'geometry': point_wkt, 'crs': str(crs)})
+    if file:
+        data = pd.DataFrame(
+            {'timestamp': get_timestamps(date_range, aggregation),
+             'precipitation': results,
+             })
+        stream = io.StringIO()
+        data.to_csv(stream, index=False)
+        response = StreamingResponse(iter([stream.getvalue()]),
+                                     media_type="text/csv"
+                                     )
+        response.headers["Content-Disposition"] = f"attachment; filename={'IMERG'}.csv"
+        return response
+
     else:
-        print("numpy")
-        result = np.array(tbarray[date_index[0]:date_index[1] + 1, index_list[1]:index_list[1] + 1,
-                          index_list[0]:index_list[0] + 1]['precipitationCal'])
-        reshaped = np.nan_to_num(result.reshape(int(result.size)), nan=-1)
+        return results.tolist()
+
+
+@app.get("/IMERG/polygon/precipitation", tags=['IMERG'])
+async def get_imerg_precipitation_from_polygon(polygon_wkt: str, date_range: str, file: bool = False,
+                                               crs: int = 4326, aggregation: str = 'hourly', dask: bool = False,
+                                               output: str = 'python'):
+    """
+    Returns the area-weighted hourly IMERG precipitation of the input polygon (2000-06-01/2021-09-31). The cells
+    within the bounds of the polygon are read in one go and weighted by the fraction of the polygon that lies within
+    each cell.
 
-    results = [np.sum(i) for i in reshaped.reshape(int(len(reshaped) / 2), 2).round(5)]
-    print('Full calculation took: ', time.time() - start_time, ' seconds.')
+    :param polygon_wkt: String representation of the wkt polygon you want to get the precipitation from.
+    :param date_range: Define the temporal range of the data you want. Format: YYYY-MM-DD/YYYY-MM-DD.
+    :param file: (default = False) If true, the output will be a .csv file instead of a list.
+    :param crs: (default = 4326) Define the CRS your wkt polygon is in.
+    :param aggregation: (default = 'hourly') Sum the precipitation per 'hourly', 'daily' or 'monthly' period.
+    :param dask: (default = False) If true, the time range is read as parallel chunks on the shared Dask scheduler.
+    :param output: (default = 'python') 'arrow' or 'npy' return the series as binary float buffer, see series_output.py.
+    :return:
+    """
+    date_range = DateRange(date_range)
+    aggregation = get_aggregation(aggregation)
+    output = get_output(output)
+    results = await blocking_executor.run(read_imerg_polygon, polygon_wkt, crs, date_range, aggregation,
+                                          imerg_scheduler if dask else None)
+    if output in BINARY_OUTPUTS:
+        return imerg_series_response(output, ['polygon'], results, date_range, aggregation,
+                                     metadata={'geometry': polygon_wkt, 'crs': str(crs)})
     if file:
         data = pd.DataFrame(
-            {'timestamp': date_range.unix_list,
+            {'timestamp': get_timestamps(date_range, aggregation),
              'precipitation': results,
              })
         stream = io.StringIO()
@@ -308,33 +563,450 @@ async def get_imerg_precipitation_from_point(point_wkt: str, date_range: str, fi
         return response
 
     else:
-        return results
+        return results.tolist()
 
 
-@app.get("/IMERG/polygon/precipitation", tags=['IMERG'])
-def get_imerg_precipitation_from_polygon(polygon_wkt: str, date_range: str, crs=4326) -> list[dict]:
+def read_imerg_points(points: ImergPoints, date_range: DateRange,
+                      aggregation: Rollup) -> tuple[list[str | int], np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Reads the precipitation of the cells containing the points in one query over their bounds. Blocks on TileDB, so
+    the endpoint runs it on the blocking executor.
+
+    :param points: The points, as feature collection or list of wkt points, and their CRS.
+    :param date_range: The date range of which the user wants the historic precipitation.
+    :param aggregation: The periods the precipitation is summed to.
+    :return: tuple containing the ids of the points (the 'id' of the features or their positions), the rows and
+    columns of their cells and the precipitation (points x periods).
+    """
+    if points.feature_collection:
+        features = geopandas.GeoDataFrame.from_features(points.feature_collection, crs=points.crs).to_crs(4326)
+        ids = list(features['id']) if 'id' in features else list(range(len(features)))
+        geometries = features.geometry
+    elif points.wkt:
+        ids = list(range(len(points.wkt)))
+        geometries = GeoSeries.from_wkt(points.wkt, crs=points.crs).to_crs(4326)
+    else:
+        raise HTTPException(status_code=400, detail="Provide either a feature_collection or a list of wkt points")
+    if not (geometries.geom_type == 'Point').all():
+        raise HTTPException(status_code=400, detail="Only point geometries are supported")
+    if len({str(point_id) for point_id in ids}) != len(ids):
+        raise HTTPException(status_code=400, detail="The ids of the features have to be unique")
+
+    rows, cols = IMERG_GRID.cell(geometries.x.to_numpy(), geometries.y.to_numpy())
+    results = read_imerg(slice(int(rows.min()), int(rows.max()) + 1), slice(int(cols.min()), int(cols.max()) + 1),
+                         date_range, aggregation,
+                         lambda array, source: get_multi_point_precipitation(array, rows, cols, date_range, source,
+                                                                             aggregation))
+    return ids, rows, cols, results
+
+
+@app.post("/IMERG/points/precipitation", tags=['IMERG'])
+async def get_imerg_precipitation_from_points(points: ImergPoints) -> ImergPointsResults:
+    """
+    Returns the IMERG precipitation of many points at once, summed per **aggregation** period (hourly, daily or
+    monthly). Send either a GeoJSON **feature_collection** of points or a list of **wkt** points. Points that fall in
+    the same cell are read once and every cell is read in a single query. The result is columnar: one row of
+    precipitation per point, in the order they were sent. Set **output** to 'arrow' or 'npy' to receive the rows as a
+    binary float buffer instead (see series_output.py).
+    """
+    date_range = DateRange(points.date_range)
+    aggregation = get_aggregation(points.aggregation)
+    output = get_output(points.output)
+    ids, rows, cols, results = await blocking_executor.run(read_imerg_points, points, date_range, aggregation)
+    if output in BINARY_OUTPUTS:
+        return imerg_series_response(output, ids, results, date_range, aggregation)
+    return ImergPointsResults(ids=ids, cells=np.stack([rows, cols], axis=1).tolist(),
+                              timestamp=get_timestamps(date_range, aggregation), precipitation=results.tolist())
+
+
+def get_date_ranges(date_ranges: str | None, years: str | None, months: str | None) -> DateRanges:
     """
-    (_Not implemented yet!_)
+    Parses the windows of the multi-window endpoints, given as a list of date ranges or as a season across years.
 
-    :param crs: /
-    :param polygon_wkt: /
-    :param date_range: /
-    :return: /
+    :param date_ranges: Comma separated date ranges (YYYY-MM-DD/YYYY-MM-DD,...).
+    :param years: First and last year (YYYY-YYYY) of the season.
+    :param months: Comma separated, consecutive months (1 - 12) of the season.
+    :return: The windows.
+    """
+    try:
+        if date_ranges and not (years or months):
+            return DateRanges.from_string(date_ranges)
+        if years and months and not date_ranges:
+            return DateRanges.seasonal(years, months)
+    except (ValueError, IndexError) as e:
+        raise HTTPException(status_code=400, detail=f"Windows not recognized ({e})")
+    raise HTTPException(status_code=400, detail="Provide either date_ranges or both years and months")
+
+
+def read_imerg_windows(geometry_wkt: str, crs: int, date_ranges: DateRanges,
+                       aggregation: Rollup) -> list[np.ndarray]:
+    """
+    Reads the precipitation of every window for the cell containing a point, or area-weighted for a polygon. Blocks
+    on TileDB, so the endpoints run it on the blocking executor.
+
+    :param geometry_wkt: String representation of the wkt point or polygon.
+    :param crs: The CRS the geometry is in.
+    :param date_ranges: The windows of which the user wants the historic precipitation.
+    :param aggregation: The periods the precipitation is summed to.
+    :return: List containing an array with the precipitation of every period for every window.
+    """
+    geometry = GeoSeries.from_wkt([geometry_wkt], crs=crs).to_crs(4326)
+    if geometry.geom_type.iloc[0] == 'Point':
+        row, col = IMERG_GRID.cell(geometry.iloc[0].x, geometry.iloc[0].y)
+        return read_imerg(slice(row, row + 1), slice(col, col + 1), date_ranges, aggregation,
+                          lambda array, source: get_point_window_precipitation(array, row, col, date_ranges, source,
+                                                                               aggregation))
+    return read_imerg(*IMERG_GRID.slices(geometry.total_bounds), date_ranges, aggregation,
+                      lambda array, source: [result[:, 0] for result in get_polygon_window_precipitation(
+                          array, geometry, date_ranges, source, aggregation)])
+
+
+def imerg_windows_response(date_ranges: DateRanges, aggregation: Rollup, results: list[np.ndarray],
+                           file: bool) -> list[dict[str, Any]] | Response:
+    """
+    Creates the response of the multi-window endpoints: one series per window, or a .csv with a window column.
+
+    :param date_ranges: The windows of which the user wants the historic precipitation.
+    :param aggregation: The periods the precipitation got summed to.
+    :param results: List containing the precipitation of every window.
+    :param file: If true, the output will be a .csv file instead of a list.
+    :return: List containing the date range, timestamps and precipitation of every window, or the .csv file.
+    """
+    windows = [{'date_range': f"{window.min_date_str}/{window.max_date_str}",
+                'timestamp': get_timestamps(window, aggregation), 'precipitation': result.tolist()}
+               for window, result in zip(date_ranges, results)]
+    if not file:
+        return windows
+    data = pd.DataFrame({'window': [window['date_range'] for window in windows for _ in window['timestamp']],
+                         'timestamp': list(itertools.chain.from_iterable(window['timestamp'] for window in windows)),
+                         'precipitation': np.concatenate(results)})
+    stream = io.StringIO()
+    data.to_csv(stream, index=False)
+    response = StreamingResponse(iter([stream.getvalue()]), media_type="text/csv")
+    response.headers["Content-Disposition"] = f"attachment; filename={'IMERG'}.csv"
+    return response
+
+
+@app.get("/IMERG/point/windows", tags=['IMERG'])
+async def get_imerg_windows_from_point(point_wkt: str, date_ranges: str | None = None, years: str | None = None,
+                                       months: str | None = None, file: bool = False, crs: int = 4326,
+                                       aggregation: str = 'hourly') -> list[dict[str, Any]]:
+    """
+    Returns the IMERG precipitation of the input point for several windows in one request, for example every July
+    from 2001 to 2021. Give the windows as a list of **date_ranges** (YYYY-MM-DD/YYYY-MM-DD,YYYY-MM-DD/YYYY-MM-DD) or
+    as a season: **years** (YYYY-YYYY) with consecutive **months** ('7', or '12,1,2' for winters that start in
+    December). All windows are read with a single multi-range query. Returns one series per window, summed per
+    **aggregation** period ('hourly', 'daily' or 'monthly').
+    """
+    date_ranges = get_date_ranges(date_ranges, years, months)
+    aggregation = get_aggregation(aggregation)
+    results = await blocking_executor.run(read_imerg_windows, point_wkt, crs, date_ranges, aggregation)
+    return imerg_windows_response(date_ranges, aggregation, results, file)
+
+
+@app.get("/IMERG/polygon/windows", tags=['IMERG'])
+async def get_imerg_windows_from_polygon(polygon_wkt: str, date_ranges: str | None = None, years: str | None = None,
+                                         months: str | None = None, file: bool = False, crs: int = 4326,
+                                         aggregation: str = 'hourly') -> list[dict[str, Any]]:
+    """
+    Returns the area-weighted IMERG precipitation of the input polygon for several windows in one request, see
+    /IMERG/point/windows.
+    """
+    date_ranges = get_date_ranges(date_ranges, years, months)
+    aggregation = get_aggregation(aggregation)
+    results = await blocking_executor.run(read_imerg_windows, polygon_wkt, crs, date_ranges, aggregation)
+    return imerg_windows_response(date_ranges, aggregation, results, file)
+
+
+def get_durations(durations: str) -> list[float]:
+    """
+    Parses the comma separated window durations (hours) of the statistics endpoints.
+
+    :param durations: String containing the durations, for example '0.5,1,3,24'.
+    :return: List containing the durations.
+    """
+    try:
+        parsed = [float(duration) for duration in durations.split(',')]
+        duration_bands(parsed)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=f"Invalid durations '{durations}': {e}")
+    return parsed
+
+
+def read_imerg_statistics(geometry_wkt: str, crs: int, date_range: DateRange, durations: list[float],
+                          threshold: float | None) -> dict[str, Any]:
+    """
+    Computes the rolling-window statistics of the cell containing a point, or the area-weighted statistics of a
+    polygon, from the half-hourly tile database. Blocks on TileDB, so the endpoints run it on the blocking executor.
+
+    :param geometry_wkt: String representation of the wkt point or polygon.
+    :param crs: The CRS the geometry is in.
+    :param date_range: The date range the statistics are computed over.
+    :param durations: Durations of the rolling windows in hours.
+    :param threshold: (optional) Rolling sums above this value are counted as exceedances.
+    :return: Dictionary containing the statistics of the geometry.
+    """
+    geometry = GeoSeries.from_wkt([geometry_wkt], crs=crs).to_crs(4326)
+    if geometry.geom_type.iloc[0] == 'Point':
+        row, col = IMERG_GRID.cell(geometry.iloc[0].x, geometry.iloc[0].y)
+        return read_imerg(slice(row, row + 1), slice(col, col + 1), date_range, None,
+                          lambda array, source: get_point_statistics(array, row, col, date_range, durations, threshold))
+    return read_imerg(*IMERG_GRID.slices(geometry.total_bounds), date_range, None,
+                      lambda array, source: get_polygon_statistics(array, geometry, date_range, durations, threshold))
+
+
+@app.get("/IMERG/point/statistics", tags=['IMERG'])
+async def get_imerg_statistics_from_point(point_wkt: str, date_range: str, crs: int = 4326,
+                                          durations: str = '0.5,1,3,6,12,24',
+                                          threshold: float | None = None) -> dict[str, Any]:
+    """
+    Computes precipitation statistics of the input point inside the service instead of returning the half-hourly
+    series. For every rolling window **duration** (hours, multiples of 0.5) it returns the maximum rolling sum, per
+    year and over the whole date range, and with a **threshold** the number of windows whose sum exceeds it. Windows
+    containing a missing half-hour are left out. Every value is a list with one entry (the point).
     """
     date_range = DateRange(date_range)
-    polygon = GeoSeries.from_wkt([polygon_wkt], crs=crs).to_crs(4326)
-    return [{'Warning': 'Not implemented yet!'}]
+    return await blocking_executor.run(read_imerg_statistics, point_wkt, crs, date_range, get_durations(durations),
+                                       threshold)
+
+
+@app.get("/IMERG/polygon/statistics", tags=['IMERG'])
+async def get_imerg_statistics_from_polygon(polygon_wkt: str, date_range: str, crs: int = 4326,
+                                            durations: str = '0.5,1,3,6,12,24',
+                                            threshold: float | None = None) -> dict[str, Any]:
+    """
+    Computes precipitation statistics of the area-weighted precipitation of the input polygon, see
+    /IMERG/point/statistics.
+    """
+    date_range = DateRange(date_range)
+    return await blocking_executor.run(read_imerg_statistics, polygon_wkt, crs, date_range, get_durations(durations),
+                                       threshold)
+
+
+def read_imerg_climatology(geometry_wkt: str, crs: int) -> dict[str, Any]:
+    """
+    Reads the climatology of the cell containing a point, or the area-weighted climatology of a polygon, from the
+    precomputed grids. Blocks on TileDB, so the endpoints run it on the blocking executor.
+
+    :param geometry_wkt: String representation of the wkt point or polygon.
+    :param crs: The CRS the geometry is in.
+    :return: Dictionary containing the statistics and return levels of every duration.
+    """
+    geometry = GeoSeries.from_wkt([geometry_wkt], crs=crs).to_crs(4326)
+    if imerg_climatology is None:
+        raise HTTPException(status_code=503, detail="No IMERG tile database is configured")
+    if imerg_climatology.is_missing:
+        raise HTTPException(status_code=404, detail="The IMERG climatology hasn't been computed yet, see "
+                                                    "IMERG/climatology.py")
+    if geometry.geom_type.iloc[0] == 'Point':
+        row, col = IMERG_GRID.cell(geometry.iloc[0].x, geometry.iloc[0].y)
+        row_slice, col_slice = slice(row, row + 1), slice(col, col + 1)
+    else:
+        row_slice, col_slice = IMERG_GRID.slices(geometry.total_bounds)
+    try:
+        with imerg_climatology.reader() as array:
+            if not covers(array, (slice(0, 1), row_slice, col_slice)):
+                raise HTTPException(status_code=400, detail="The geometry lies outside the area of the climatology")
+            if geometry.geom_type.iloc[0] == 'Point':
+                return get_point_climatology(array, row, col)
+            return get_polygon_climatology(array, geometry)
+    except DatasetNotReady as e:
+        raise HTTPException(status_code=503, detail=e.message)
+
+
+@app.get("/IMERG/point/climatology", tags=['IMERG'])
+async def get_imerg_climatology_from_point(point_wkt: str, crs: int = 4326) -> dict[str, Any]:
+    """
+    Returns the precomputed precipitation climatology of the cell containing the input point: for every rolling window
+    duration (hours) the maximum, the mean and standard deviation of the annual maxima, the number of complete years
+    they were taken from, and the Gumbel **return_levels** per return period (years). Every value is a list with one
+    entry (the point), -1 where it couldn't be computed. The grids are computed by IMERG/climatology.py.
+    """
+    return await blocking_executor.run(read_imerg_climatology, point_wkt, crs)
+
+
+@app.get("/IMERG/polygon/climatology", tags=['IMERG'])
+async def get_imerg_climatology_from_polygon(polygon_wkt: str, crs: int = 4326) -> dict[str, Any]:
+    """
+    Returns the area-weighted mean of the precomputed climatology grids within the input polygon, see
+    /IMERG/point/climatology.
+    """
+    return await blocking_executor.run(read_imerg_climatology, polygon_wkt, crs)
+
+
+RASTER_OUTPUTS = {'png': 'image/png', 'npy': BINARY_OUTPUTS['npy']}
+
+
+def get_period(timestamp: str, aggregation: str) -> tuple[datetime64, Rollup | None, int]:
+    """
+    Parses the timestamp and aggregation of the raster endpoints.
+
+    :param timestamp: Timestamp (YYYY-MM-DDTHH:MM) within the period.
+    :param aggregation: 'half-hourly' or one of the rollups.
+    :return: tuple containing the timestamp, the rollup of the period (None for half-hourly) and the number of
+    half-hours in the period.
+    """
+    rollup = None if aggregation == 'half-hourly' else get_aggregation(aggregation)
+    try:
+        parsed = datetime64(timestamp, 'm')
+        bands = period_bands(parsed, rollup)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=f"Timestamp '{timestamp}' not recognized ({e})")
+    except DateRangeOutOfBounds as e:
+        raise HTTPException(status_code=400, detail=e.message)
+    return parsed, rollup, bands.stop - bands.start
+
+
+def raster_response(content: bytes, output: str, headers: dict[str, str], filename: str) -> Response:
+    """
+    Creates the response of a rendered raster. Rasters of past periods don't change, so clients may cache them.
+
+    :param content: Bytes of the PNG or .npy file.
+    :param output: The raster output, 'png' or 'npy'.
+    :param headers: Headers describing the raster, for example its bounds.
+    :param filename: Name of the file without extension.
+    :return: Response containing the raster.
+    """
+    return Response(content=content, media_type=RASTER_OUTPUTS[output],
+                    headers={**headers, 'Cache-Control': 'public, max-age=86400',
+                             'Content-Disposition': f"inline; filename={filename}.{output}"})
+
+
+def read_raster(read: Callable[[], tuple[np.ndarray, int]], output: str) -> bytes:
+    """
+    Reads a precipitation field and encodes it. Blocks on TileDB, so the endpoints run it on the blocking executor.
+
+    :param read: Function returning the summed precipitation field and the number of half-hours summed into it.
+    :param output: The raster output, 'png' or 'npy'.
+    :return: Bytes of the PNG or .npy file.
+    """
+    try:
+        field, n_bands = read()
+    except DateRangeOutOfBounds as e:
+        raise HTTPException(status_code=400, detail=e.message)
+    except DatasetNotReady as e:
+        raise HTTPException(status_code=503, detail=e.message)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return render_png(field, n_bands) if output == 'png' else encode_npy(field)
+
+
+def read_imerg_tile(timestamp: datetime64, aggregation: Rollup | None, z: int, x: int, y: int, output: str) -> bytes:
+    """
+    Renders a map tile, or takes it from the tile cache. Tiles are cached per period, every timestamp within it shares
+    the tile, and per version of the tile databases the period is read from, so a re-ingest renders it again. Tiles
+    are only cached when the availability of the tile database is known, so tiles of periods that are still being
+    ingested are rendered again.
+
+    :param timestamp: Timestamp within the period.
+    :param aggregation: The rollup the period belongs to, None for a single half-hour.
+    :param z: Zoom level of the tile.
+    :param x: Column of the tile.
+    :param y: Row of the tile, counted from the north.
+    :param output: The raster output, 'png' or 'npy'.
+    :return: Bytes of the PNG or .npy file.
+    """
+    bands = period_bands(timestamp, aggregation)
+    rollup = imerg_rollups.get(aggregation.name) if aggregation is not None else None
+    period = aggregation.index(timestamp) if aggregation is not None else None
+    version = (imerg_datasets.version(bands), rollup.version(slice(period, period + 1)) if rollup else None)
+    key = ('IMERG tile', str(aggregation or 'half-hourly'), bands.start, bands.stop, version, z, x, y, output)
+    cached = imerg_tile_cache.get(key) if imerg_tile_cache is not None else None
+    if cached is not None:
+        return cached.tobytes()
+    content = read_raster(lambda: read_tile(imerg_datasets, imerg_rollups, timestamp, aggregation, z, x, y), output)
+    # Without an availability the period may still be ingested, so the tile could change.
+    if imerg_tile_cache is not None and imerg_datasets.availability is not None:
+        imerg_tile_cache.put(key, np.frombuffer(content, dtype=np.uint8))
+    return content
+
+
+@app.get("/IMERG/tile/{z}/{x}/{y}", tags=['IMERG'])
+async def get_imerg_tile(z: int, x: int, y: int, timestamp: str, aggregation: str = 'half-hourly',
+                         output: str = 'png') -> Response:
+    """
+    Returns the IMERG precipitation of one period as a 256x256 web mercator (XYZ) map tile, for map playback. The
+    period is the half-hour starting at **timestamp** (YYYY-MM-DDTHH:MM) or, with **aggregation** 'hourly', 'daily' or
+    'monthly', the period containing it. Output 'png' is coloured by mean intensity (mm/h) with dry cells transparent,
+    'npy' holds the summed precipitation as float32 (NaN where missing). Rendered tiles are kept in a disk cache.
+    """
+    if output not in RASTER_OUTPUTS:
+        raise HTTPException(status_code=400, detail=f"Export variable: '{output}' not recognized")
+    if not (0 <= z <= 12 and 0 <= x < 2 ** z and 0 <= y < 2 ** z):
+        raise HTTPException(status_code=400, detail=f"Tile {z}/{x}/{y} doesn't exist (zoom levels 0 - 12)")
+    timestamp, aggregation, n_bands = get_period(timestamp, aggregation)
+    content = await blocking_executor.run(read_imerg_tile, timestamp, aggregation, z, x, y, output)
+    return raster_response(content, output, {'X-Half-Hours': str(n_bands)}, f"IMERG_{z}_{x}_{y}")
+
+
+@app.get("/IMERG/snapshot", tags=['IMERG'])
+async def get_imerg_snapshot(bbox: str, timestamp: str, aggregation: str = 'half-hourly',
+                             output: str = 'png') -> Response:
+    """
+    Returns the IMERG precipitation field of one period within **bbox** (minx,miny,maxx,maxy in EPSG:4326) on the
+    IMERG grid, north up, read with a single query. See /IMERG/tile for the period and outputs. The X-Bounds header
+    holds the outer edges of the returned cells.
+    """
+    if output not in RASTER_OUTPUTS:
+        raise HTTPException(status_code=400, detail=f"Export variable: '{output}' not recognized")
+    try:
+        bounds = [float(value) for value in bbox.split(',')]
+    except ValueError:
+        bounds = []
+    if len(bounds) != 4 or bounds[0] >= bounds[2] or bounds[1] >= bounds[3]:
+        raise HTTPException(status_code=400, detail=f"bbox '{bbox}' not recognized, use minx,miny,maxx,maxy")
+    timestamp, aggregation, n_bands = get_period(timestamp, aggregation)
+    row_slice, col_slice = IMERG_GRID.slices(bounds)
+    content = await blocking_executor.run(
+        read_raster, lambda: read_field(imerg_datasets, imerg_rollups, timestamp, aggregation, row_slice, col_slice),
+        output)
+    bounds = ','.join(str(edge) for edge in field_bounds(row_slice, col_slice))
+    return raster_response(content, output, {'X-Half-Hours': str(n_bands), 'X-Bounds': bounds}, 'IMERG')
+
+
+@app.get("/IMERG/availability", tags=['IMERG'])
+def get_imerg_availability(date_range: str | None = None) -> dict[str, Any]:
+    """
+    Returns the first and last available IMERG timestamp, the number of available half-hourly bands and the missing
+    periods (first and last missing timestamp). With a **date_range**, only the missing periods within that range are
+    listed.
+    """
+    availability = imerg_datasets.availability
+    if availability is None:
+        raise HTTPException(status_code=503, detail="No IMERG availability has been recorded (yet)")
+    try:
+        return availability.coverage(IMERG_TIME_AXIS.slice(DateRange(date_range)) if date_range else None)
+    except DateRangeOutOfBounds as e:
+        raise HTTPException(status_code=400, detail=e.message)
+
+
+@app.get("/IMERG/cache", tags=['IMERG'])
+def get_imerg_cache_stats() -> dict[str, int | float]:
+    """
+    Returns the size and the hit, miss, eviction and bypass counters of the IMERG block cache (and its disk cache) of
+    this worker.
+    """
+    if imerg_cache is None:
+        raise HTTPException(status_code=404, detail="The IMERG block cache is disabled")
+    return imerg_cache.stats()
 
 
 @app.get("/NVE/point/flow", tags=['NVE'])
-def get_closest_culvert_data(point_wkt: str, date_range: str, crs=4326) -> Response:
+def get_closest_culvert_data(point_wkt: str, date_range: str, crs=4326, output: str = 'json') -> Response:
     """
     Returns hourly water level and/or water flow (depending on what is available) of the closest culvert to the input
-    point.
+    point. Set output to 'arrow' or 'npy' for a binary buffer with one series per parameter.
     """
     date_range = DateRange(date_range)
+    output = get_output(output, ('json',))
     pointer = geopandas.GeoDataFrame(geometry=[shapely.wkt.loads(point_wkt)], crs=crs).to_crs(4326)
     df = get_nearest_station_obesrvation(pointer, date_range)
+    if output in BINARY_OUTPUTS:
+        series = [(f"{row['stationId']}:{row['parameter']}",
+                   pd.to_datetime([o['time'] for o in row['observations']]).asi8 // 10 ** 6,
+                   [np.nan if o['value'] is None else o['value'] for o in row['observations']])
+                  for _, row in df.iterrows()]
+        return irregular_series_response(output, series, filename='NVE')
     return Response(content=df.to_json(), media_type="application/json")
 
 
@@ -412,12 +1084,29 @@ def get_idf_from_point(point_wkt: str, crs: int = 4326) -> Response:
     return Response(content=idf, media_type="application/json")
 
 
+def pipelife_series_response(output: str, pipes_data: list[list[CulvertResults]]) -> Response:
+    """
+    Creates the binary response of the water level series of PipeLife culverts. The PipeLife API logs in unix
+    seconds, the series are returned in milliseconds like every other endpoint.
+
+    :param output: 'arrow' or 'npy'.
+    :param pipes_data: List containing the water level series of every culvert.
+    :return: Response containing the series in the requested format.
+    """
+    series = [(result.id, np.asarray(result.timestamp, dtype=np.int64) * 1000, result.values)
+              for culvert_results in pipes_data for result in culvert_results]
+    return irregular_series_response(output, series, filename='PipeLife')
+
+
 @app.get("/PipeLife/id/waterlevel", tags=['PipeLife'])
-def get_water_level_from_id(pipelife_ids: str, date_range: str, pipelife_user: str | None = None) -> list[list[CulvertResults]] | list[Any]:  # , verify:bool = True
+def get_water_level_from_id(pipelife_ids: str, date_range: str, pipelife_user: str | None = None,
+                            output: str = 'python') -> list[list[CulvertResults]] | list[Any]:  # , verify:bool = True
     """
-    Returns a list containing hourly water level data of the input culvert.
+    Returns a list containing hourly water level data of the input culvert. Set output to 'arrow' or 'npy' for a
+    binary buffer with one series per water level sensor.
     """
     date_range = DateRange(date_range)
+    output = get_output(output)
     if pipelife_user:
         user = [i for i in pipelife_users if i['TCN_MYUSER'] == pipelife_user]
         if not user:
@@ -434,6 +1123,8 @@ def get_water_level_from_id(pipelife_ids: str, date_range: str, pipelife_user: s
         all_pipes_data = [culvert.get_hourly_data(date_range) for culvert in selected_culverts]
         if not all_pipes_data:
             raise HTTPException(status_code=400, detail=f'No Data found for date and culvert combination.')
+        if output in BINARY_OUTPUTS:
+            return pipelife_series_response(output, all_pipes_data)
         return all_pipes_data
     else:
         pipelife_users_list = [PipeLifeUser(client_id=user['TCN_CLIENT_ID'], client_secret=user['TCN_CLIENT_SECRET'],
@@ -442,6 +1133,8 @@ def get_water_level_from_id(pipelife_ids: str, date_range: str, pipelife_user: s
         selected_culverts = list(itertools.chain(
             *[x.get_culverts_from_id_list(pipelife_ids.split(',')) for x in pipelife_users_list]))
         all_pipes_data = [culvert.get_hourly_data(date_range) for culvert in selected_culverts]
+        if output in BINARY_OUTPUTS:
+            return pipelife_series_response(output, all_pipes_data)
         return all_pipes_data
 
 
@@ -0,0 +1,124 @@
+"""
+series_output.py: Contains the binary (Arrow IPC and NumPy) output formats of the time series endpoints.
+
+JSON sends every value as text and repeats the timestamp of every value. The binary formats send the values as one
+contiguous float64 buffer per series and describe a regular time axis with its start and step, so Python (pyarrow,
+numpy) and JavaScript (apache-arrow) clients can load a multi-year series without parsing it.
+
+Regular series (IMERG, MET) share one time axis:
+- arrow: a table with one float64 column per series, named after its id. The schema metadata holds 'start' and 'step'
+  (unix time in milliseconds) or, for irregular axes, the table has an int64 'timestamp' column. Extra metadata (for
+  example the geometry the series belongs to) is only added to the schema, never to the headers, so it can't grow
+  the headers beyond what proxies accept.
+- npy: a (series x time) float64 array. The headers X-Series-Ids, X-Start and X-Step (or X-Timestamps) describe it.
+Series ids are short and have to be unique, duplicates are answered with 400 because they would share a column (or
+become indistinguishable in the headers).
+
+Irregular series (NVE, PipeLife) each have their own timestamps:
+- arrow: a long table with the columns 'id' (dictionary encoded), 'timestamp' (int64, unix ms) and 'value' (float64).
+- npy: a structured array with the fields 'series' (index into X-Series-Ids), 'timestamp' and 'value'.
+"""
+
+__author__ = "Tim Rietdijk"
+__email__ = "tim.is@live.nl"
+__status__ = "Development"
+
+# standard imports:
+import io
+import json
+
+# third-party imports:
+import numpy as np
+import pyarrow as pa
+from fastapi import HTTPException
+from starlette.responses import Response
+
+BINARY_OUTPUTS = {'arrow': 'application/vnd.apache.arrow.stream', 'npy': 'application/x-npy'}
+
+
+def _arrow_response(table: pa.Table, filename: str) -> Response:
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_stream(sink, table.schema) as writer:
+        writer.write_table(table)
+    return Response(content=sink.getvalue().to_pybytes(), media_type=BINARY_OUTPUTS['arrow'],
+                    headers={'Content-Disposition': f"attachment; filename={filename}.arrow"})
+
+
+def _unique_ids(ids: list[str | int]) -> list[str]:
+    """
+    Returns the ids of the series as strings, rejecting duplicates.
+
+    :param ids: Ids of the series.
+    :return: List containing the ids as strings.
+    """
+    names = [str(series_id) for series_id in ids]
+    if len(set(names)) != len(names):
+        raise HTTPException(status_code=400, detail=f"The series ids have to be unique, found duplicates of: "
+                                                    f"{sorted({name for name in names if names.count(name) > 1})}")
+    return names
+
+
+def _npy_response(values: np.ndarray, filename: str, headers: dict[str, str]) -> Response:
+    stream = io.BytesIO()
+    np.save(stream, values, allow_pickle=False)
+    return Response(content=stream.getvalue(), media_type=BINARY_OUTPUTS['npy'],
+                    headers={**headers, 'Content-Disposition': f"attachment; filename={filename}.npy"})
+
+
+def regular_series_response(output: str, ids: list[str | int], values: np.ndarray | list, start: int | None = None,
+                            step: int | None = None, timestamps: list[int] | None = None,
+                            filename: str = 'series', metadata: dict[str, str] | None = None) -> Response:
+    """
+    Creates a binary response for series that share one time axis. The axis is described by its start and step, or
+    by its timestamps when the periods aren't evenly spaced (for example months).
+
+    :param output: 'arrow' or 'npy'.
+    :param ids: Id of every series.
+    :param values: Array (series x time) containing the values.
+    :param start: Unix time (ms) of the first value.
+    :param step: Milliseconds between two values.
+    :param timestamps: Unix time (ms) of every value, used when there is no start and step.
+    :param filename: Name of the downloaded file without extension.
+    :param metadata: (optional) Extra metadata added to the Arrow schema, left out of the npy headers.
+    :return: Response containing the series in the requested format.
+    """
+    names = _unique_ids(ids)
+    values = np.ascontiguousarray(values, dtype=np.float64).reshape(len(ids), -1)
+    if output == 'arrow':
+        columns = dict(zip(names, values))
+        schema_metadata = dict(metadata or {})
+        if start is not None:
+            schema_metadata.update({'start': str(start), 'step': str(step)})
+        else:
+            columns = {'timestamp': np.asarray(timestamps, dtype=np.int64), **columns}
+        return _arrow_response(pa.table(columns, metadata=schema_metadata), filename)
+    headers = {'X-Series-Ids': json.dumps(names)}
+    if start is not None:
+        headers.update({'X-Start': str(start), 'X-Step': str(step)})
+    else:
+        headers['X-Timestamps'] = json.dumps(list(timestamps))
+    return _npy_response(values, filename, headers)
+
+
+def irregular_series_response(output: str, series: list[tuple[str | int, np.ndarray | list, np.ndarray | list]],
+                              filename: str = 'series') -> Response:
+    """
+    Creates a binary response for series that each have their own timestamps, in long format.
+
+    :param output: 'arrow' or 'npy'.
+    :param series: List containing the id, the timestamps (unix ms) and the values of every series.
+    :param filename: Name of the downloaded file without extension.
+    :return: Response containing the series in the requested format.
+    """
+    ids = _unique_ids([series_id for series_id, _, _ in series])
+    lengths = [len(values) for _, _, values in series]
+    index = np.repeat(np.arange(len(series), dtype=np.int32), lengths)
+    timestamps = np.concatenate([np.asarray(t, dtype=np.int64) for _, t, _ in series] or [np.empty(0, np.int64)])
+    values = np.concatenate([np.asarray(v, dtype=np.float64) for _, _, v in series] or [np.empty(0)])
+    if output == 'arrow':
+        table = pa.table({'id': pa.DictionaryArray.from_arrays(index, pa.array(ids, pa.string())),
+                          'timestamp': timestamps, 'value': values})
+        return _arrow_response(table, filename)
+    records = np.empty(len(values), dtype=[('series', np.int32), ('timestamp', np.int64), ('value', np.float64)])
+    records['series'], records['timestamp'], records['value'] = index, timestamps, values
+    return _npy_response(records, filename, {'X-Series-Ids': json.dumps(ids)})
@@ -0,0 +1,62 @@
+"""
+test_blocking.py: Checks that the async endpoints run their blocking work on the executor, so a long-running request
+doesn't delay the fast requests served next to it.
+"""
+
+__author__ = "Tim Rietdijk"
+__email__ = "tim.is@live.nl"
+__status__ = "Development"
+
+# standard imports:
+import asyncio
+import importlib
+import sys
+import time
+from pathlib import Path
+
+# third-party imports:
+import httpx
+import numpy as np
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+SLOW_READ_SECONDS = 2.0
+# main.py reads these from the .env file when it is imported, the IMERG tile databases are left unconfigured.
+SECRETS = ['AMAZON_S3_AWS_ACCESS_KEY_ID', 'AMAZON_S3_AWS_SECRET_ACCESS_KEY', 'MET_FROST_CLIENT_ID',
+           *[f'PIPELIFE_{user}_{key}' for user in ('PIPELIFE', 'BANENOR', 'KRISTIANSAND', 'svv')
+             for key in ('CLIENT_ID', 'SECRET', 'USER', 'PASSWORD')]]
+
+
+@pytest.fixture
+def main(tmp_path, monkeypatch):
+    (tmp_path / '.env').write_text(''.join(f'{key}=test\n' for key in SECRETS))
+    monkeypatch.chdir(tmp_path)
+    module = importlib.import_module('main')
+    yield module
+    module.blocking_executor.close()
+
+
+def test_slow_read_does_not_delay_fast_requests(main, monkeypatch):
+    def slow_read(point_wkt, crs, date_range, aggregation, scheduler):
+        time.sleep(SLOW_READ_SECONDS)
+        return np.zeros(24)
+
+    monkeypatch.setattr(main, 'read_imerg_point', slow_read)
+
+    async def requests() -> tuple[httpx.Response, httpx.Response, float]:
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=main.app), base_url='http://test') as client:
+            slow = asyncio.create_task(client.get('/IMERG/point/precipitation',
+                                                  params={'point_wkt': 'POINT (10 60)', 'date_range':
+                                                          '2020-01-01/2020-01-01', 'output': 'npy'}))
+            await asyncio.sleep(0.2)
+            start = time.perf_counter()
+            fast = await client.get('/IMERG/point/climatology', params={'point_wkt': 'POINT (10 60)'})
+            elapsed = time.perf_counter() - start
+            assert not slow.done()
+            return await slow, fast, elapsed
+
+    slow, fast, elapsed = asyncio.run(requests())
+    assert slow.status_code == 200
+    assert fast.status_code == 503
+    assert elapsed < SLOW_READ_SECONDS / 2
@@ -0,0 +1,134 @@
+"""
+upstream.py: Contains the class 'UpstreamClient' which sends the requests of every upstream API: FROST, NVE HydAPI,
+telecontrolnet (PipeLife) and locationforecast.
+
+A bare requests.get opens a new connection for every call, so every call pays a TCP and TLS handshake and a single
+PipeLife request pays dozens of them. All upstream modules share the client here instead. It keeps a pool of
+keep-alive connections per host, uses HTTP/2 when the h2 package is installed and the host supports it, and asks for
+gzip compressed responses. Idempotent requests that fail to connect or get a 429/502/503/504 are retried with
+exponential backoff, a Retry-After longer than the read timeout isn't waited for. Timeouts and retries are set with
+UPSTREAM_TIMEOUT, UPSTREAM_CONNECT_TIMEOUT and UPSTREAM_RETRIES.
+"""
+
+__author__ = "Tim Rietdijk"
+__email__ = "tim.is@live.nl"
+__status__ = "Development"
+
+# standard imports:
+import threading
+import time
+from typing import Any
+
+# third-party imports:
+import httpx
+from dotenv import dotenv_values
+
+try:
+    import h2  # noqa: F401
+    HTTP2 = True
+except ImportError:
+    HTTP2 = False
+
+RETRY_STATUSES = frozenset({429, 502, 503, 504})
+RETRY_METHODS = frozenset({'GET', 'HEAD'})
+
+
+class UpstreamClient:
+    def __init__(self, timeout: float = 60, connect_timeout: float = 10, retries: int = 3, backoff: float = 0.5,
+                 max_connections: int = 100, max_keepalive_connections: int = 20,
+                 keepalive_expiry: float = 60) -> None:
+        """
+        The HTTP client shared by all upstream modules of a worker, created on first use. Async endpoints use it from
+        the threads of the blocking executor.
+
+        :param timeout: Seconds to wait for a response (read, write and pool).
+        :param connect_timeout: Seconds to wait for a connection.
+        :param retries: Number of times a failed idempotent request is retried. A response asking to retry after more
+        than timeout seconds is returned instead.
+        :param backoff: Seconds before the first retry, doubled for every next retry.
+        :param max_connections: Maximum number of open connections.
+        :param max_keepalive_connections: Maximum number of idle connections kept open.
+        :param keepalive_expiry: Seconds an idle connection is kept open.
+        """
+        self.retries = retries
+        self.backoff = backoff
+        self.max_retry_delay = timeout
+        self._options = {'timeout': httpx.Timeout(timeout, connect=connect_timeout),
+                         'limits': httpx.Limits(max_connections=max_connections,
+                                                max_keepalive_connections=max_keepalive_connections,
+                                                keepalive_expiry=keepalive_expiry),
+                         'http2': HTTP2, 'follow_redirects': True, 'headers': {'Accept-Encoding': 'gzip, deflate'}}
+        self._client: httpx.Client | None = None
+        self._lock = threading.Lock()
+
+    @property
+    def client(self) -> httpx.Client:
+        with self._lock:
+            if self._client is None:
+                self._client = httpx.Client(**self._options)
+            return self._client
+
+    def _retry_delay(self, method: str, attempt: int, response: httpx.Response | None) -> float | None:
+        """
+        Decides whether a request is sent again.
+
+        :param method: HTTP method of the request.
+        :param attempt: Number of retries done so far.
+        :param response: The response, or None if the request failed before a response came.
+        :return: Seconds to wait before the retry, or None if the request isn't retried.
+        """
+        if method.upper() not in RETRY_METHODS or attempt >= self.retries:
+            return None
+        if response is None:
+            return self.backoff * 2 ** attempt
+        if response.status_code not in RETRY_STATUSES:
+            return None
+        retry_after = response.headers.get('Retry-After', '')
+        if not retry_after.isdigit():
+            return self.backoff * 2 ** attempt
+        return float(retry_after) if float(retry_after) <= self.max_retry_delay else None
+
+    def request(self, method: str, url: str, **kwargs) -> httpx.Response:
+        """
+        Sends a request on the shared blocking client.
+
+        :param method: HTTP method.
+        :param url: Url of the request.
+        :param kwargs: Arguments of httpx.Client.request (params, data, json, headers, auth, ...).
+        :return: The response.
+        """
+        for attempt in range(self.retries + 1):
+            try:
+                response = self.client.request(method, url, **kwargs)
+            except httpx.TransportError:
+                delay = self._retry_delay(method, attempt, None)
+                if delay is None:
+                    raise
+            else:
+                delay = self._retry_delay(method, attempt, response)
+                if delay is None:
+                    return response
+            time.sleep(delay)
+
+    def get(self, url: str, params: Any = None, **kwargs) -> httpx.Response:
+        return self.request('GET', url, params=params, **kwargs)
+
+    def post(self, url: str, data: Any = None, **kwargs) -> httpx.Response:
+        return self.request('POST', url, data=data, **kwargs)
+
+    def close(self) -> None:
+        """
+        Closes the client and its connections.
+
+        :return: None
+        """
+        with self._lock:
+            if self._client is not None:
+                self._client.close()
+                self._client = None
+
+
+secrets = dotenv_values('.env')
+upstream = UpstreamClient(timeout=float(secrets.get('UPSTREAM_TIMEOUT') or 60),
+                          connect_timeout=float(secrets.get('UPSTREAM_CONNECT_TIMEOUT') or 10),
+                          retries=int(secrets.get('UPSTREAM_RETRIES') or 3))